@@ -1,13 +1,48 @@
 from flask import Flask, Blueprint, request, jsonify
 from dotenv import load_dotenv
 import os
+import click
 from datetime import timedelta
-from backend.controllers import watchlist, auth, strategy, syncdata, order, tradesmenu, review
+from backend.controllers import watchlist, auth, strategy, syncdata, order, tradesmenu, review, metrics, export, stream, candles
 from backend.utilities import log_error
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from werkzeug.exceptions import BadRequest
-from backend.db.db import connect_to_db
+from backend.db.db import get_connection
+from backend.services.sync_worker import start_sync_thread
+from backend.services.pricing import start_pricing_thread
+from backend.services.strategy_host import strategy_hosts, stop_all_hosted_strategies
+
+
+def is_serving():
+    """
+    False while a flask command other than flask run loads the app, e.g. flask syncdata replay or
+    flask candles backfill, which must not reset strategies or start background threads
+    """
+    # the flask CLI sets this for every command, flask run included
+    if os.environ.get('FLASK_RUN_FROM_CLI') != 'true':
+        return True
+    ctx = click.get_current_context(silent=True)
+    return ctx is not None and ctx.command.name == 'run'
+
+
+def start_background_services():
+    """What the API does when it starts serving: resets strategies left over from its last run, starts the sync
+    and pricing threads"""
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("UPDATE active_strategies_trades SET is_active = FALSE, pid = NULL")
+    # strategy hosts outlive the API, stop what they still run so it matches the reset above
+    if strategy_hosts:
+        stop_all_hosted_strategies()
+
+    # Keep the database in sync with OANDA in the background. Set OANDA_SYNC_WORKER=process when running
+    # python -m backend.services.sync_worker separately, e.g. behind several API workers.
+    if os.environ.get('OANDA_SYNC_WORKER', 'thread') == 'thread':
+        start_sync_thread()
+    # Mark open trades to market from the OANDA price stream between syncs. Set PRICING_STREAM=process when
+    # running python -m backend.services.pricing separately.
+    if os.environ.get('PRICING_STREAM', 'off') == 'thread':
+        start_pricing_thread()
 
 
 def create_app():
@@ -18,6 +53,7 @@ def create_app():
         "allow_headers": [
             "Content-Type", "Authorization", "Access-Control-Allow-Credentials"
         ],
+        "expose_headers": ["X-Data-Synced-At", "X-Data-Age", "X-Data-Sync", "ETag"],
         "supports_credentials": True,
         "methods": ["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"]
     }})
@@ -39,6 +75,10 @@ def create_app():
     app.register_blueprint(order.order_bp)
     app.register_blueprint(tradesmenu.trades_menu_bp)
     app.register_blueprint(review.review_trader_bp)
+    app.register_blueprint(metrics.metrics_bp)
+    app.register_blueprint(export.export_bp)
+    app.register_blueprint(stream.stream_bp)
+    app.register_blueprint(candles.candles_bp)
 
     @app.errorhandler(BadRequest)
     def handle_bad_request(e):
@@ -51,11 +91,8 @@ def create_app():
         log_error(f'Server Error: {e}')
         return jsonify({'status': 'error', 'msg': 'An error has occurred'}), 500
 
-    conn = connect_to_db()
-    with conn.cursor() as cur:
-        cur.execute("UPDATE active_strategies_trades SET is_active = FALSE, pid = NULL")
-        conn.commit()
-    conn.close()
+    if is_serving():
+        start_background_services()
 
     return app
 
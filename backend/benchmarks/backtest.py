@@ -0,0 +1,47 @@
+import argparse
+import time
+import numpy
+from backend.strategy.backtest import Market
+from backend.scripts.breakout import generate_signals
+
+# Throughput of the vectorised backtest on a random walk, with the breakout example's signals:
+#     python -m backend.benchmarks.backtest --bars 5000000
+# Building the Market (its stop loss / take profit indexes) happens once per history and is timed separately
+# from generating signals and simulating them, which a parameter sweep repeats.
+
+
+def random_walk(bars, seed=1):
+    generator = numpy.random.default_rng(seed)
+    closes = 1.1 + numpy.cumsum(generator.normal(0, 0.0005, bars))
+    opens = numpy.concatenate(([closes[0]], closes[:-1]))
+    return {
+        'time': 1_600_000_000 + 60 * numpy.arange(bars, dtype=numpy.int64),
+        'open': opens,
+        'high': numpy.maximum(opens, closes) + generator.uniform(0, 0.0004, bars),
+        'low': numpy.minimum(opens, closes) - generator.uniform(0, 0.0004, bars),
+        'close': closes,
+        'volume': generator.integers(1, 500, bars),
+    }
+
+
+def main(bars, lookback):
+    candles = random_walk(bars)
+    started_at = time.perf_counter()
+    market = Market(candles, 'EUR_USD', spread=0.0001)
+    built_at = time.perf_counter()
+    units, stop_loss, take_profit = generate_signals(market.candles, lookback=lookback)
+    signalled_at = time.perf_counter()
+    result = market.backtest(units, stop_loss, take_profit)
+    finished_at = time.perf_counter()
+    print(f'{bars} bars, {numpy.count_nonzero(units)} orders, {len(result.trades["units"])} trades')
+    for name, seconds in (('market', built_at - started_at), ('signals', signalled_at - built_at),
+                          ('simulation', finished_at - signalled_at), ('signals + simulation', finished_at - built_at)):
+        print(f'{name:<22} {seconds * 1000:9.1f} ms   {bars / seconds / 1e6:8.2f} M bars/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bars per second of the vectorised backtest')
+    parser.add_argument('--bars', type=int, default=5_000_000)
+    parser.add_argument('--lookback', type=int, default=20)
+    arguments = parser.parse_args()
+    main(arguments.bars, arguments.lookback)
@@ -0,0 +1,105 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from backend.services.strategy_launcher import launch_with_launcher
+
+# Start-to-first-order latency of a strategy, cold (python script.py instrument, as start_strategy did) against
+# forked from the warm strategy launcher:
+#     python -m backend.benchmarks.strategy_start --runs 20
+# The benchmark strategy does what the bundled scripts do before their first order (import asyncio / httpx /
+# dotenv and the market data client, load .env) and then "places" its order by writing the time to a file, so
+# the numbers exclude OANDA and the API but include everything a start pays for.
+
+BENCHMARK_STRATEGY = """
+import asyncio
+import os
+import sys
+import time
+import httpx
+from dotenv import load_dotenv
+from backend.services.market_data_client import fetch_latest_candles
+
+load_dotenv()
+
+
+async def create_market_order_oanda(instrument_name):
+    with open(os.path.join({directory!r}, instrument_name), 'w') as f:
+        f.write(repr(time.time()))
+
+
+if __name__ == '__main__':
+    asyncio.run(create_market_order_oanda(sys.argv[1]))
+"""
+
+
+def wait_for_order(path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            with open(path) as f:
+                content = f.read()
+            if content:
+                return float(content)
+        time.sleep(0.001)
+    raise TimeoutError(f'no order after {timeout}s')
+
+
+def measure(start, directory, runs):
+    latencies = []
+    for _ in range(runs):
+        order_path = os.path.join(directory, f'{start.__name__}_{time.monotonic_ns()}')
+        started_at = time.time()
+        start(order_path)
+        latencies.append(wait_for_order(order_path) - started_at)
+    return latencies
+
+
+def summarise(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f'{name:<10} median {statistics.median(latencies) * 1000:8.1f} ms   p95 {p95 * 1000:8.1f} ms   '
+          f'min {latencies[0] * 1000:8.1f} ms')
+
+
+def main(runs):
+    repository_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = {**os.environ, 'PYTHONPATH': repository_root}
+    with tempfile.TemporaryDirectory() as directory:
+        script_path = os.path.join(directory, 'benchmark_strategy.py')
+        with open(script_path, 'w') as f:
+            f.write(BENCHMARK_STRATEGY.format(directory=directory))
+        socket_path = os.path.join(directory, 'launcher.sock')
+        launcher = subprocess.Popen([sys.executable, '-m', 'backend.services.strategy_launcher', socket_path],
+                                    cwd=repository_root, env=env)
+        children = []
+        try:
+            while not os.path.exists(socket_path):
+                time.sleep(0.01)
+
+            def cold(order_path):
+                children.append(subprocess.Popen([sys.executable, script_path, os.path.basename(order_path)],
+                                                 cwd=repository_root, env=env))
+
+            def forked(order_path):
+                launch_with_launcher(script_path, os.path.basename(order_path), socket_path)
+
+            # one untimed start each so both sides read the files from the page cache
+            measure(cold, directory, 1)
+            measure(forked, directory, 1)
+            summarise('cold', measure(cold, directory, runs))
+            summarise('launcher', measure(forked, directory, runs))
+        finally:
+            for child in children:
+                child.wait()
+            launcher.terminate()
+            launcher.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Start-to-first-order latency with and without the strategy launcher')
+    parser.add_argument('--runs', type=int, default=20)
+    main(parser.parse_args().runs)
@@ -3,7 +3,7 @@ import uuid
 from flask import Blueprint, request, jsonify
 import bcrypt
 from backend.utilities import log_info, log_warning, log_error
-from backend.db.db import connect_to_db
+from backend.db.db import get_connection
 from dotenv import load_dotenv
 from flask_jwt_extended import create_access_token, create_refresh_token, get_jwt_identity, jwt_required, get_jwt
 
@@ -41,7 +41,6 @@ def check_password(input_password, db_hash):
 
 def allocate_cash(trader_id, add_balance=1000):
     # write sql statement to get unallocated capital
-    conn = None
     try:
         print(trader_id)
         print(add_balance)
@@ -49,8 +48,7 @@ def allocate_cash(trader_id, add_balance=1000):
             raise TypeError("Trader ID must be an integer")
         if not isinstance(add_balance, (float, int)):
             raise TypeError("add_balance must be a number")
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             cur.execute("SELECT balance FROM cash_balances WHERE trader_id = %s", (trader_id,))
             if cur.fetchone() is None:
                 raise Exception(f"user id {trader_id} not found")
@@ -94,11 +92,6 @@ def allocate_cash(trader_id, add_balance=1000):
     except Exception as e:
         print(e)
         log_error(f'something went wrong while allocating initial cash: {e}')
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
 
 
 @auth_bp.put('/register/')
@@ -118,8 +111,7 @@ def register():
         # check db for unique email & display name and valid role
         new_trader_id = None
         role_id = None
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             find_duplicates = """
             SELECT id FROM auth
             WHERE display_name = %s OR email = %s
@@ -172,8 +164,7 @@ def login():
         data = request.json
         email = data['email']
         input_password = data['password']
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             get_hash = """
             SELECT auth.id AS user_id, auth.password_hash, user_roles.role_name AS role_name, auth.display_name AS display_name, auth.account_disabled
             FROM auth
@@ -237,8 +228,7 @@ def check_email():
     try:
         data = request.json
         email = data['email']
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             find_existing_email = """
             SELECT LOWER(email)
             FROM auth
@@ -262,8 +252,7 @@ def check_name():
     try:
         data = request.json
         name = data['display_name']
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             find_existing_email = """
             SELECT LOWER(display_name)
             FROM auth
@@ -285,8 +274,7 @@ def check_name():
 @auth_bp.route('/roles/')
 def fetch_roles():
     try:
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             find_existing_role = """
             SELECT role_name
             FROM user_roles
@@ -0,0 +1,95 @@
+import datetime
+import click
+from flask import Blueprint, request, jsonify, Response
+from flask_jwt_extended import jwt_required
+from backend.utilities import log_error
+from backend.services.candle_hub import get_series, watch_series, CandleFetchError
+from backend.services.candle_store import backfill, read_candles
+from backend.services.push_hub import format_event, heartbeat, push_heartbeat_interval
+
+candles_bp = Blueprint('candles', __name__, url_prefix='/api/candles')
+
+
+def get_candle_args(args):
+    granularity = args.get('granularity', 'H1')
+    try:
+        count = int(args.get('count', 500))
+    except ValueError:
+        raise ValueError('count must be a positive integer')
+    return granularity, count
+
+
+@candles_bp.get('/<instrument>/')
+@jwt_required()
+def get_candles(instrument):
+    """
+    Mid candles of an instrument, oldest first, in OANDA's candles format. The last candle may still be forming.
+    granularity:    OANDA granularity, e.g. M5, H1, D (default H1)
+    count:          number of candles, at most 5000 (default 500)
+    """
+    try:
+        granularity, count = get_candle_args(request.args)
+        series = get_series(instrument, granularity, count)
+        return jsonify({'instrument': instrument, 'granularity': granularity, 'candles': series.tail(count)}), 200
+    except ValueError as e:
+        return jsonify({'status': 'error', 'msg': str(e)}), 400
+    except CandleFetchError as e:
+        log_error(f'an error has occurred while fetching candles: {str(e)}')
+        return jsonify({'status': 'error', 'msg': 'unable to fetch candles'}), 502
+    except Exception as e:
+        log_error(f'an error has occurred while fetching candles: {str(e)}')
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
+
+
+def candle_events(instrument, granularity, count):
+    series = get_series(instrument, granularity, count)
+    version = series.version
+    candles = series.tail(count)
+    yield format_event('candles', {'candles': candles})
+    last_time = candles[-1]['time'] if candles else None
+    while True:
+        series = watch_series(instrument, granularity, version, push_heartbeat_interval)
+        if series is None:
+            yield heartbeat()
+            continue
+        version = series.version
+        changed = series.changed_since(last_time)
+        if changed:
+            yield format_event('candles', {'candles': changed})
+            last_time = changed[-1]['time']
+
+
+@candles_bp.get('/<instrument>/stream/')
+@jwt_required(locations=['headers', 'query_string'])
+def stream_candles(instrument):
+    """
+    Server-sent 'candles' events, access token as ?jwt=<token>. The first event carries count candles, later
+    ones the last candle the client already has (which may have moved) and any newer ones. Merge them by time.
+    """
+    try:
+        granularity, count = get_candle_args(request.args)
+        # validate and warm the series before committing to a stream
+        get_series(instrument, granularity, count)
+        return Response(candle_events(instrument, granularity, count), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'msg': str(e)}), 400
+    except CandleFetchError as e:
+        log_error(f'an error has occurred while opening the candle stream: {str(e)}')
+        return jsonify({'status': 'error', 'msg': 'unable to fetch candles'}), 502
+    except Exception as e:
+        log_error(f'an error has occurred while opening the candle stream: {str(e)}')
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
+
+
+@candles_bp.cli.command('backfill')
+@click.argument('instrument')
+@click.argument('granularities', nargs=-1, required=True)
+@click.option('--since', type=click.DateTime(), default=None, help='Where an empty series starts, UTC')
+def backfill_command(instrument, granularities, since):
+    """Store the candles missing since the last stored one: flask candles backfill EUR_USD M5 H1"""
+    for granularity in granularities:
+        added = backfill(instrument, granularity, since)
+        times = read_candles(instrument, granularity)['time']
+        last_time = datetime.datetime.fromtimestamp(int(times[-1]), datetime.timezone.utc) if len(times) else None
+        print(f'{instrument} {granularity}: added {added}, {len(times)} stored, last {last_time}')
@@ -0,0 +1,120 @@
+import datetime
+import os
+from flask import Blueprint, request, jsonify, Response
+from dotenv import load_dotenv
+from flask_jwt_extended import jwt_required, get_jwt
+from backend.utilities import log_info, log_error
+from backend.db.db import connect_to_db
+from backend.services.export_writer import encode_csv, encode_parquet, gzip_chunks, parquet_available
+
+load_dotenv()
+# rows fetched from the server-side cursor per round trip, and rows per CSV chunk / Parquet row group
+export_batch_size = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+
+export_bp = Blueprint('export', __name__, url_prefix='/api/export')
+
+# dataset name: (query, column types). Column names come from the query, the types map to Parquet types in
+# export_writer.get_arrow_type. Every query takes trader_id, NULL exports the whole desk.
+EXPORTS = {
+    'trades': ("""
+        SELECT id, user_id, strategy_id, transaction_id, instrument, state_id, open_time, close_time,
+               initial_units, current_units, price, realized_pl, financing, unrealized_pl, margin_used, update_time
+        FROM trades
+        WHERE (%(trader_id)s::integer IS NULL OR user_id = %(trader_id)s)
+        ORDER BY id
+        """,
+               ('integer', 'integer', 'integer', 'text', 'text', 'integer', 'timestamp', 'timestamp',
+                'numeric', 'numeric', 'numeric', 'numeric', 'numeric', 'numeric', 'numeric', 'timestamp')),
+    'trade_audit': ("""
+        SELECT trade_id, user_id, net_realized_pl, close_time
+        FROM trade_audit
+        WHERE (%(trader_id)s::integer IS NULL OR user_id = %(trader_id)s)
+        ORDER BY trade_id
+        """,
+                    ('integer', 'integer', 'numeric', 'timestamp')),
+    'cash_balances': ("""
+        SELECT id, trader_id, description, balance, nav, margin_used, margin_available, initial_balance,
+               last_update, CURRENT_TIMESTAMP AS snapshot_time
+        FROM cash_balances
+        WHERE (%(trader_id)s::integer IS NULL OR trader_id = %(trader_id)s)
+        ORDER BY id
+        """,
+                      ('integer', 'integer', 'text', 'numeric', 'numeric', 'numeric', 'numeric', 'numeric',
+                       'timestamp', 'timestamp')),
+}
+
+
+def stream_export(dataset, trader_id, export_format, compress):
+    """
+    Generator for the response body. Rows come from a named (server-side) cursor on a dedicated connection,
+    so neither Postgres nor Flask materialises the whole export, and a slow download does not hold a pooled
+    connection.
+    """
+    query, column_types = EXPORTS[dataset]
+    conn = connect_to_db()
+    try:
+        with conn.transaction(), conn.cursor(name=f'export_{dataset}') as cur:
+            cur.itersize = export_batch_size
+            cur.execute(query, {'trader_id': trader_id})
+            columns = [column.name for column in cur.description]
+            # fetchmany returns an empty list once the cursor is exhausted
+            batches = iter(lambda: cur.fetchmany(export_batch_size), [])
+            if export_format == 'parquet':
+                chunks = encode_parquet(columns, column_types, batches)
+            else:
+                chunks = encode_csv(columns, batches)
+            yield from (gzip_chunks(chunks) if compress else chunks)
+    except Exception as e:
+        log_error(f'export of {dataset} failed midway: {str(e)}', 'stream_export')
+        raise
+    finally:
+        conn.close()
+
+
+@export_bp.get('/<dataset>/')
+@jwt_required()
+def export_dataset(dataset):
+    """
+    Streams a whole table as a file download.
+    dataset:        trades | trade_audit | cash_balances
+    format:         csv (default) | parquet (needs pyarrow)
+    gzip:           1 / true to gzip the file
+    trader_id:      export a single trader. Managers may leave it out for a desk-wide export,
+                    traders can only export their own records.
+    """
+    try:
+        claims = get_jwt()
+        if dataset not in EXPORTS:
+            return jsonify({'status': 'error', 'msg': 'unknown dataset'}), 404
+        export_format = request.args.get('format', 'csv')
+        if export_format not in ('csv', 'parquet'):
+            return jsonify({'status': 'error', 'msg': 'format must be csv or parquet'}), 400
+        if export_format == 'parquet' and not parquet_available():
+            return jsonify({'status': 'error', 'msg': 'parquet export needs pyarrow installed on the server'}), 501
+        compress = request.args.get('gzip', '').lower() in ('1', 'true')
+        trader_id = request.args.get('trader_id')
+        try:
+            trader_id = int(trader_id) if trader_id else None
+        except ValueError:
+            return jsonify({'status': 'error', 'msg': 'trader_id must be a positive integer'}), 400
+        if claims['role'] == 'Trader':
+            if trader_id not in (None, claims['id']):
+                return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+            trader_id = claims['id']
+        elif not claims['role'] == 'Manager':
+            return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+
+        scope = f'trader_{trader_id}' if trader_id else 'desk'
+        filename = f"{dataset}_{scope}_{datetime.date.today().strftime('%y%m%d')}.{export_format}"
+        mimetype = 'text/csv' if export_format == 'csv' else 'application/vnd.apache.parquet'
+        if compress:
+            filename += '.gz'
+            mimetype = 'application/gzip'
+        log_info(f'exporting {filename} for user {claims["id"]}')
+        return Response(stream_export(dataset, trader_id, export_format, compress), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    except KeyError:
+        return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+    except Exception as e:
+        log_error(f'an error has occurred while exporting {dataset}: {str(e)}')
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
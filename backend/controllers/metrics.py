@@ -0,0 +1,47 @@
+from flask import Blueprint, jsonify
+from flask_jwt_extended import jwt_required, get_jwt
+from backend.utilities import log_error
+from backend.db.db import get_pool_metrics
+from backend.services.response_cache import response_cache
+from backend.services.candle_hub import get_candle_hub_metrics
+
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/api/metrics')
+
+
+@metrics_bp.get('/db/')
+@jwt_required()
+def get_db_pool_metrics():
+    try:
+        claims = get_jwt()
+        if not claims['role'] == 'Manager':
+            return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+        return jsonify({'pool': get_pool_metrics()}), 200
+    except Exception as e:
+        log_error(f'an error has occurred while reading pool metrics: {str(e)}')
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
+
+
+@metrics_bp.get('/cache/')
+@jwt_required()
+def get_response_cache_metrics():
+    try:
+        claims = get_jwt()
+        if not claims['role'] == 'Manager':
+            return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+        return jsonify({'response_cache': response_cache.stats()}), 200
+    except Exception as e:
+        log_error(f'an error has occurred while reading cache metrics: {str(e)}')
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
+
+
+@metrics_bp.get('/candles/')
+@jwt_required()
+def get_candle_cache_metrics():
+    try:
+        claims = get_jwt()
+        if not claims['role'] == 'Manager':
+            return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+        return jsonify({'candle_hub': get_candle_hub_metrics()}), 200
+    except Exception as e:
+        log_error(f'an error has occurred while reading candle metrics: {str(e)}')
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
@@ -3,7 +3,7 @@ from dotenv import load_dotenv
 import os, requests
 from flask_jwt_extended import jwt_required, get_jwt
 from backend.utilities import log_info, log_error, log_warning
-from backend.db.db import connect_to_db
+from backend.db.db import get_connection
 
 load_dotenv()
 oanda_platform = os.environ.get('OANDA_PLATFORM')
@@ -45,8 +45,7 @@ def create_market_order_oanda():
             log_error(f'instrument parameter has to be a string'), 400
             return jsonify({'status': 'error', 'msg': 'instrument parameter has to be a string'}), 400
 
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             get_script_path_by_trader = """
             SELECT id, script_path FROM strategies WHERE owner_id = %s"""
             cur.execute(get_script_path_by_trader, (trader_id,))
@@ -100,8 +99,7 @@ def create_market_order_oanda():
                 # else, check if order is created and log it
                 try:
                     order_id = response_data['orderCreateTransaction']['id']
-                    conn = connect_to_db()
-                    with conn.cursor() as cur:
+                    with get_connection() as conn, conn.cursor() as cur:
                         insert_unfilled_order = """INSERT INTO orders (trader_id, order_id) VALUES (%s, %s)"""
                         cur.execute(insert_unfilled_order, (trader_id, order_id))
                     return jsonify({'status': 'ok', 'msg': 'order created'}), 201
@@ -132,8 +130,7 @@ def cancel_all_trades_by_trader_oanda():
             user_id = int(data['id'])
         except ValueError:
             return jsonify({'status': 'error', 'msg': 'ID must be a positive integer'}), 400
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             get_role_of_user = """
                                 SELECT u.role_name
                                 FROM auth a
@@ -149,20 +146,21 @@ def cancel_all_trades_by_trader_oanda():
                 return jsonify({'status': 'error', 'msg': "unauthorized"}), 401
             cur.execute("SELECT transaction_id FROM trades WHERE state_id != 3 AND user_id = %s", (user_id,))
             trade_ids = cur.fetchall()
-            for trade_id in trade_ids:
-                endpoint = f"{oanda_platform}/v3/accounts/{oanda_account}/trades/{trade_id[0]}/close"
-                headers = {'Authorization': f'Bearer {oanda_API_key}', 'Connection': 'keep-alive'}
-                data = {
-                    'order': 'ALL'
-                }
-                response = requests.post(endpoint, headers=headers, json=data)
-                # capture response data
-                response_data = None
-                if response.status_code == 200:
-                    pass
-                else:
-                    log_error(f'Failed to cancel order #{trade_id[0]}: {response.status_code} {response.text}')
-                    # return False
+        # don't hold a pooled connection while waiting on OANDA
+        for trade_id in trade_ids:
+            endpoint = f"{oanda_platform}/v3/accounts/{oanda_account}/trades/{trade_id[0]}/close"
+            headers = {'Authorization': f'Bearer {oanda_API_key}', 'Connection': 'keep-alive'}
+            data = {
+                'order': 'ALL'
+            }
+            response = requests.post(endpoint, headers=headers, json=data)
+            # capture response data
+            response_data = None
+            if response.status_code == 200:
+                pass
+            else:
+                log_error(f'Failed to cancel order #{trade_id[0]}: {response.status_code} {response.text}')
+                # return False
         # return True
         return jsonify({'status': 'ok', 'msg': f'{len(trade_ids)} trades cancelled'}), 200
     except KeyError:
@@ -173,7 +171,6 @@ def cancel_all_trades_by_trader_oanda():
 
 
 def cancel_trade_by_trade_id(trade_id):
-    conn = None
     try:
         endpoint = f"{oanda_platform}/v3/accounts/{oanda_account}/trades/{trade_id}/close"
         headers = {'Authorization': f'Bearer {oanda_API_key}', 'Connection': 'keep-alive'}
@@ -182,30 +179,12 @@ def cancel_trade_by_trade_id(trade_id):
         }
         response = requests.put(endpoint, headers=headers, json=data)
         if response.status_code == 200:
-            conn = connect_to_db()
-            with conn.cursor() as cur:
-                get_pid = """
-                SELECT a.pid FROM active_strategies_trades a 
-                JOIN trades t ON a.trade_id = t.id 
-                WHERE a.trade_id = %s
-                """
-                cur.execute(get_pid, (trade_id,))
-                pid = cur.fetchone()
-                if pid:
-                    pid = pid[0]
-                    cur.execute("UPDATE active_strategies_trades SET pid = NULL WHERE pid = %s", (pid,))
-                    conn.commit()
-
+            # the caller owns the active_strategies_trades row: stop_strategy deletes it once the trade is closed
             return True
         else:
-            log_error(f'Failed to cancel order #{trade_id[0]}: {response.status_code} {response.text}')
+            log_error(f'Failed to cancel order #{trade_id}: {response.status_code} {response.text}')
 
             return False
     except Exception as e:
         log_error(f'Failed to cancel order #{trade_id}: {e}')
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
 
@@ -3,10 +3,11 @@ from dotenv import load_dotenv
 import os
 from flask_jwt_extended import jwt_required, get_jwt
 from backend.utilities import log_info, log_error, log_warning
-from backend.db.db import connect_to_db, connect_to_db_dict_response
-from backend.controllers.syncdata import sync_with_oanda
+from backend.db.db import get_connection
+from backend.controllers.syncdata import run_sync, sync_if_requested, add_sync_headers, bump_data_version
 
 review_trader_bp = Blueprint('review_trader', __name__, url_prefix='/api/review')
+review_trader_bp.after_request(add_sync_headers)
 
 load_dotenv()
 
@@ -18,59 +19,60 @@ def get_traders_performance():
         claims = get_jwt()
         if not claims['role'] == 'Manager':
             return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
-        sync_with_oanda()
-        conn = connect_to_db_dict_response()
-        with conn.cursor() as cur:
+        sync_if_requested()
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+            # Realized P&L comes from the daily rollups the sync maintains, unrealized P&L from the open trades
+            # only, so the cost of the report does not grow with the length of the trade history.
             traders_performance = """
+            WITH realized AS (
+                SELECT
+                    user_id,
+                    SUM(net_realized_pl) FILTER (WHERE trade_date >= CURRENT_DATE - 1) AS yesterday_net_realized_pl,
+                    SUM(net_realized_pl) FILTER (WHERE trade_date >= CURRENT_DATE - 7) AS last_7_days_net_realized_pl,
+                    SUM(net_realized_pl) FILTER (WHERE trade_date >= CURRENT_DATE - 30) AS last_30_days_net_realized_pl,
+                    SUM(net_realized_pl) FILTER (WHERE trade_date >= DATE_TRUNC('year', CURRENT_DATE)) AS ytd_net_realized_pl,
+                    SUM(trades_closed) FILTER (WHERE trade_date >= CURRENT_DATE - 1) AS yesterday_trades_closed,
+                    SUM(trades_closed) FILTER (WHERE trade_date >= CURRENT_DATE - 7) AS last_7_days_trades_closed,
+                    SUM(trades_closed) FILTER (WHERE trade_date >= CURRENT_DATE - 30) AS last_30_days_trades_closed,
+                    SUM(trades_closed) FILTER (WHERE trade_date >= DATE_TRUNC('year', CURRENT_DATE)) AS ytd_trades_closed
+                FROM trader_daily_pnl
+                WHERE trade_date >= LEAST(CURRENT_DATE - 30, DATE_TRUNC('year', CURRENT_DATE)::date)
+                  AND trade_date < CURRENT_DATE
+                GROUP BY user_id
+            ), unrealized AS (
+                SELECT
+                    user_id,
+                    SUM(unrealized_pl) FILTER (WHERE open_time >= CURRENT_DATE - INTERVAL '1 day') AS yesterday_unrealized_pl,
+                    SUM(unrealized_pl) FILTER (WHERE open_time >= CURRENT_DATE - INTERVAL '7 days') AS last_7_days_unrealized_pl,
+                    SUM(unrealized_pl) FILTER (WHERE open_time >= CURRENT_DATE - INTERVAL '30 days') AS last_30_days_unrealized_pl,
+                    SUM(unrealized_pl) FILTER (WHERE open_time >= DATE_TRUNC('year', CURRENT_DATE)) AS ytd_unrealized_pl
+                FROM trades
+                WHERE state_id != 3
+                GROUP BY user_id
+            )
             SELECT 
                 a.id,
                 a.display_name,
                 a.email,
                 a.can_trade,
-                MAX(c.nav) as current_nav,
-                -- Yesterday's performance
-                SUM(CASE 
-                    WHEN t.close_time >= CURRENT_DATE - INTERVAL '1 day' AND t.close_time < CURRENT_DATE 
-                    THEN t.realized_pl + t.financing ELSE 0 
-                    END) AS yesterday_net_realized_pl,
-                SUM(CASE 
-                    WHEN t.open_time >= CURRENT_DATE - INTERVAL '1 day' 
-                    THEN t.unrealized_pl ELSE 0 
-                    END) AS yesterday_unrealized_pl,
-            
-                -- Last 7 days' performance
-                SUM(CASE 
-                    WHEN t.close_time >= CURRENT_DATE - INTERVAL '7 days' AND t.close_time < CURRENT_DATE 
-                    THEN t.realized_pl + t.financing ELSE 0 
-                    END) AS last_7_days_net_realized_pl,
-                SUM(CASE 
-                    WHEN t.open_time >= CURRENT_DATE - INTERVAL '7 days' 
-                    THEN t.unrealized_pl ELSE 0 
-                    END) AS last_7_days_unrealized_pl,
-            
-                -- Last 30 days' performance
-                SUM(CASE 
-                    WHEN t.close_time >= CURRENT_DATE - INTERVAL '30 days' AND t.close_time < CURRENT_DATE 
-                    THEN t.realized_pl + t.financing ELSE 0 
-                    END) AS last_30_days_net_realized_pl,
-                SUM(CASE 
-                    WHEN t.open_time >= CURRENT_DATE - INTERVAL '30 days' 
-                    THEN t.unrealized_pl ELSE 0 
-                    END) AS last_30_days_unrealized_pl,
-            
-                -- Year to date performance
-                SUM(CASE 
-                    WHEN t.close_time >= DATE_TRUNC('year', CURRENT_DATE) AND t.close_time < CURRENT_DATE
-                    THEN t.realized_pl + t.financing ELSE 0
-                    END) as ytd_net_realized_pl,
-                SUM(CASE WHEN t.open_time >= DATE_TRUNC('year', CURRENT_DATE)
-                    THEN t.unrealized_pl ELSE 0
-                    END) as ytd_unrealized_pl
+                c.nav AS current_nav,
+                COALESCE(r.yesterday_net_realized_pl, 0) AS yesterday_net_realized_pl,
+                COALESCE(u.yesterday_unrealized_pl, 0) AS yesterday_unrealized_pl,
+                COALESCE(r.yesterday_trades_closed, 0) AS yesterday_trades_closed,
+                COALESCE(r.last_7_days_net_realized_pl, 0) AS last_7_days_net_realized_pl,
+                COALESCE(u.last_7_days_unrealized_pl, 0) AS last_7_days_unrealized_pl,
+                COALESCE(r.last_7_days_trades_closed, 0) AS last_7_days_trades_closed,
+                COALESCE(r.last_30_days_net_realized_pl, 0) AS last_30_days_net_realized_pl,
+                COALESCE(u.last_30_days_unrealized_pl, 0) AS last_30_days_unrealized_pl,
+                COALESCE(r.last_30_days_trades_closed, 0) AS last_30_days_trades_closed,
+                COALESCE(r.ytd_net_realized_pl, 0) AS ytd_net_realized_pl,
+                COALESCE(u.ytd_unrealized_pl, 0) AS ytd_unrealized_pl,
+                COALESCE(r.ytd_trades_closed, 0) AS ytd_trades_closed
             FROM auth a
-            LEFT JOIN trades t ON a.id = t.user_id
-            LEFT JOIN cash_balances c ON a.id = c.trader_id
-            WHERE a.role_id = 1 AND c.trader_id IS NOT NULL AND a.account_disabled IS FALSE
-            GROUP BY a.id;
+            JOIN cash_balances c ON a.id = c.trader_id
+            LEFT JOIN realized r ON a.id = r.user_id
+            LEFT JOIN unrealized u ON a.id = u.user_id
+            WHERE a.role_id = 1 AND a.account_disabled IS FALSE;
             """
             cur.execute(traders_performance)
             performances = cur.fetchall()
@@ -85,7 +87,6 @@ def get_traders_performance():
 @review_trader_bp.patch('/toggleTrade/')
 @jwt_required()
 def toggle_ability_to_trade():
-    conn = None
     try:
         claims = get_jwt()
         data = request.json
@@ -99,8 +100,7 @@ def toggle_ability_to_trade():
         except ValueError:
             return jsonify({'status': 'error', 'msg': 'ID must be a positive integer'}), 400
         print(data)
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             get_role_of_user = """
             SELECT u.role_name
             FROM auth a
@@ -129,18 +129,12 @@ def toggle_ability_to_trade():
         return jsonify({'status': 'error', 'msg': "missing parameters"}), 400
     except Exception as e:
         log_error(f"Something went wrong when toggling trader's ability to trade: {str(e)}")
-        if conn:
-            conn.rollback()
         return jsonify({'status': 'error', 'msg': "Something went wrong when toggling trader's ability to trade"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @review_trader_bp.patch('/fire/')
 @jwt_required()
 def fire_trader():
-    conn = None
     try:
         claims = get_jwt()
         data = request.json
@@ -151,8 +145,7 @@ def fire_trader():
             user_id = int(data['id'])
         except ValueError:
             return jsonify({'status': 'error', 'msg': 'ID must be a positive integer'}), 400
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             get_role_of_user = """
                         SELECT u.role_name
                         FROM auth a
@@ -172,11 +165,16 @@ def fire_trader():
                         WHERE id = %s
                         """
             cur.execute(update_trader_ability_to_trade, (user_id,))
-            sync_with_oanda()
+            conn.commit()
+        # the trader's closed trades settle into their balance before it moves. No connection is held meanwhile,
+        # the sync takes its own
+        run_sync()
+        with get_connection() as conn, conn.cursor() as cur:
             get_trade_cash = """
                         SELECT balance
                         FROM cash_balances
                         WHERE trader_id = %s
+                        FOR UPDATE
                         """
             cur.execute(get_trade_cash, (user_id,))
             trader_balance = cur.fetchone()[0]
@@ -194,6 +192,7 @@ def fire_trader():
                                     WHERE id = 1 AND description = 'Unallocated Capital';
                                     """
             cur.execute(move_trader_cash_to_unallocated, (trader_balance,))
+            bump_data_version(cur, [user_id])
             conn.commit()
             # need to add cancel all open trades and orders
         return jsonify({'status': 'ok', 'msg': 'trader ability to trade changed successfully'}), 200
@@ -201,10 +200,5 @@ def fire_trader():
         return jsonify({'status': 'error', 'msg': "missing parameters"}), 400
     except Exception as e:
         log_error(f"Something went wrong when toggling trader's ability to trade: {str(e)}")
-        if conn:
-            conn.rollback()
         return jsonify(
             {'status': 'error', 'msg': "Something went wrong when toggling trader's ability to trade"}), 500
-    finally:
-        if conn:
-            conn.close()
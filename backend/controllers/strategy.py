@@ -5,10 +5,20 @@ import os
 from flask_jwt_extended import jwt_required, get_jwt
 from backend.utilities import log_info, log_error, log_warning, get_function_name
 from backend.controllers.order import cancel_trade_by_trade_id
-from backend.db.db import connect_to_db, connect_to_db_dict_response
+from backend.controllers.syncdata import bump_data_version
+from backend.db.db import get_connection
+from backend.services.strategy_host import strategy_hosts, start_hosted_strategy, stop_hosted_strategy, NoEntryPoint
+from backend.services.strategy_launcher import strategy_launcher, launch_with_launcher
 from werkzeug.utils import secure_filename
+from psycopg.types.json import Jsonb
+import json
+import signal
+import sys
 import threading
-from subprocess import Popen
+from subprocess import Popen, run, TimeoutExpired
+from backend.services.candle_hub import GRANULARITY_SECONDS
+from backend.strategy.backtest import backtest_timeout, parse_time
+from backend.services.optimizer import get_parameter_sets, to_datetime, METRICS, optimizer_max_runs
 
 strategy_bp = Blueprint('strategy', __name__, url_prefix='/api/strategy')
 ALLOWED_EXTENSIONS = ['py']
@@ -21,11 +31,15 @@ def allowed_file(filename):
 # Dictionary to hold information of running threads for trading scripts
 threads = {}
 processes= {}
+# pids forked by the strategy launcher, they are not children of this process
+launched_pids = set()
+# optimization run id -> (user_id, Popen) while the optimizer process is alive
+optimizations = {}
+optimizations_lock = threading.Lock()
 
 @strategy_bp.put("/create/")
 @jwt_required()
 def create_strategy():
-    conn = None
     try:
         claims = get_jwt()
         user_id = claims['id']
@@ -46,8 +60,7 @@ def create_strategy():
             return jsonify({'status': 'error', 'msg': 'All fields are required'}), 400
         if not isinstance(type, (str,)):
             return jsonify({'status': 'error', 'msg': 'type must be a string'}), 400
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             cur.execute('SELECT id FROM strategy_type WHERE type = %s', (type,))
             type_id = cur.fetchone()
         if not type_id:
@@ -65,7 +78,7 @@ def create_strategy():
         file_path = os.path.join(current_app.config['SCRIPT_FOLDER'], filename)
         relative_file_path = os.path.relpath(file_path, start=current_app.root_path)
         file.save(file_path)
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             new_strategy = """
             INSERT INTO strategies (owner_id, type, name, comments, script_path)
             VALUES (%s,%s,%s,%s,%s)
@@ -76,12 +89,7 @@ def create_strategy():
     except Exception as e:
         error_message = str(e)
         log_error(f'Error: {error_message}')
-        if conn:
-            conn.rollback()
         return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 def run_script(script_path, instrument_name):
@@ -93,10 +101,43 @@ def run_script(script_path, instrument_name):
     except Exception as e:
         log_error(f'An error has occurred: {str(e)}')
 
+def get_script_env():
+    """Scripts run from the repository root's point of view, so they can import backend.services.market_data_client"""
+    repository_root = os.path.dirname(current_app.root_path)
+    python_path = os.environ.get('PYTHONPATH')
+    return {**os.environ, 'PYTHONPATH': f'{repository_root}{os.pathsep}{python_path}' if python_path else repository_root}
+
+
+def launch_strategy(active_id, abs_script_path, instrument_name):
+    """Starts the script on a strategy host, or in its own process, and returns the pid running it"""
+    if strategy_hosts:
+        try:
+            pid = start_hosted_strategy(active_id, abs_script_path, instrument_name)
+            log_info(f'started strategy {active_id} on host pid {pid}')
+            return pid
+        except NoEntryPoint as e:
+            log_info(f'running strategy {active_id} in its own process: {str(e)}')
+        except OSError as e:
+            log_warning(f'strategy host unavailable, running strategy {active_id} in its own process: {str(e)}')
+    if strategy_launcher:
+        try:
+            pid = launch_with_launcher(abs_script_path, instrument_name)
+            launched_pids.add(pid)
+            log_info(f'forked strategy {active_id} as pid {pid}')
+            return pid
+        except OSError as e:
+            log_warning(f'strategy launcher unavailable, starting a new interpreter: {str(e)}')
+    cmd = ['python', abs_script_path, instrument_name]
+    process = Popen(cmd, env=get_script_env())
+    processes[process.pid] = process
+    log_info(f'started subprocess: {str(process.pid)}')
+    log_info(f'processes: {str(processes)}')
+    return process.pid
+
+
 @strategy_bp.post("/start/")
 @jwt_required()
 def start_strategy():
-    conn = None
     try:
         claims = get_jwt()
         user_id = claims['id']
@@ -115,8 +156,7 @@ def start_strategy():
             strategy_id = int(strategy_id)
         except ValueError:
             return jsonify({'status': 'error', 'msg': 'strategy must be a positive integer'}), 400
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             cur.execute("SELECT id, owner_id, script_path FROM strategies WHERE id= %s", (strategy_id,))
             strategy_row = cur.fetchone()
             if not strategy_row:
@@ -130,29 +170,277 @@ def start_strategy():
             script_path = strategy_row[2]
             abs_script_path = os.path.join(current_app.root_path, script_path)
 
-            cmd = ['python', abs_script_path, instrument_name]
-            process = Popen(cmd)
-            processes[process.pid] = process
-            log_info(f'started subprocess: {str(process.pid)}')
-            log_info(f'processes: {str(processes)}')
-
             insert_active_strategy = """
-                                    INSERT INTO active_strategies_trades (user_id, strategy_id, instrument, is_active, pid)
-                                    VALUES (%s, %s, %s, %s, %s)
+                                    INSERT INTO active_strategies_trades (user_id, strategy_id, instrument, is_active)
+                                    VALUES (%s, %s, %s, %s)
+                                    RETURNING id
                                     """
-            cur.execute(insert_active_strategy, (user_id, strategy_id, instrument_name, True, process.pid))
+            cur.execute(insert_active_strategy, (user_id, strategy_id, instrument_name, True))
+            active_id = cur.fetchone()[0]
+            # committed before launching: the sync attaches the script's first fill to this row, and would insert a
+            # second row if the fill arrived while the insert was still uncommitted
+            conn.commit()
+        try:
+            pid = launch_strategy(active_id, abs_script_path, instrument_name)
+        except Exception:
+            with get_connection() as conn, conn.cursor() as cur:
+                cur.execute('DELETE FROM active_strategies_trades WHERE id = %s', (active_id,))
+            raise
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("UPDATE active_strategies_trades SET pid = %s WHERE id = %s", (pid, active_id))
+            bump_data_version(cur, [user_id])
             conn.commit()
-        return jsonify({'status': 'ok', 'msg': 'Trading script started', 'pid': process.pid}), 202
+        return jsonify({'status': 'ok', 'msg': 'Trading script started', 'pid': pid}), 202
         # return jsonify({'status': 'ok', 'msg': 'Trading script started', 'thread_id': thread_id}), 202
     except Exception as e:
         log_error(f'An error has occurred: {str(e)}')
         return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
 
 
+@strategy_bp.post("/backtest/")
+@jwt_required()
+def backtest_strategy():
+    """
+    Backtests one of the trader's strategies over the candle store, backfilled from OANDA first. Body:
+    {'strategy_id', 'instrument', 'granularity' (default H1), 'start' / 'end' (optional, e.g. 2023-01-01),
+    'params' (optional, e.g. {'lookback': 30}), 'spread' (optional, price units)}
+    """
+    function_name = get_function_name()
+    try:
+        claims = get_jwt()
+        user_id = claims['id']
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            return jsonify({'status': 'error', 'msg': 'ID must be a positive integer'}), 400
+        if not claims['role'] == 'Trader':
+            return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+        data = request.json or {}
+        instrument_name = data.get('instrument')
+        strategy_id = data.get('strategy_id')
+        granularity = data.get('granularity', 'H1')
+        params = data.get('params') or {}
+        if not instrument_name or not strategy_id:
+            return jsonify({'status': 'error', 'msg': 'Missing instrument or strategy parameter'}), 400
+        if granularity not in GRANULARITY_SECONDS:
+            return jsonify({'status': 'error', 'msg': 'invalid granularity'}), 400
+        if not isinstance(params, dict):
+            return jsonify({'status': 'error', 'msg': 'params must be an object'}), 400
+        try:
+            strategy_id = int(strategy_id)
+            spread = float(data.get('spread', 0))
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'msg': 'strategy and spread must be numbers'}), 400
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT id, owner_id, script_path FROM strategies WHERE id= %s", (strategy_id,))
+            strategy_row = cur.fetchone()
+            if not strategy_row:
+                return jsonify({'status': 'error', 'msg': 'strategy not found'}), 404
+            if not strategy_row[1] == user_id:
+                return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+            cur.execute("SELECT * FROM instruments WHERE name = %s", (instrument_name,))
+            if not cur.fetchone():
+                return jsonify({'status': 'error', 'msg': 'instrument not found'}), 404
+        abs_script_path = os.path.join(current_app.root_path, strategy_row[2])
+        # uploaded code runs in its own process, as it does live
+        cmd = [sys.executable, '-m', 'backend.strategy.backtest', abs_script_path, instrument_name, granularity,
+               '--backfill', '--json', '--spread', str(spread)]
+        for option in ('start', 'end'):
+            if data.get(option):
+                cmd += [f'--{option}', str(data[option])]
+        for name, value in params.items():
+            cmd += ['--param', f'{name}={json.dumps(value)}']
+        try:
+            completed = run(cmd, env=get_script_env(), cwd=os.path.dirname(current_app.root_path),
+                            capture_output=True, text=True, timeout=backtest_timeout)
+        except TimeoutExpired:
+            return jsonify({'status': 'error', 'msg': f'backtest took longer than {backtest_timeout}s'}), 504
+        if completed.returncode != 0:
+            log_error(f'backtest of strategy {strategy_id} failed: {completed.stderr[-2000:]}', function_name)
+            return jsonify({'status': 'error', 'msg': 'backtest failed'}), 422
+        return jsonify({'status': 'ok', 'msg': 'backtest complete', 'backtest': json.loads(completed.stdout)}), 200
+    except Exception as e:
+        log_error(f'an error has occurred: {str(e)}', function_name)
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
+
+
+def fail_optimization(run_id, error):
+    """Marks a run failed unless the optimizer got to record how it ended"""
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE optimization_runs SET status = 'failed', error = %s, finished_at = now()
+            WHERE id = %s AND status IN ('queued', 'running')""", (error, run_id))
+
+
+def wait_for_optimization(run_id, process):
+    """Reaps an optimizer process and frees its slot, runs in a thread per optimization"""
+    try:
+        returncode = process.wait()
+        if returncode != 0:
+            log_warning(f'optimization {run_id} exited with {returncode}', 'wait_for_optimization')
+            # killed or crashed before it could mark the run failed itself
+            fail_optimization(run_id, f'optimizer exited with {returncode}')
+    except Exception as e:
+        log_error(f'optimization {run_id}: {str(e)}', 'wait_for_optimization')
+    finally:
+        with optimizations_lock:
+            optimizations.pop(run_id, None)
+
+
+@strategy_bp.post("/optimize/")
+@jwt_required()
+def optimize_strategy():
+    """
+    Starts a parameter sweep of one of the trader's strategies, see backend/services/optimizer.py. Body:
+    {'strategy_id', 'instrument', 'granularity' (default H1), 'start' / 'end' (optional),
+    'parameters' (e.g. {'lookback': {'min': 10, 'max': 50, 'step': 5}, 'units': [1000, 10000]}),
+    'method' ('grid' or 'random'), 'samples' (random only, default 50), 'seed', 'folds' (default 3, 0 for no
+    walk-forward), 'train_ratio' (default 0.7), 'metric' (default profit), 'spread'}
+    Poll GET /api/strategy/optimize/<run_id>/ for progress and results.
+    """
+    function_name = get_function_name()
+    try:
+        claims = get_jwt()
+        user_id = claims['id']
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            return jsonify({'status': 'error', 'msg': 'ID must be a positive integer'}), 400
+        if not claims['role'] == 'Trader':
+            return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+        data = request.json or {}
+        instrument_name = data.get('instrument')
+        strategy_id = data.get('strategy_id')
+        granularity = data.get('granularity', 'H1')
+        method = data.get('method', 'grid')
+        metric = data.get('metric', 'profit')
+        if not instrument_name or not strategy_id:
+            return jsonify({'status': 'error', 'msg': 'Missing instrument or strategy parameter'}), 400
+        if granularity not in GRANULARITY_SECONDS:
+            return jsonify({'status': 'error', 'msg': 'invalid granularity'}), 400
+        if metric not in METRICS:
+            return jsonify({'status': 'error', 'msg': f'metric must be one of {", ".join(METRICS)}'}), 400
+        try:
+            strategy_id = int(strategy_id)
+            samples = int(data.get('samples', 50))
+            seed = int(data['seed']) if data.get('seed') is not None else None
+            folds = int(data.get('folds', 3))
+            train_ratio = float(data.get('train_ratio', 0.7))
+            spread = float(data.get('spread', 0))
+            start_time = to_datetime(parse_time(data.get('start')))
+            end_time = to_datetime(parse_time(data.get('end')))
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'msg': 'invalid number or date'}), 400
+        if not 0 <= folds <= 20 or not 0 < train_ratio < 1:
+            return jsonify({'status': 'error', 'msg': 'folds must be 0 to 20 and train_ratio between 0 and 1'}), 400
+        try:
+            total = len(get_parameter_sets(data.get('parameters'), method, samples, seed))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'msg': str(e)}), 400
+        with optimizations_lock:
+            if any(owner == user_id for owner, _ in optimizations.values()):
+                return jsonify({'status': 'error', 'msg': 'an optimization of yours is already running'}), 409
+            if len(optimizations) >= optimizer_max_runs:
+                return jsonify({'status': 'error', 'msg': 'too many optimizations running, try again later'}), 429
+            with get_connection() as conn, conn.cursor() as cur:
+                cur.execute("SELECT id, owner_id FROM strategies WHERE id= %s", (strategy_id,))
+                strategy_row = cur.fetchone()
+                if not strategy_row:
+                    return jsonify({'status': 'error', 'msg': 'strategy not found'}), 404
+                if not strategy_row[1] == user_id:
+                    return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+                cur.execute("SELECT * FROM instruments WHERE name = %s", (instrument_name,))
+                if not cur.fetchone():
+                    return jsonify({'status': 'error', 'msg': 'instrument not found'}), 404
+                insert_run = """
+                    INSERT INTO optimization_runs (user_id, strategy_id, instrument, granularity, start_time, end_time,
+                    method, parameters, samples, seed, folds, train_ratio, metric, spread, total)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
+                    """
+                cur.execute(insert_run, (user_id, strategy_id, instrument_name, granularity, start_time, end_time,
+                                         method, Jsonb(data['parameters']), samples if method == 'random' else None,
+                                         seed, folds, train_ratio, metric, spread, total))
+                run_id = cur.fetchone()[0]
+                conn.commit()
+            # uploaded code runs outside the API process, the optimizer reports progress through optimization_runs
+            try:
+                process = Popen([sys.executable, '-m', 'backend.services.optimizer', str(run_id)],
+                                env=get_script_env(), cwd=os.path.dirname(current_app.root_path))
+            except OSError as e:
+                fail_optimization(run_id, f'could not start the optimizer: {str(e)}')
+                raise
+            optimizations[run_id] = (user_id, process)
+        threading.Thread(target=wait_for_optimization, args=(run_id, process), daemon=True).start()
+        log_info(f'started optimization {run_id} of strategy {strategy_id}: {total} parameter sets, {folds} folds')
+        return jsonify({'status': 'ok', 'msg': 'optimization started', 'run_id': run_id, 'total': total}), 202
+    except Exception as e:
+        log_error(f'an error has occurred: {str(e)}', function_name)
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
+
+
+@strategy_bp.get("/optimize/")
+@jwt_required()
+def get_optimizations():
+    """The trader's optimization runs, newest first, optionally of one strategy (?strategy_id=)"""
+    function_name = get_function_name()
+    try:
+        claims = get_jwt()
+        user_id = int(claims['id'])
+        if not claims['role'] == 'Trader':
+            return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+        strategy_id = request.args.get('strategy_id', type=int)
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+            get_runs = """
+                SELECT id, strategy_id, instrument, granularity, method, metric, folds, status, completed, total,
+                created_at, finished_at
+                FROM optimization_runs
+                WHERE user_id = %s AND (%s::integer IS NULL OR strategy_id = %s)
+                ORDER BY created_at DESC
+                LIMIT 50
+                """
+            cur.execute(get_runs, (user_id, strategy_id, strategy_id))
+            runs = cur.fetchall()
+        return jsonify({'status': 'ok', 'msg': 'optimization runs', 'runs': runs}), 200
+    except Exception as e:
+        log_error(f'an error has occurred: {str(e)}', function_name)
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
+
+
+@strategy_bp.get("/optimize/<int:run_id>/")
+@jwt_required()
+def get_optimization(run_id):
+    """Progress of an optimization run and, once done, its best ?limit= (default 20) parameter sets"""
+    function_name = get_function_name()
+    try:
+        claims = get_jwt()
+        user_id = int(claims['id'])
+        if not claims['role'] == 'Trader':
+            return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 1000)
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+            cur.execute('SELECT * FROM optimization_runs WHERE id = %s', (run_id,))
+            run = cur.fetchone()
+            if not run:
+                return jsonify({'status': 'error', 'msg': 'optimization not found'}), 404
+            if not run['user_id'] == user_id:
+                return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+            get_results = """
+                SELECT rank, params, score, in_sample, out_of_sample, error FROM optimization_results
+                WHERE run_id = %s ORDER BY rank LIMIT %s
+                """
+            cur.execute(get_results, (run_id, limit))
+            results = cur.fetchall()
+        run['progress'] = run['completed'] / run['total'] if run['total'] else 0
+        return jsonify({'status': 'ok', 'msg': 'optimization', 'optimization': run, 'results': results}), 200
+    except Exception as e:
+        log_error(f'an error has occurred: {str(e)}', function_name)
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
+
+
 @strategy_bp.delete("/stop/")
 @jwt_required()
 def stop_strategy():
-    conn = None
     try:
         claims = get_jwt()
         user_id = claims['id']
@@ -167,9 +455,7 @@ def stop_strategy():
         print(f'active_id: {active_strategy_trade_id}')
         if not active_strategy_trade_id:
             return jsonify({'status': 'error', 'msg': 'missing required parameters'}), 400
-        pid = None
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             get_pid = """
                 SELECT a.pid AS pid, t.transaction_id AS trade_id, t.close_time as close_time, a.id as id 
                 FROM active_strategies_trades a LEFT JOIN trades t ON a.trade_id = t.id 
@@ -177,40 +463,42 @@ def stop_strategy():
                 """
             cur.execute(get_pid, (active_strategy_trade_id,))
             result = cur.fetchone()
-            print(result)
-            cur.execute('DELETE FROM active_strategies_trades WHERE id = %s', (active_strategy_trade_id,))
-            if result:
-                pid = result[0]
-                trade_id = result[1]
-                close_time = result[2]
-                if trade_id and close_time is None:
-                    is_successful = cancel_trade_by_trade_id(trade_id)
-                    if not is_successful:
-                        conn.rollback()
+        if not result:
+            return jsonify({'status': 'ok', 'msg': 'Stopped trading script'}), 200
+        pid = result[0]
+        trade_id = result[1]
+        close_time = result[2]
+        # OANDA is called outside of any transaction, so no row lock is held for the round trip
+        is_successful = True
+        if trade_id and close_time is None:
+            is_successful = cancel_trade_by_trade_id(trade_id)
+        if is_successful:
+            with get_connection() as conn, conn.cursor() as cur:
+                cur.execute('DELETE FROM active_strategies_trades WHERE id = %s', (active_strategy_trade_id,))
+                bump_data_version(cur, [user_id])
                 conn.commit()
-                if not pid:
-                    return jsonify({'status': 'ok', 'msg': 'deleted'}), 200
-            else:
-                print("here")
-                return jsonify({'status': 'ok', 'msg': 'Stopped trading script'}), 200
-            if pid and os.path.exists(f'/proc/{pid}'):
-                process = processes.pop(pid, None)
-                if process:
-                    process.terminate()
-                    process.wait()
-
-                return jsonify({'status': 'ok', 'msg': 'Stopped trading script'}), 200
-            else:
-                return jsonify({'status': 'error', 'msg': 'Process not found'}), 404
+        if not pid:
+            return jsonify({'status': 'ok', 'msg': 'deleted'}), 200
+        # hosted strategies share their host's pid, only the host can stop one of them
+        if strategy_hosts and stop_hosted_strategy(int(active_strategy_trade_id)):
+            return jsonify({'status': 'ok', 'msg': 'Stopped trading script'}), 200
+        if pid and os.path.exists(f'/proc/{pid}'):
+            process = processes.pop(pid, None)
+            if process:
+                process.terminate()
+                process.wait()
+            elif pid in launched_pids:
+                # forked by the strategy launcher, which reaps it
+                launched_pids.discard(pid)
+                os.kill(pid, signal.SIGTERM)
+
+            return jsonify({'status': 'ok', 'msg': 'Stopped trading script'}), 200
+        else:
+            return jsonify({'status': 'error', 'msg': 'Process not found'}), 404
 
     except Exception as e:
         log_error(f'An error has occurred in stopping strategy: {str(e)}')
-        if conn:
-            conn.rollback()
         return jsonify({'status': 'error', 'msg': 'An error has occurred in stopping strategy'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @strategy_bp.get("/")
@@ -225,8 +513,7 @@ def get_strategies_by_user():
             return jsonify({'status': 'error', 'msg': 'ID must be a positive integer'}), 400
         if not claims['role'] == 'Trader':
             return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
-        conn = connect_to_db_dict_response()
-        with conn.cursor() as cur:
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
             get_user_strategies = """
             SELECT s.id AS id, s.owner_id AS owner_id, s.name AS name, s.comments AS comments, s.script_path AS script_path, t.type AS type FROM strategies s
             JOIN strategy_type t
@@ -235,7 +522,6 @@ def get_strategies_by_user():
             """
             cur.execute(get_user_strategies, (user_id,))
             strategies = cur.fetchall()
-        conn.close()
         return jsonify({'strategies': strategies}), 200
     except Exception as e:
         log_error(f"an error has occurred: {str(e)}")
@@ -252,15 +538,13 @@ def get_strategies_types():
             user_id = int(user_id)
         except ValueError:
             return jsonify({'status': 'error', 'msg': 'ID must be a positive integer'}), 400
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             get_types = """
             SELECT type FROM strategy_type 
             """
             cur.execute(get_types)
             types = cur.fetchall()
             types = [type[0] for type in types]
-        conn.close()
         return jsonify({'types': types}), 200
     except Exception as e:
         log_error(f"an error has occurred: {str(e)}")
@@ -288,8 +572,7 @@ def delete_strategy_by_id():
             strategy_id = int(strategy_id)
         except ValueError:
             return jsonify({'status': 'error', 'msg': 'strategy must be a positive integer'}), 400
-        conn = connect_to_db_dict_response()
-        with conn.cursor() as cur:
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
             check_for_conflict = """
             SELECT s.id, s.owner_id, s.script_path, a.id AS active_strat_id
             FROM strategies s
@@ -323,7 +606,6 @@ def delete_strategy_by_id():
 @strategy_bp.patch("/")
 @jwt_required()
 def update_strategy():
-    conn = None
     try:
         claims = get_jwt()
         user_id = claims['id']
@@ -345,8 +627,7 @@ def update_strategy():
             return jsonify({'status': 'error', 'msg': 'All fields are required'}), 400
         if not isinstance(type, (str,)):
             return jsonify({'status': 'error', 'msg': 'type must be a string'}), 400
-        conn = connect_to_db_dict_response()
-        with conn.cursor() as cur:
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
             cur.execute('SELECT id, owner_id, script_path FROM strategies WHERE id = %s', (strategy_id,))
             strategy = cur.fetchone()
             if not strategy['owner_id'] == user_id:
@@ -354,8 +635,7 @@ def update_strategy():
             if not strategy:
                 return jsonify({'status': 'error', 'msg': 'strategy not found'}), 404
 
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             cur.execute('SELECT id FROM strategy_type WHERE type = %s', (type,))
             type_id = cur.fetchone()
             if not type_id:
@@ -376,31 +656,27 @@ def update_strategy():
             file_path = os.path.join(current_app.config['SCRIPT_FOLDER'], filename)
             relative_file_path = os.path.relpath(file_path, start=current_app.root_path)
             file.save(file_path)
-            with conn.cursor() as cur:
+            with get_connection() as conn, conn.cursor() as cur:
                 new_strategy = """
                 UPDATE strategies SET type = %s, name = %s, comments = %s, script_path = %s WHERE id = %s
                 """
                 cur.execute(new_strategy, (type_id, name, comments, relative_file_path, strategy_id))
+                bump_data_version(cur, [user_id])
                 conn.commit()
-                conn.close()
             return jsonify(({'status': 'ok', 'msg': 'Update successful'})), 201
         else:
-            with conn.cursor() as cur:
+            with get_connection() as conn, conn.cursor() as cur:
                 # update without changing file
                 update_sql = """
                 UPDATE strategies SET type = %s, name = %s, comments = %s WHERE id=%s
                 """
                 values = (type_id, name, comments, strategy_id)
                 cur.execute(update_sql, values)
+                bump_data_version(cur, [user_id])
                 conn.commit()
 
                 return jsonify(({'status': 'ok', 'msg': 'Update successful'})), 200
     except Exception as e:
         error_message = str(e)
         log_error(f'Error: {error_message}')
-        if conn:
-            conn.rollback()
         return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
-    finally:
-        if conn:
-            conn.close()
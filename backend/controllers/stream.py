@@ -0,0 +1,128 @@
+import json
+from flask import Blueprint, jsonify, Response
+from flask_jwt_extended import jwt_required, get_jwt
+from backend.utilities import log_error
+from backend.db.db import get_connection
+from backend.controllers.tradesmenu import select_account_summary, select_positions, select_active_strategies
+from backend.services.push_hub import subscribe, unsubscribe, format_event, heartbeat, push_heartbeat_interval
+
+stream_bp = Blueprint('stream', __name__, url_prefix='/api/stream')
+
+
+def normalise(data):
+    """Decimals and datetimes as the client sees them, so unchanged values compare equal"""
+    return json.loads(json.dumps(data, default=str))
+
+
+def diff_record(previous, current):
+    """Returns {'changed': {field: value}} or None"""
+    if current is None:
+        return None
+    changed = {field: value for field, value in current.items() if (previous or {}).get(field) != value}
+    return {'changed': changed} if changed else None
+
+
+def diff_rows(previous, current, key):
+    """Returns {'upserted': [rows], 'removed': [keys]} or None. previous / current: {key: row}"""
+    upserted = [row for row_key, row in current.items() if previous.get(row_key) != row]
+    removed = [row_key for row_key in previous if row_key not in current]
+    if not upserted and not removed:
+        return None
+    return {'key': key, 'upserted': upserted, 'removed': removed}
+
+
+def select_trader_state(user_id):
+    with get_connection(dict_rows=True, caller='trader stream') as conn, conn.cursor() as cur:
+        return {
+            'summary': normalise(select_account_summary(cur, user_id)),
+            'positions': {row['id']: row for row in normalise(select_positions(cur, user_id))},
+            'strategies': {row['id']: row for row in normalise(select_active_strategies(cur, user_id))},
+        }
+
+
+def select_desk_state(trader_ids):
+    """trader_ids: only refresh these traders, [] for all of them"""
+    get_trader_balances = """
+    SELECT c.trader_id, a.display_name, a.can_trade, c.balance, c.nav, c.margin_used, c.margin_available
+    FROM cash_balances c
+    JOIN auth a ON a.id = c.trader_id
+    WHERE a.role_id = 1 AND a.account_disabled IS FALSE
+      AND (cardinality(%(trader_ids)s::integer[]) = 0 OR c.trader_id = ANY(%(trader_ids)s))
+    """
+    with get_connection(dict_rows=True, caller='desk stream') as conn, conn.cursor() as cur:
+        cur.execute(get_trader_balances, {'trader_ids': list(trader_ids)})
+        return {row['trader_id']: row for row in normalise(cur.fetchall())}
+
+
+def trader_events(user_id):
+    subscription = subscribe(user_id)
+    try:
+        state = select_trader_state(user_id)
+        yield format_event('summary', {'changed': state['summary'] or {}})
+        yield format_event('positions', {'key': 'id', 'upserted': list(state['positions'].values()), 'removed': []})
+        yield format_event('strategies', {'key': 'id', 'upserted': list(state['strategies'].values()), 'removed': []})
+        while True:
+            if subscription.wait(push_heartbeat_interval) is None:
+                yield heartbeat()
+                continue
+            current = select_trader_state(user_id)
+            for event, diff in (('summary', diff_record(state['summary'], current['summary'])),
+                                ('positions', diff_rows(state['positions'], current['positions'], 'id')),
+                                ('strategies', diff_rows(state['strategies'], current['strategies'], 'id'))):
+                if diff:
+                    yield format_event(event, diff)
+            state = current
+    finally:
+        unsubscribe(subscription)
+
+
+def desk_events(user_id):
+    subscription = subscribe(user_id, desk=True)
+    try:
+        traders = select_desk_state([])
+        yield format_event('traders', {'key': 'trader_id', 'upserted': list(traders.values()), 'removed': []})
+        while True:
+            trader_ids = subscription.wait(push_heartbeat_interval)
+            if trader_ids is None:
+                yield heartbeat()
+                continue
+            current = select_desk_state(trader_ids)
+            previous = traders if not trader_ids else {trader_id: traders[trader_id]
+                                                        for trader_id in trader_ids if trader_id in traders}
+            diff = diff_rows(previous, current, 'trader_id')
+            if diff:
+                yield format_event('traders', diff)
+            if not trader_ids:
+                traders = current
+            else:
+                for trader_id in trader_ids:
+                    traders.pop(trader_id, None)
+                traders.update(current)
+    finally:
+        unsubscribe(subscription)
+
+
+@stream_bp.get('/')
+@jwt_required(locations=['headers', 'query_string'])
+def stream_updates():
+    """
+    Server-sent events. EventSource cannot set headers, so the access token may be passed as ?jwt=<token>.
+    Traders get 'summary', 'positions' and 'strategies' events, managers get 'traders' events.
+    The first events carry the full state, later ones only what changed:
+    summary:        {'changed': {field: value}}
+    lists:          {'key': <id field>, 'upserted': [rows], 'removed': [ids]}
+    """
+    try:
+        claims = get_jwt()
+        user_id = int(claims['id'])
+        if claims['role'] == 'Manager':
+            events = desk_events(user_id)
+        elif claims['role'] == 'Trader':
+            events = trader_events(user_id)
+        else:
+            return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
+        return Response(events, mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    except Exception as e:
+        log_error(f'an error has occurred while opening the update stream: {str(e)}')
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
@@ -1,10 +1,21 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g, make_response
+from functools import wraps
 from dotenv import load_dotenv
-import os, requests, datetime
+import os, requests, datetime, time
+import click
 from flask_jwt_extended import jwt_required, get_jwt
-from backend.utilities import log_info, log_error, log_warning, get_function_name
-from backend.db.db import connect_to_db, connect_to_db_dict_response
+from backend.utilities import log_info, log_error, log_warning, get_function_name, SingleFlight
+from backend.db.db import get_connection
+import psycopg
+from psycopg.rows import dict_row
+from backend.services.trade_writer import upsert_trades, use_copy, update_open_trades, get_changed_open_trades, \
+    remember_open_trades, validate_open_trade_snapshot, forget_open_trades
+from backend.services.oanda_payload import ChangesPayload
+from backend.services.sync_journal import record_payload, read_journal
+from backend.services.push_hub import notify_data_changed
+from backend.services.response_cache import response_cache, invalidate_cached_responses, make_etag
 from decimal import Decimal
+from contextlib import nullcontext
 
 load_dotenv()
 leverage = int(os.environ.get('LEVERAGE'))
@@ -14,12 +25,24 @@ oanda_API_key = os.environ.get('OANDA_API_KEY')
 
 syncdata_bp = Blueprint('syncdata', __name__, url_prefix='/api/sync')
 
+# Concurrent syncs within this process share one in-flight sync, syncs across API workers and the sync worker
+# process are serialised on this Postgres advisory lock
+sync_flight = SingleFlight()
+SYNC_ADVISORY_LOCK_ID = 80_201_524
+oanda_request_timeout = 30
 
+
+# rows of the trade_state lookup table, loaded on first use rather than at import so that importing this module
+# (e.g. for flask syncdata replay against a scratch database) does not query the live database
 trade_states = None
-connect = connect_to_db_dict_response()
-with connect.cursor() as cursor:
-    cursor.execute("""SELECT * FROM trade_state""")
-    trade_states = cursor.fetchall()
+
+
+def get_trade_states(cur):
+    global trade_states
+    if trade_states is None:
+        cur.execute("""SELECT * FROM trade_state""")
+        trade_states = [dict(row) for row in cur.fetchall()]
+    return trade_states
 
 
 def get_trade_id_by_state(list_of_trade_states_dict, state):
@@ -54,552 +77,649 @@ def check_strategy_exists(cur, strategy_id):
 @syncdata_bp.get('/oanda/')
 @jwt_required()
 def sync_with_oanda():
+    result = run_sync()
+    if result['status'] == 'error':
+        return jsonify({'status': 'error', 'message': result['msg'], 'sync': result['sync']}), 500
+    if result['status'] == 'up to date':
+        return jsonify({'status': 'ok', 'msg': 'already up to date', 'sync': result['sync']})
+    return jsonify({'status': 'ok', 'sync': result['sync']}), 200
+
+
+def run_sync():
+    """
+    Syncs with OANDA unless a sync is already running, in which case it waits for that sync instead of
+    applying the same changes again. Returns the dictionary described in sync_once, plus:
+    sync: 'ran'         if this call performed the sync
+          'piggybacked' if it waited for a sync started by another thread or process
+    """
+    result, ran = sync_flight.run('oanda', sync_once)
+    if not ran or result.get('sync') == 'piggybacked':
+        return dict(result, sync='piggybacked')
+    return dict(result, sync='ran')
+
+
+def sync_once():
+    """
+    Polls OANDA for changes since the last recorded transaction and applies them to the database.
+    Called by the background sync worker and by read endpoints when a fresh sync is requested.
+    The whole changes payload is applied on one connection, in one transaction, with statements sent
+    in pipeline mode. If any stage fails nothing is committed, so trades and balances never drift apart.
+    Returns a dictionary:
+    status: 'ok'            if changes were applied
+            'up to date'    if OANDA had no new transactions (open trade values are still refreshed)
+            'error'         if the sync failed, with msg describing the failure
+    last_transaction_id:    the transaction id the database is now synced up to (unless status is 'error')
+    """
     function_name = None
     try:
         function_name = get_function_name()
         endpoint = f"{oanda_platform}/v3/accounts/{oanda_account}/changes"
-        db_latest_transaction_id = """
-        SELECT last_transaction_id 
-        FROM oanda_transaction_log
-        ORDER BY recorded_at DESC
-        LIMIT 1"""
-        conn = connect_to_db()
-        with conn.cursor() as cur:
-            cur.execute(db_latest_transaction_id)
-            latest_transaction_id_tuple = cur.fetchone()
-            if latest_transaction_id_tuple:
-                latest_transaction_id = latest_transaction_id_tuple[0]
-            else:
-                latest_transaction_id = 1
-        payload = {'sinceTransactionID': latest_transaction_id}
-        headers = {'Authorization': f'Bearer {oanda_API_key}', 'Connection': 'keep-alive'}
-        response = requests.get(endpoint, params=payload, headers=headers)
-        response_data = None
-        print(f'latest_transaction_id: {latest_transaction_id}')
-        if response.status_code == 200:
+        # holds the connection across the OANDA request: the advisory lock belongs to this session
+        with get_connection(dict_rows=True, caller=function_name) as conn:
+            lock_acquired = False
             try:
-                response_data = response.json()
-                if int(response_data['lastTransactionID']) == latest_transaction_id:
-                    return jsonify({'status': 'ok', 'msg': 'already up to date'})
-                """
-                log_trades_opened and log_trades_reduced functions returns a dictionary:
-                updated: True   if successfully logged new trades
-                or
-                updated: None   if no new trades were in detected.
-                """
-                check_open_trade_response = log_trades_opened(response_data)
-                check_reduced_trade_response = log_trades_reduced(response_data)
-
-                """
-                log_trades_closed returns a dictionary with two key value pairs:
-                updated: True   if successfully logged new trades
-                or
-                updated: None   if no new trades were in detected,
-                closed_trades: [{id: id, user_id: user_id, realized_pl: realized_pl, close_time: close_time} ...]
-                """
-                check_closed_trade_response = log_trades_closed(response_data)
-                tie_order_to_trade_and_active_strategies(response_data)
-                update_open_trade(response_data)
-                if check_closed_trade_response['updated']:
-                    audit_closed_trade_and_update_trader_cash_balance(check_closed_trade_response['closed_trades'])
-
-                if check_open_trade_response['updated'] or check_reduced_trade_response['updated'] or check_closed_trade_response['updated']:
-                    update_latest_polled_transaction(response_data)
-                update_trader_nav()
-                update_all_margin_used_and_available()
-                return jsonify({'status': 'ok'}), 200
-            except ValueError as e:
-                log_error(f'Invalid JSON response: {response_data}\nerror: {e}', function_name)
-                return jsonify({'status': 'error', 'message': 'Invalid JSON response'}), 500
-        else:
-            log_error(f'Failed to fetch data: {response.status_code} {response.text}', function_name)
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_try_advisory_lock(%s) AS acquired", (SYNC_ADVISORY_LOCK_ID,))
+                    lock_acquired = cur.fetchone()['acquired']
+                    if not lock_acquired:
+                        # another process is syncing: wait for it to commit, then report what it synced up to
+                        cur.execute("SELECT pg_advisory_lock(%s)", (SYNC_ADVISORY_LOCK_ID,))
+                        lock_acquired = True
+                        latest_transaction_id = get_latest_transaction_id(cur)
+                        conn.commit()
+                        return {'status': 'up to date', 'sync': 'piggybacked',
+                                'last_transaction_id': latest_transaction_id}
+                    # read the checkpoint only once we hold the lock, so it includes the previous sync's changes
+                    latest_transaction_id = get_latest_transaction_id(cur)
+                    cur.execute("SELECT last_synced_at, open_trades_version FROM oanda_sync_status WHERE id = 1")
+                    sync_status = cur.fetchone()
+                conn.commit()
+                validate_open_trade_snapshot(
+                    (sync_status['last_synced_at'], sync_status['open_trades_version']) if sync_status else None)
+                payload = {'sinceTransactionID': latest_transaction_id}
+                headers = {'Authorization': f'Bearer {oanda_API_key}', 'Connection': 'keep-alive'}
+                response = requests.get(endpoint, params=payload, headers=headers, timeout=oanda_request_timeout)
+                response_data = None
+                if response.status_code == 200:
+                    try:
+                        response_data = response.json()
+                        journaled = str(response_data.get('lastTransactionID')) != str(latest_transaction_id)
+                        try:
+                            changes = ChangesPayload(response_data)
+                            # COPY cannot run in pipeline mode, large payloads send their statements one by one
+                            pipeline = nullcontext() if use_copy(changes.count_changed_trades()) else conn.pipeline()
+                            up_to_date = int(changes.last_transaction_id) == latest_transaction_id
+                            with conn.transaction(), pipeline, conn.cursor() as cur:
+                                # no new transactions still means new prices: refresh the open trades that moved
+                                sync_state = apply_changes(cur, changes, OPEN_TRADE_STAGES if up_to_date else None)
+                                data_changed = not up_to_date or bool(sync_state['trader_ids'])
+                                synced_at, open_trades_version = update_sync_status(
+                                    cur, changes.last_transaction_id, data_changed, sync_state['open_trades_changed'])
+                                if sync_state['trader_ids']:
+                                    notify_data_changed(cur, sync_state['trader_ids'])
+                        except Exception as e:
+                            if journaled:
+                                record_payload(latest_transaction_id, response_data, f'{type(e).__name__}: {str(e)}')
+                            raise
+                        if journaled:
+                            record_payload(latest_transaction_id, response_data)
+                        # anything but this sync's own bump means the pricing engine wrote open trades meanwhile
+                        if sync_status is None or open_trades_version == \
+                                sync_status['open_trades_version'] + int(sync_state['open_trades_changed']):
+                            remember_open_trades(sync_state['open_trades'], (synced_at, open_trades_version))
+                        else:
+                            forget_open_trades()
+                        if data_changed:
+                            invalidate_cached_responses()
+                        if up_to_date:
+                            return {'status': 'up to date', 'last_transaction_id': latest_transaction_id}
+                        return {'status': 'ok', 'last_transaction_id': int(changes.last_transaction_id)}
+                    except KeyError as e:
+                        log_error(f'Unexpected JSON structure: {response_data}\nerror: {e}', function_name)
+                        return {'status': 'error', 'msg': 'Unexpected JSON structure'}
+                    except ValueError as e:
+                        log_error(f'Invalid JSON response: {response_data}\nerror: {e}', function_name)
+                        return {'status': 'error', 'msg': 'Invalid JSON response'}
+                else:
+                    log_error(f'Failed to fetch data: {response.status_code} {response.text}', function_name)
+                    return {'status': 'error', 'msg': f'OANDA responded with {response.status_code}'}
+            finally:
+                if lock_acquired:
+                    release_sync_lock(conn, function_name)
     except Exception as e:
         log_error(f'Unexpected error: {str(e)}', function_name)
-        return jsonify({'status': 'error', 'message': 'An unexpected error has occurred'}), 500
+        return {'status': 'error', 'msg': 'An unexpected error has occurred'}
+
+
+def release_sync_lock(conn, function_name):
+    """
+    Pooled connections are not closed after a sync, so the session lock has to be released explicitly.
+    If that fails the connection is closed instead of going back to the pool still holding the lock.
+    """
+    try:
+        conn.rollback()
+        conn.execute("SELECT pg_advisory_unlock(%s)", (SYNC_ADVISORY_LOCK_ID,))
+        conn.commit()
+    except Exception as e:
+        log_warning(f'failed to release sync lock, closing the connection to release it: {e}', function_name)
+        conn.close()
+
+
+def get_latest_transaction_id(cur):
+    db_latest_transaction_id = """
+    SELECT last_transaction_id 
+    FROM oanda_transaction_log
+    ORDER BY recorded_at DESC
+    LIMIT 1"""
+    cur.execute(db_latest_transaction_id)
+    latest_transaction_id_dict = cur.fetchone()
+    if latest_transaction_id_dict:
+        return latest_transaction_id_dict['last_transaction_id']
+    return 1
+
+
+def apply_changes(cur, changes, stages=None, timings=None):
+    """
+    Runs each sync stage in order against the same cursor. The caller owns the transaction.
+    Every stage takes (cur, changes, sync_state) where changes is the parsed ChangesPayload
+    and sync_state is a dictionary shared between stages:
+    closed_trades: [{id: id, user_id: user_id, realized_pl: realized_pl, financing: financing, close_time: close_time} ...]
+                   filled by log_trades_closed and consumed by audit_closed_trade_and_update_trader_cash_balance
+    trader_ids:    set of trader ids whose trades changed, nav and margin are only recomputed for these traders
+    Stages can be run individually or in a different combination by passing stages.
+    timings: optional dictionary, the seconds spent in each stage are added to timings[stage name]
+    """
+    if stages is None:
+        stages = SYNC_STAGES
+    sync_state = {'closed_trades': [], 'trader_ids': set(), 'open_trades': [], 'open_trades_changed': False}
+    for stage in stages:
+        if timings is None:
+            stage(cur, changes, sync_state)
+            continue
+        started = time.perf_counter()
+        stage(cur, changes, sync_state)
+        timings[stage.__name__] = timings.get(stage.__name__, 0.0) + time.perf_counter() - started
+    return sync_state
+
+
+def update_sync_status(cur, last_transaction_id, data_changed=True, open_trades_changed=False):
+    """
+    data_changed: bumps data_version, which cached responses are keyed on
+    open_trades_changed: bumps open_trades_version, which the pricing engine reloads its book on
+    Returns (last_synced_at, open_trades_version)
+    """
+    record_successful_sync = """
+    INSERT INTO oanda_sync_status (id, last_synced_at, last_transaction_id)
+    VALUES (1, CURRENT_TIMESTAMP, %s)
+    ON CONFLICT (id) DO UPDATE
+    SET last_synced_at = EXCLUDED.last_synced_at, last_transaction_id = EXCLUDED.last_transaction_id,
+        data_version = oanda_sync_status.data_version + CASE WHEN %s THEN 1 ELSE 0 END,
+        open_trades_version = oanda_sync_status.open_trades_version + CASE WHEN %s THEN 1 ELSE 0 END
+    RETURNING last_synced_at, open_trades_version
+    """
+    cur.execute(record_successful_sync, (last_transaction_id, data_changed, open_trades_changed))
+    result = cur.fetchone()
+    if isinstance(result, dict):
+        return result['last_synced_at'], result['open_trades_version']
+    return result[0], result[1]
+
+
+def bump_data_version(cur, trader_ids=None):
+    """
+    Call in the same transaction as writes that change what the read endpoints return outside of a sync.
+    trader_ids: traders whose update streams should refresh, None for all of them
+    """
+    cur.execute("UPDATE oanda_sync_status SET data_version = data_version + 1 WHERE id = 1")
+    notify_data_changed(cur, trader_ids)
+    invalidate_cached_responses()
+
+
+def get_sync_status():
+    """
+    Returns {'last_synced_at', 'last_transaction_id', 'data_version'} or None before the first sync.
+    Read once per request, after a requested sync has run.
+    """
+    if 'sync_status' not in g:
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+            cur.execute("SELECT last_synced_at, last_transaction_id, data_version FROM oanda_sync_status WHERE id = 1")
+            g.sync_status = cur.fetchone()
+    return g.sync_status
+
+
+def get_last_synced_at():
+    sync_status = get_sync_status()
+    return sync_status['last_synced_at'] if sync_status else None
+
 
+def sync_if_requested():
+    """
+    Read endpoints serve straight from the database, which the sync worker keeps up to date.
+    Clients can opt in to a blocking sync before the read with ?fresh=1.
+    """
+    if 'sync' not in g and request.args.get('fresh', '').lower() in ('1', 'true'):
+        g.sync = run_sync()['sync']
 
-def log_trades_opened(response):
-    conn = None
+
+def cached_response(view):
+    """
+    Caches the JSON of a GET endpoint per user and URL, keyed on the data version the response was built from:
+    the last OANDA transaction applied and oanda_sync_status.data_version. Clients that send back the ETag
+    get 304 Not Modified without the endpoint running at all. Put it below @jwt_required().
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        sync_if_requested()
+        sync_status = get_sync_status()
+        if request.method != 'GET' or not sync_status:
+            return view(*args, **kwargs)
+        arguments = tuple(sorted((name, value) for name, value in request.args.items(multi=True) if name != 'fresh'))
+        key = (get_jwt()['id'], request.path, arguments, sync_status['last_transaction_id'],
+               sync_status['data_version'])
+        etag = make_etag(key)
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            cached = response_cache.get(key)
+            if cached is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response_cache.put(key, (response.get_data(), response.mimetype))
+            else:
+                response = make_response(cached[0], 200)
+                response.mimetype = cached[1]
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
+
+def add_sync_headers(response):
+    """
+    after_request hook for read endpoints. Tells the client when the data was last synced with OANDA
+    and how many seconds old it is. For ?fresh=1 requests X-Data-Sync says whether this request ran the sync
+    or piggybacked on one already in progress.
+    """
+    if request.method != 'GET':
+        return response
+    try:
+        last_synced_at = get_last_synced_at()
+    except Exception as e:
+        log_warning(f'unable to read sync status: {str(e)}', 'add_sync_headers')
+        return response
+    if last_synced_at:
+        age = datetime.datetime.now(datetime.timezone.utc) - last_synced_at
+        response.headers['X-Data-Synced-At'] = last_synced_at.isoformat()
+        response.headers['X-Data-Age'] = str(max(int(age.total_seconds()), 0))
+    else:
+        response.headers['X-Data-Synced-At'] = 'never'
+    if 'sync' in g:
+        response.headers['X-Data-Sync'] = g.sync
+    return response
+
+
+def get_trade_values(trade, state_id, unrealized_pl, margin_used):
+    return (trade.user_id, trade.open_time, trade.close_time, trade.current_units, trade.financing, trade.id,
+            trade.initial_units, trade.instrument, trade.price, trade.realized_pl, unrealized_pl, state_id, margin_used,
+            trade.strategy_id)
+
+
+def log_trades_opened(cur, changes, sync_state):
     function_name = None
     try:
         function_name = get_function_name()
-        list_of_trades_opened = response['changes']['tradesOpened']
-        trade_info = response['state']['trades']
+        list_of_trades_opened = changes.trades_opened
         if len(list_of_trades_opened) == 0:
-            return {'updated': None}
+            return
         log_info(f'{len(list_of_trades_opened)} List of trades opened:')
-        conn = connect_to_db()
-        with conn.cursor() as cur:
-
-            for trade in list_of_trades_opened:
-                log_info(f'{len(list_of_trades_opened)} open trade: {trade}')
-                user_id = None
-                client_extensions = trade.get('clientExtensions', '')
-                if client_extensions:
-                    user_id = client_extensions.get('tag').split("_")[1]
-                    strategy_id = client_extensions.get('comment').split("_")[1]
-                else:
-                    log_info(f"client extensions user_id not found, defaulting user_id to 1 for {trade['id']}")
-                    user_id = 1
-                transaction_id = trade['id']
-                open_time = trade['openTime']
-                current_units = trade['currentUnits']
-                instrument = trade['instrument']
-                financing = trade['financing']
-                initial_units = trade['initialUnits']
-                price = trade['price']
-                realized_pl = trade['realizedPL']
-                unrealized_pl = [trade['unrealizedPL'] for trade in trade_info if trade['id'] == transaction_id][0]
-                margin_used = [trade['marginUsed'] for trade in trade_info if trade['id'] == transaction_id][0]
-                state = trade['state']
-                state_id = get_trade_id_by_state(trade_states, state)
-                if not state_id:
-                    raise ValueError(f'{state} is not a valid state')
-                check_existing_trade = """
-                SELECT * FROM trades WHERE transaction_id = %s
-                """
-                cur.execute(check_existing_trade, (transaction_id,))
-                result = cur.fetchone()
-                if result:
-                    update_trade = """
-                    UPDATE trades
-                    SET user_id = %s, open_time = %s, current_units = %s, financing = %s, initial_units = %s, instrument = %s, price = %s, realized_pl = %s, unrealized_pl = %s, state_id = %s, update_time = %s, margin_used = %s
-                    WHERE transaction_id = %s
-                    """
-                    values = (user_id, open_time, current_units, financing, initial_units, instrument, price, realized_pl, unrealized_pl, state_id, datetime.datetime.now(), margin_used, transaction_id)
-                    cur.execute(update_trade, values)
-                else:
-                    insert_new_trade = """
-                    INSERT INTO trades (user_id, open_time, current_units, financing, transaction_id, initial_units, instrument, price, realized_pl, unrealized_pl, state_id, margin_used)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """
-                    values = (user_id, open_time, current_units, financing, transaction_id, initial_units, instrument, price, realized_pl, unrealized_pl, state_id, margin_used)
-                    cur.execute(insert_new_trade, values)
-            conn.commit()
-        return {'updated': True}
-    except KeyError as e:
-        print(f'KeyError: {e}')
-        log_error(f'error when logging open trades: {e}', function_name)
-        if conn:
-            conn.rollback()
-        raise
+        trades = []
+        for trade in list_of_trades_opened:
+            log_info(f'{len(list_of_trades_opened)} open trade: {trade}')
+            state_id = get_trade_id_by_state(get_trade_states(cur), trade.state)
+            if not state_id:
+                raise ValueError(f'{trade.state} is not a valid state')
+            trades.append(get_trade_values(trade, state_id, changes.unrealized_pl(trade.id), changes.margin_used(trade.id)))
+        upserted_trades = upsert_trades(cur, trades)
+        sync_state['trader_ids'].update(upserted_trade['user_id'] for upserted_trade in upserted_trades)
     except Exception as e:
         print(e)
         log_error(f'error when logging open trades: {e}', function_name)
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
 
 
-def log_trades_reduced(response):
-    conn = None
+def log_trades_reduced(cur, changes, sync_state):
     function_name = None
     try:
         function_name = get_function_name()
-        list_of_trades_reduced = response['changes']['tradesReduced']
-        trade_info = response['state']['trades']
+        list_of_trades_reduced = changes.trades_reduced
         if len(list_of_trades_reduced) == 0:
-            return {'updated': None}
+            return
         print(f'{len(list_of_trades_reduced)} trades reduced.')
         log_info(f'{len(list_of_trades_reduced)} trades reduced:')
-        conn = connect_to_db()
-        with conn.cursor() as cur:
-
-            for trade in list_of_trades_reduced:
-                log_info(f'reduced trade: {trade}')
-                user_id = None
-                client_extensions = trade.get('clientExtensions', '')
-                if client_extensions:
-                    user_id = client_extensions.get('tag').split("_")[1]
-                    strategy_id = client_extensions.get('comment').split("_")[1]
-                else:
-                    log_info(f"client extensions user_id not found, defaulting user_id to 1 for {trade['id']}")
-                    user_id = 1
-                transaction_id = trade['id']
-                open_time = trade['openTime']
-                current_units = trade['currentUnits']
-                instrument = trade['instrument']
-                financing = trade['financing']
-                initial_units = trade['initialUnits']
-                price = trade['price']
-                realized_pl = trade['realizedPL']
-                unrealized_pl = [trade['unrealizedPL'] for trade in trade_info if trade['id'] == transaction_id][0]
-                margin_used = [trade['marginUsed'] for trade in trade_info if trade['id'] == transaction_id][0]
-                state = 'reduced'
-                state_id = get_trade_id_by_state(trade_states, state)
-                if not state_id:
-                    raise ValueError(f'{state} is not a valid state')
-                check_existing_trade = """
-                SELECT * FROM trades WHERE transaction_id = %s
-                """
-                cur.execute(check_existing_trade, (transaction_id,))
-                result = cur.fetchone()
-                if result:
-                    update_trade = """
-                    UPDATE trades
-                    SET user_id = %s, open_time = %s, current_units = %s, financing = %s, initial_units = %s, instrument = %s, price = %s, realized_pl = %s, unrealized_pl = %s, state_id = %s, update_time = %s, margin_used = %s
-                    WHERE transaction_id = %s
-                    """
-                    values = (
-                    user_id, open_time, current_units, financing, initial_units, instrument, price, realized_pl,
-                    unrealized_pl, state_id, datetime.datetime.now(), margin_used, transaction_id)
-                    cur.execute(update_trade, values)
-                else:
-                    insert_new_trade = """
-                    INSERT INTO trades (user_id, open_time, current_units, financing, transaction_id, initial_units, instrument, price, realized_pl, unrealized_pl, state_id, margin_used)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """
-                    values = (
-                    user_id, open_time, current_units, financing, transaction_id, initial_units, instrument, price,
-                    realized_pl, unrealized_pl, state_id, margin_used)
-                    cur.execute(insert_new_trade, values)
-            conn.commit()
-        return {'updated': True}
-    except KeyError as e:
-        print(f'KeyError: {e}')
-        log_error(f'error when logging open trades: {e}', function_name)
-        if conn:
-            conn.rollback()
-        raise
+        state = 'reduced'
+        state_id = get_trade_id_by_state(get_trade_states(cur), state)
+        if not state_id:
+            raise ValueError(f'{state} is not a valid state')
+        trades = []
+        for trade in list_of_trades_reduced:
+            log_info(f'reduced trade: {trade}')
+            trades.append(get_trade_values(trade, state_id, changes.unrealized_pl(trade.id), changes.margin_used(trade.id)))
+        upserted_trades = upsert_trades(cur, trades)
+        sync_state['trader_ids'].update(upserted_trade['user_id'] for upserted_trade in upserted_trades)
     except Exception as e:
         print(e)
-        log_error(f'error when logging open trades: {e}', function_name)
-        if conn:
-            conn.rollback()
+        log_error(f'error when logging reduced trades: {e}', function_name)
         raise
-    finally:
-        if conn:
-            conn.close()
 
 
-def log_trades_closed(response):
-    conn = None
+def log_trades_closed(cur, changes, sync_state):
+    """
+    Stores the rows returned by the upsert in sync_state['closed_trades'] so auditing doesn't re-query them:
+    [{id: id, user_id: user_id, transaction_id: transaction_id, realized_pl: realized_pl, financing: financing, close_time: close_time} ...]
+    """
     function_name = None
     try:
         function_name = get_function_name()
-        list_of_trades_closed = response['changes']['tradesClosed']
-        list_of_closed_trades = []
+        list_of_trades_closed = changes.trades_closed
         if len(list_of_trades_closed) == 0:
-            return {'updated': None, 'closed_trades': list_of_closed_trades}
+            return
         print(f'{len(list_of_trades_closed)} trades closed.')
         log_info(f'{len(list_of_trades_closed)} trades closed:')
-        conn = connect_to_db_dict_response()
-
-        with conn.cursor() as cur:
-
-            for trade in list_of_trades_closed:
-                log_info(f'closed trade: {trade}')
-                user_id = None
-                client_extensions = trade.get('clientExtensions', '')
-                if client_extensions:
-                    user_id = client_extensions.get('tag').split("_")[1]
-                    strategy_id = client_extensions.get('comment').split("_")[1]
-                else:
-                    log_info(f"client extensions user_id not found, defaulting user_id to 1 for {trade['id']}")
-                    user_id = 1
-                transaction_id = trade['id']
-                open_time = trade['openTime']
-                close_time = trade['closeTime']
-                current_units = trade['currentUnits']
-                instrument = trade['instrument']
-                financing = trade['financing']
-                initial_units = trade['initialUnits']
-                price = trade['price']
-                realized_pl = trade['realizedPL']
-                unrealized_pl = 0
-                margin_used = 0
-                state = 'closed'
-                state_id = get_trade_id_by_state(trade_states, state)
-                if not state_id:
-                    raise ValueError(f'{state} is not a valid state')
-                check_existing_trade = """
-                SELECT * FROM trades WHERE transaction_id = %s
-                """
-                cur.execute(check_existing_trade, (transaction_id,))
-                result = cur.fetchone()
-                if result:
-                    close_trade = """
-                    UPDATE trades
-                    SET user_id = %s, open_time = %s, close_time = %s, current_units = %s, financing = %s, initial_units = %s, instrument = %s, price = %s, realized_pl = %s, unrealized_pl = %s, state_id = %s, update_time = %s, margin_used = %s
-                    WHERE transaction_id = %s
-                    RETURNING id, user_id, realized_pl, financing, close_time
-                    """
-                    values = (
-                        user_id, open_time, close_time, current_units, financing, initial_units, instrument, price,
-                        realized_pl, unrealized_pl, state_id, datetime.datetime.now(), margin_used, transaction_id)
-                    cur.execute(close_trade, values)
-                    closed_trade_info_dictionary = cur.fetchone()
-                    list_of_closed_trades.append(closed_trade_info_dictionary)
-                else:
-                    insert_new_trade = """
-                    INSERT INTO trades (user_id, open_time, close_time, current_units, financing, transaction_id, initial_units, instrument, price, realized_pl, unrealized_pl, state_id, margin_used)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id, user_id, realized_pl, close_time
-                    """
-                    values = (
-                        user_id, open_time, close_time, current_units, financing, transaction_id, initial_units, instrument, price,
-                        realized_pl, unrealized_pl, state_id, margin_used)
-                    cur.execute(insert_new_trade, values)
-                    closed_trade_info_dictionary = cur.fetchone()
-                    list_of_closed_trades.append(closed_trade_info_dictionary)
-            conn.commit()
-
-        return {'updated': True, 'closed_trades': list_of_closed_trades}
-    except KeyError as e:
-        print(f'KeyError: {e}')
-        log_error(f'error when logging open trades: {e}', function_name)
-        if conn:
-            conn.rollback()
-        raise
+        state = 'closed'
+        state_id = get_trade_id_by_state(get_trade_states(cur), state)
+        if not state_id:
+            raise ValueError(f'{state} is not a valid state')
+        trades = []
+        for trade in list_of_trades_closed:
+            log_info(f'closed trade: {trade}')
+            unrealized_pl = 0
+            margin_used = 0
+            trades.append(get_trade_values(trade, state_id, unrealized_pl, margin_used))
+        upserted_trades = upsert_trades(cur, trades)
+        sync_state['closed_trades'].extend(upserted_trades)
+        sync_state['trader_ids'].update(upserted_trade['user_id'] for upserted_trade in upserted_trades)
     except Exception as e:
         print(e)
-        log_error(f'error when logging open trades: {e}', function_name)
-        if conn:
-            conn.rollback()
+        log_error(f'error when logging closed trades: {e}', function_name)
         raise
-    finally:
-        if conn:
-            conn.close()
 
 
-def tie_order_to_trade_and_active_strategies(response):
-    conn = None
+def tie_order_to_trade_and_active_strategies(cur, changes, sync_state):
     try:
-        orders_filled = response['changes']['ordersFilled']
-        orders_cancelled = response['changes']['ordersCancelled']
-        conn = connect_to_db_dict_response()
-
-        for order in orders_filled:
-            if order['type'] == 'MARKET' and order['state'] == 'FILLED' and not order['positionFill'] == 'REDUCE_ONLY':
+        for order in changes.orders_filled:
+            if order.type == 'MARKET' and order.state == 'FILLED' and not order.position_fill == 'REDUCE_ONLY':
                 print(order)
-                order_id = order['id']
-                oanda_trade_id = order.get('tradeOpenedID', '')
-                if not oanda_trade_id:
-                    oanda_trade_id = order.get('tradeReducedID', '')
-                instrument = order['instrument']
-                user_id = None
-                strategy_id = None
-                client_extensions = order.get('clientExtensions', '')
-                if client_extensions:
-                    user_id = client_extensions.get('tag').split("_")[1]
-                    strategy_id = client_extensions.get('comment').split("_")[1]
-                else:
-                    log_info(f"client extensions user_id not found, defaulting user_id to 1 for {order['id']}")
-                    user_id = 1
-                with conn.cursor() as cur:
-                    cur.execute("SELECT trader_id FROM orders WHERE order_id = %s", (order_id,))
-                    trader_id = cur.fetchone()
-                    if trader_id:
-                        trader_id = trader_id[0]
-
-                        cur.execute("UPDATE trades SET user_id = %s WHERE transaction_id = %s", (trader_id, oanda_trade_id))
-                        cur.execute("UPDATE orders SET completed = TRUE WHERE order_id = %s", (order_id,))
-                    cur.execute('SELECT id FROM trades WHERE transaction_id = %s', (oanda_trade_id,))
-                    result = cur.fetchone()
-                    if result:
-                        trade_id = result['id']
-                    if client_extensions and strategy_id:
-
-                        if check_strategy_exists(cur, strategy_id):
-                            update_active_strategy_trade = """UPDATE active_strategies_trades SET trade_id = %s, is_active = %s
-                            WHERE user_id = %s AND strategy_id = %s AND instrument = %s AND trade_id IS NULL;
+                oanda_trade_id = order.trade_id
+                user_id = order.user_id
+                strategy_id = order.strategy_id
+                trade_id = None
+                cur.execute("SELECT trader_id FROM orders WHERE order_id = %s", (order.id,))
+                trader_id = cur.fetchone()
+                if trader_id:
+                    trader_id = trader_id['trader_id']
+                    sync_state['trader_ids'].update((user_id, trader_id))
+
+                    cur.execute("UPDATE trades SET user_id = %s WHERE transaction_id = %s", (trader_id, oanda_trade_id))
+                    cur.execute("UPDATE orders SET completed = TRUE WHERE order_id = %s", (order.id,))
+                cur.execute('SELECT id FROM trades WHERE transaction_id = %s', (oanda_trade_id,))
+                result = cur.fetchone()
+                if result:
+                    trade_id = result['id']
+                if order.tagged and strategy_id:
+
+                    if check_strategy_exists(cur, strategy_id):
+                        # RETURNING rather than cur.rowcount, which is -1 in pipeline mode
+                        update_active_strategy_trade = """UPDATE active_strategies_trades SET trade_id = %s, is_active = %s
+                        WHERE user_id = %s AND strategy_id = %s AND instrument = %s AND trade_id IS NULL
+                        RETURNING id
+                        """
+                        cur.execute(update_active_strategy_trade,
+                                    (trade_id, True, user_id, strategy_id, order.instrument))
+
+                        if cur.fetchone() is None:
+                            print("no rows updated, inserting instead.")
+                            insert_active_strategy_trade = """
+                            INSERT INTO active_strategies_trades (user_id, strategy_id, instrument, trade_id, is_active)
+                            VALUES (%s, %s, %s, %s, %s)
                             """
-                            cur.execute(update_active_strategy_trade,
-                                        (trade_id, True, user_id, strategy_id, instrument))
-                            updated_rows = cur.rowcount
-
-                            if updated_rows == 0:
-                                print("no rows updated, inserting instead.")
-                                insert_active_strategy_trade = """
-                                INSERT INTO active_strategies_trades (user_id, strategy_id, instrument, trade_id, is_active)
-                                VALUES (%s, %s, %s, %s, %s)
-                                """
-                                cur.execute(insert_active_strategy_trade,
-                                            (user_id, strategy_id, instrument, trade_id, True))
-                    conn.commit()
-
-        for order in orders_cancelled:
-            if order['type'] == 'MARKET':
-                order_id = order['id']
-                with conn.cursor() as cur:
-                    cur.execute("UPDATE orders SET completed = TRUE WHERE order_id = %s", (order_id,))
-                    conn.commit()
-    except KeyError:
-        log_error("JSON structure unexpected")
-        raise
+                            cur.execute(insert_active_strategy_trade,
+                                        (user_id, strategy_id, order.instrument, trade_id, True))
+
+        for order in changes.orders_cancelled:
+            if order.type == 'MARKET':
+                cur.execute("UPDATE orders SET completed = TRUE WHERE order_id = %s", (order.id,))
     except Exception as e:
         log_error(f"An error has occurred: {str(e)}")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+        raise
 
 
-def audit_closed_trade_and_update_trader_cash_balance(list_of_closed_trades):
+def audit_closed_trade_and_update_trader_cash_balance(cur, changes, sync_state):
     """
-    Example parameter data type:
-    [{'id': 1, 'user_id': 1, 'realized_pl': Decimal('5.87780'), 'financing': Decimal('-0.13150'), 'close_time': datetime.datetime(2024, 4, 26, 10, 17, 27, 681522, tzinfo=zoneinfo.ZoneInfo(key='Asia/Singapore'))}]
+    Audits all closed trades, credits their net realized P&L to the traders' cash balances and adds them to the
+    traders' daily P&L rollup in one statement.
+    Trades that were already audited are skipped by ON CONFLICT, so their P&L is never credited or rolled up twice.
+    Example sync_state['closed_trades'] data type:
+    [{'id': 1, 'user_id': 1, 'transaction_id': '2130', 'realized_pl': Decimal('5.87780'), 'financing': Decimal('-0.13150'), 'close_time': datetime.datetime(2024, 4, 26, 10, 17, 27, 681522, tzinfo=zoneinfo.ZoneInfo(key='Asia/Singapore'))}]
     """
-    conn = None
+    list_of_closed_trades = sync_state['closed_trades']
+    if not list_of_closed_trades:
+        return
     try:
-        conn = connect_to_db()
-        with conn.cursor() as cur:
-            for closed_trades in list_of_closed_trades:
-                trade_id = closed_trades['id']
-                user_id = closed_trades['user_id']
-                net_realized_pl = closed_trades['realized_pl'] + closed_trades.get('financing', Decimal('0.00'))
-                close_time = closed_trades['close_time']
-
-                find_existing_trade = """SELECT * FROM trade_audit WHERE trade_id = %s"""
-                values = (trade_id,)
-                cur.execute(find_existing_trade, values)
-                result = cur.fetchone()
-                if result:
-                    continue
-                else:
-                    insert_new_audit = """INSERT INTO trade_audit (trade_id, user_id, net_realized_pl, close_time)
-                    VALUES (%s, %s, %s, %s)
-                    """
-                    new_audit_values = (trade_id, user_id, net_realized_pl, close_time)
-                    cur.execute(insert_new_audit, new_audit_values)
-
-                    get_trader_cash_balance = """ SELECT balance FROM cash_balances WHERE trader_id = %s
-                    """
-                    get_trader_balance_values = (user_id,)
-                    cur.execute(get_trader_cash_balance, get_trader_balance_values)
-                    balance = cur.fetchone()[0]
-                    new_balance = balance + net_realized_pl
-
-                    update_trader_cash = """
-                    UPDATE cash_balances
-                    SET balance = %s
-                    WHERE trader_id = %s
-                    """
-                    update_trader_cash_values = (new_balance, user_id)
-                    cur.execute(update_trader_cash, update_trader_cash_values)
-
-            conn.commit()
+        trade_ids = [closed_trade['id'] for closed_trade in list_of_closed_trades]
+        user_ids = [closed_trade['user_id'] for closed_trade in list_of_closed_trades]
+        realized_pls = [closed_trade['realized_pl'] for closed_trade in list_of_closed_trades]
+        financings = [closed_trade['financing'] or Decimal('0.00') for closed_trade in list_of_closed_trades]
+        close_times = [closed_trade['close_time'] for closed_trade in list_of_closed_trades]
+        audit_and_credit_cash_balances = """
+        WITH incoming AS (
+            SELECT *
+            FROM unnest(%s::integer[], %s::integer[], %s::numeric[], %s::numeric[], %s::timestamptz[])
+                 AS incoming (trade_id, user_id, realized_pl, financing, close_time)
+        ), audited AS (
+            INSERT INTO trade_audit (trade_id, user_id, net_realized_pl, close_time)
+            SELECT trade_id, user_id, realized_pl + financing, close_time
+            FROM incoming
+            ON CONFLICT (trade_id) DO NOTHING
+            RETURNING trade_id
+        ), audited_trades AS (
+            SELECT incoming.*
+            FROM incoming
+            JOIN audited ON audited.trade_id = incoming.trade_id
+        ), rolled_up AS (
+            INSERT INTO trader_daily_pnl (user_id, trade_date, net_realized_pl, realized_pl, financing, trades_closed)
+            SELECT user_id, close_time::date, SUM(realized_pl + financing), SUM(realized_pl), SUM(financing), COUNT(*)
+            FROM audited_trades
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id, close_time::date
+            ON CONFLICT (user_id, trade_date) DO UPDATE
+            SET net_realized_pl = trader_daily_pnl.net_realized_pl + EXCLUDED.net_realized_pl,
+                realized_pl = trader_daily_pnl.realized_pl + EXCLUDED.realized_pl,
+                financing = trader_daily_pnl.financing + EXCLUDED.financing,
+                trades_closed = trader_daily_pnl.trades_closed + EXCLUDED.trades_closed
+        )
+        UPDATE cash_balances c
+        SET balance = c.balance + audited_totals.net_realized_pl
+        FROM (
+            SELECT user_id, SUM(realized_pl + financing) AS net_realized_pl
+            FROM audited_trades
+            GROUP BY user_id
+        ) audited_totals
+        WHERE c.trader_id = audited_totals.user_id
+        """
+        cur.execute(audit_and_credit_cash_balances, (trade_ids, user_ids, realized_pls, financings, close_times))
     except Exception as e:
         log_error(f'Error in auditing closed trade.\nClosed trades that failed to log: {list_of_closed_trades}.\nError message: {str(e)}')
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
 
 
-def update_open_trade(response):
-    conn = None
+def update_open_trade(cur, changes, sync_state):
+    """
+    Writes unrealized P&L and margin used of the open trades whose values changed since the last sync,
+    in one statement keyed on transaction_id. Only the owners of changed trades need their nav recomputed.
+    """
     try:
-        open_trades = response['state']['trades']
-        conn = connect_to_db_dict_response()
-        for order in open_trades:
-            unrealized_pl = order['unrealizedPL']
-            margin_used = order['marginUsed']
-            transaction_id = order['id']
-            with conn.cursor() as cur:
-                update_trade = """
-                UPDATE trades SET unrealized_pl = %s, margin_used = %s WHERE id = %s
-                RETURNING unrealized_pl, margin_used
-                """
-                cur.execute(update_trade, (unrealized_pl, margin_used, transaction_id))
-                result = cur.fetchone()
-                conn.commit()
+        open_trades = [(trade_state.id, trade_state.unrealized_pl, trade_state.margin_used)
+                       for trade_state in changes.trade_states.values()]
+        sync_state['open_trades'] = open_trades
+        changed_open_trades = get_changed_open_trades(open_trades)
+        changed_user_ids = update_open_trades(cur, changed_open_trades)
+        sync_state['open_trades_changed'] = sync_state['open_trades_changed'] or bool(changed_user_ids)
+        sync_state['trader_ids'].update(user_id for user_id in changed_user_ids if user_id is not None)
     except Exception as e:
         log_error(f"error occurred updating open trades: {str(e)}")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+        raise
+
 
+def update_trader_nav(cur, changes, sync_state):
+    if sync_state['trader_ids']:
+        recompute_trader_nav(cur, list(sync_state['trader_ids']))
 
-def update_trader_nav():
-    conn = None
+
+def recompute_trader_nav(cur, trader_ids=None):
+    """
+    Sets nav = balance + unrealized P&L for the given traders in one statement.
+    trader_ids: list of trader ids, or None to recompute every trader
+    """
     try:
-        conn = connect_to_db_dict_response()
-        with conn.cursor() as cur:
-            get_unrealized_pl_by_trader = """
-            SELECT user_id, SUM(unrealized_pl) AS sum_of_unrealized_pl
-            FROM trades
-            GROUP BY user_id
-            """
-            cur.execute(get_unrealized_pl_by_trader)
-            results = cur.fetchall()
-            for result in results:
-                unrealized_pl = result['sum_of_unrealized_pl']
-                user_id = result['user_id']
-                update_nav = """
-                UPDATE cash_balances
-                SET nav = balance + %s
-                WHERE trader_id = %s
-                """
-                values = (unrealized_pl, user_id)
-                cur.execute(update_nav, values)
-            conn.commit()
+        update_nav = """
+        UPDATE cash_balances c
+        SET nav = c.balance + unrealized.sum_of_unrealized_pl
+        FROM (
+            SELECT cb.trader_id, COALESCE(SUM(t.unrealized_pl), 0) AS sum_of_unrealized_pl
+            FROM cash_balances cb
+            LEFT JOIN trades t ON t.user_id = cb.trader_id
+            WHERE cb.trader_id IS NOT NULL AND (%(trader_ids)s::integer[] IS NULL OR cb.trader_id = ANY(%(trader_ids)s))
+            GROUP BY cb.trader_id
+        ) unrealized
+        WHERE c.trader_id = unrealized.trader_id
+        """
+        cur.execute(update_nav, {'trader_ids': trader_ids})
     except Exception as e:
         log_error(f'Something went wrong updating trader nav: {str(e)}')
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
 
 
-def update_latest_polled_transaction(response_data):
-    conn = None
+def update_latest_polled_transaction(cur, changes, sync_state):
     try:
-        new_transaction_id = response_data['lastTransactionID']
-        conn = connect_to_db()
-        with conn.cursor() as cur:
-            cur.execute("""INSERT INTO oanda_transaction_log (last_transaction_id) VALUES (%s)""", (new_transaction_id,))
-            conn.commit()
+        new_transaction_id = changes.last_transaction_id
+        cur.execute("""INSERT INTO oanda_transaction_log (last_transaction_id) VALUES (%s)""", (new_transaction_id,))
     except Exception as e:
         log_error(f'Something went wrong updating latest oanda polled transaction: {str(e)}')
-        if conn:
-            conn.rollback()
-            raise
-    finally:
-        if conn:
-            conn.close()
+        raise
 
 
-def update_all_margin_used_and_available():
-    conn = None
+def update_all_margin_used_and_available(cur, changes, sync_state):
+    if sync_state['trader_ids']:
+        recompute_margin_used_and_available(cur, list(sync_state['trader_ids']))
+
+
+def recompute_margin_used_and_available(cur, trader_ids=None):
+    """
+    Sets margin used from the traders' open trades and margin available = nav - margin used in one statement.
+    Run after recompute_trader_nav so margin available is derived from the current nav.
+    trader_ids: list of trader ids, or None to recompute every trader
+    """
     try:
-        conn = connect_to_db_dict_response()
-        with conn.cursor() as cur:
-            get_all_margin_used_by_traders = """
-            SELECT user_id, SUM(margin_used)
-            FROM trades
-            WHERE state_id != 3
-            GROUP BY user_id
-            """
-            cur.execute(get_all_margin_used_by_traders)
-            results = cur.fetchall()
-            if results:
-                for result in results:
-                    trader_id = result['user_id']
-                    margin_used = result.get('margin_used', Decimal('0.00'))
-                    update_margin_used_and_available_for_each_trader = """
-                    UPDATE cash_balances
-                    SET margin_used = %s, margin_available = nav - %s
-                    WHERE trader_id = %s
-                    """
-                    values = (margin_used, margin_used, trader_id)
-                    cur.execute(update_margin_used_and_available_for_each_trader, values)
-        conn.commit()
+        update_margin_used_and_available = """
+        UPDATE cash_balances c
+        SET margin_used = margin.margin_used, margin_available = c.nav - margin.margin_used
+        FROM (
+            SELECT cb.trader_id, COALESCE(SUM(t.margin_used), 0) AS margin_used
+            FROM cash_balances cb
+            LEFT JOIN trades t ON t.user_id = cb.trader_id AND t.state_id != 3
+            WHERE cb.trader_id IS NOT NULL AND (%(trader_ids)s::integer[] IS NULL OR cb.trader_id = ANY(%(trader_ids)s))
+            GROUP BY cb.trader_id
+        ) margin
+        WHERE c.trader_id = margin.trader_id
+        """
+        cur.execute(update_margin_used_and_available, {'trader_ids': trader_ids})
     except Exception as e:
         log_error(f'Error in updating margin used and available: {str(e)}')
-        if conn:
-            conn.rollback()
         raise
+
+
+@syncdata_bp.cli.command('recompute-balances')
+def recompute_balances_command():
+    """Recompute nav, margin used and margin available for every trader: flask syncdata recompute-balances"""
+    with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+        recompute_trader_nav(cur)
+        recompute_margin_used_and_available(cur)
+    print('Recomputed nav and margin for all traders.')
+
+
+@syncdata_bp.cli.command('rebuild-daily-pnl')
+def rebuild_daily_pnl_command():
+    """Rebuild trader_daily_pnl from trade_audit: flask syncdata rebuild-daily-pnl"""
+    rebuild_daily_pnl = """
+    INSERT INTO trader_daily_pnl (user_id, trade_date, net_realized_pl, realized_pl, financing, trades_closed)
+    SELECT a.user_id, a.close_time::date, SUM(a.net_realized_pl), SUM(COALESCE(t.realized_pl, a.net_realized_pl)),
+           SUM(COALESCE(t.financing, 0)), COUNT(*)
+    FROM trade_audit a
+    LEFT JOIN trades t ON t.id = a.trade_id
+    GROUP BY a.user_id, a.close_time::date
+    """
+    with get_connection() as conn, conn.cursor() as cur:
+        # lock out the sync so no closed trade is audited between the delete and the rebuild
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (SYNC_ADVISORY_LOCK_ID,))
+        cur.execute("DELETE FROM trader_daily_pnl")
+        cur.execute(rebuild_daily_pnl)
+        print(f'Rebuilt {cur.rowcount} trader days.')
+
+
+# Order matters: trades must exist before orders are tied to them, closed trades are audited before
+# balances feed into nav, and nav must be current before margin available is derived from it.
+# Run when OANDA reports no new transactions
+OPEN_TRADE_STAGES = [update_open_trade, update_trader_nav, update_all_margin_used_and_available]
+
+SYNC_STAGES = [
+    log_trades_opened,
+    log_trades_reduced,
+    log_trades_closed,
+    tie_order_to_trade_and_active_strategies,
+    update_open_trade,
+    audit_closed_trade_and_update_trader_cash_balance,
+    update_latest_polled_transaction,
+    update_trader_nav,
+    update_all_margin_used_and_available,
+]
+
+
+@syncdata_bp.cli.command('replay')
+@click.option('--conninfo', required=True, help='Scratch database to replay into, e.g. "dbname=traderjoe_scratch user=db_user"')
+@click.option('--journal-dir', default=None, help='Defaults to SYNC_JOURNAL_DIR')
+@click.option('--since', type=int, default=None, help='First sinceTransactionID to replay')
+@click.option('--until', type=int, default=None, help='Last lastTransactionID to replay')
+@click.option('--pipeline/--no-pipeline', default=True, help='Send statements in pipeline mode like the live sync')
+@click.option('--failed', is_flag=True, help='Replay the payloads whose sync rolled back instead of the applied ones')
+def replay_journal_command(conninfo, journal_dir, since, until, pipeline, failed):
+    """Replay journaled OANDA payloads through the sync stages and report per-stage timings: flask syncdata replay"""
+    timings = {}
+    payload_count = 0
+    conn = psycopg.connect(conninfo, row_factory=dict_row)
+    try:
+        for entry in read_journal(journal_dir, since, until, 'failed' if failed else 'applied'):
+            try:
+                started = time.perf_counter()
+                changes = ChangesPayload(entry['payload'])
+                timings['parse payload'] = timings.get('parse payload', 0.0) + time.perf_counter() - started
+                use_pipeline = pipeline and not use_copy(changes.count_changed_trades())
+                with conn.transaction(), (conn.pipeline() if use_pipeline else nullcontext()), conn.cursor() as cur:
+                    apply_changes(cur, changes, timings=timings)
+                    started = time.perf_counter()
+                timings['commit'] = timings.get('commit', 0.0) + time.perf_counter() - started
+            except Exception as e:
+                if not failed:
+                    raise
+                # a payload that failed live is expected to fail here too, report it and move on
+                print(f'changes {entry["since"]}-{entry["last"]} failed again: {type(e).__name__}: {str(e)}'
+                      f' (live: {entry.get("error")})')
+            payload_count += 1
     finally:
-        if conn:
-            conn.close()
+        conn.close()
+    if not payload_count:
+        print('No journal entries matched.')
+        return
+    total = sum(timings.values())
+    print(f'Replayed {payload_count} payloads in {total:.3f}s')
+    for stage_name, seconds in timings.items():
+        print(f'{stage_name:<55} {seconds * 1000:>10.1f} ms  {seconds / payload_count * 1000:>8.2f} ms/payload')
@@ -1,39 +1,125 @@
 from flask import Blueprint, request, jsonify
 from dotenv import load_dotenv
-import os
+import os, json, base64, datetime
 from flask_jwt_extended import jwt_required, get_jwt
 from backend.utilities import log_info, log_error, log_warning
-from backend.db.db import connect_to_db, connect_to_db_dict_response
-from backend.controllers.syncdata import sync_with_oanda
+from backend.db.db import get_connection
+from backend.controllers.syncdata import sync_if_requested, add_sync_headers, cached_response
 
 trades_menu_bp = Blueprint('trades_menu', __name__, url_prefix='/api/tradesMenu')
+trades_menu_bp.after_request(add_sync_headers)
 
 load_dotenv()
 leverage = int(os.environ.get('LEVERAGE'))
 print(f'Leverage: {leverage}')
 
 
+# Columns the history endpoint can return, ?fields= picks a subset. id and close_time are always returned
+# because the next page's cursor is built from them.
+HISTORY_FIELDS = ('id', 'transaction_id', 'user_id', 'strategy_id', 'instrument', 'open_time', 'close_time',
+                  'initial_units', 'current_units', 'price', 'realized_pl', 'financing', 'unrealized_pl',
+                  'margin_used', 'state_id', 'update_time')
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 500
+
+
+def encode_history_cursor(close_time, trade_id):
+    cursor = json.dumps([close_time.isoformat(), trade_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(cursor).decode('ascii')
+
+
+def decode_history_cursor(cursor):
+    close_time, trade_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return datetime.datetime.fromisoformat(close_time), int(trade_id)
+
+
+def get_history_query(args):
+    """
+    Builds the keyset-paginated history query from the request arguments.
+    Returns (fields, conditions, params, limit); raises ValueError on invalid arguments.
+    """
+    fields = HISTORY_FIELDS
+    if args.get('fields'):
+        fields = tuple(field.strip() for field in args['fields'].split(',') if field.strip())
+        invalid_fields = [field for field in fields if field not in HISTORY_FIELDS]
+        if invalid_fields:
+            raise ValueError(f'invalid fields: {", ".join(invalid_fields)}')
+        fields = tuple(dict.fromkeys(('id', 'close_time') + fields))
+
+    limit = int(args.get('limit', HISTORY_PAGE_SIZE))
+    if not 0 < limit <= HISTORY_MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}')
+
+    conditions = []
+    params = {}
+    if args.get('cursor'):
+        try:
+            params['cursor_close_time'], params['cursor_id'] = decode_history_cursor(args['cursor'])
+        except Exception:
+            raise ValueError('invalid cursor')
+        conditions.append('(close_time, id) < (%(cursor_close_time)s, %(cursor_id)s)')
+    if args.get('instrument'):
+        conditions.append('instrument = %(instrument)s')
+        params['instrument'] = args['instrument']
+    if args.get('strategy_id'):
+        conditions.append('strategy_id = %(strategy_id)s')
+        params['strategy_id'] = int(args['strategy_id'])
+    if args.get('from'):
+        conditions.append('close_time >= %(from_time)s')
+        params['from_time'] = datetime.datetime.fromisoformat(args['from'])
+    if args.get('to'):
+        conditions.append('close_time < %(to_time)s')
+        params['to_time'] = datetime.datetime.fromisoformat(args['to'])
+    pnl = args.get('pnl')
+    if pnl == 'positive':
+        conditions.append('realized_pl + financing > 0')
+    elif pnl == 'negative':
+        conditions.append('realized_pl + financing < 0')
+    elif pnl:
+        raise ValueError('pnl must be positive or negative')
+    return fields, conditions, params, limit
+
+
 @trades_menu_bp.get('/history/')
 @jwt_required()
+@cached_response
 def get_trade_history_by_userid():
+    """
+    Closed trades, newest first, one page at a time. Query parameters (all optional):
+    cursor:         next_cursor of the previous page
+    limit:          page size, default 100, at most 500
+    instrument, strategy_id
+    from, to:       ISO 8601 close time range, to is exclusive
+    pnl:            positive | negative net realized P&L
+    fields:         comma separated subset of HISTORY_FIELDS
+    """
     try:
         claims = get_jwt()
         user_id = claims['id']
         if not claims['role'] == 'Trader':
             return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
-        sync_with_oanda()
-        conn = connect_to_db_dict_response()
-        with conn.cursor() as cur:
-            get_closed_trades = """
-            SELECT *
+        try:
+            fields, conditions, params, limit = get_history_query(request.args)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'msg': str(e)}), 400
+        sync_if_requested()
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+            get_closed_trades = f"""
+            SELECT {', '.join(fields)}
             FROM trades
-            WHERE user_id = %s AND state_id = 3
-            ORDER BY close_time DESC
+            WHERE user_id = %(user_id)s AND state_id = 3 AND close_time IS NOT NULL
+            {''.join(f' AND {condition}' for condition in conditions)}
+            ORDER BY close_time DESC, id DESC
+            LIMIT %(limit)s
             """
-            cur.execute(get_closed_trades, (user_id,))
+            # fetch one extra row to know whether there is a next page
+            cur.execute(get_closed_trades, dict(params, user_id=user_id, limit=limit + 1))
             items = cur.fetchall()
-            results = [item for item in items]
-            return jsonify({'history': results})
+            next_cursor = None
+            if len(items) > limit:
+                items = items[:limit]
+                next_cursor = encode_history_cursor(items[-1]['close_time'], items[-1]['id'])
+            return jsonify({'history': items, 'next_cursor': next_cursor})
     except KeyError:
         return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
     except Exception as e:
@@ -44,30 +130,16 @@ def get_trade_history_by_userid():
 
 @trades_menu_bp.get('/summary/')
 @jwt_required()
+@cached_response
 def get_summary_by_userid():
     try:
         claims = get_jwt()
         user_id = claims['id']
         if not claims['role'] == 'Trader':
             return jsonify({'status': 'error', 'msg': 'unauthorized'}), 401
-        sync_with_oanda()
-        conn = connect_to_db_dict_response()
-        with conn.cursor() as cur:
-            get_account_summary = """
-            SELECT 
-                c.balance AS balance,
-                c.margin_used AS margin_used,
-                c.margin_available AS margin_available,
-                c.nav AS nav,
-                (SELECT SUM(net_realized_pl) FROM trade_audit WHERE user_id = %s) AS realized_pl,
-                (SELECT SUM(unrealized_pl) FROM trades WHERE user_id = %s) AS unrealized_pl
-            FROM cash_balances c
-            WHERE c.trader_id = %s
-            """
-            cur.execute(get_account_summary, (user_id, user_id, user_id))
-            result = cur.fetchone()
-            result['currency'] = 'SGD'
-            result['leverage'] = 20
+        sync_if_requested()
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+            result = select_account_summary(cur, user_id)
             print(result)
             return jsonify({'summary': result})
     except KeyError:
@@ -80,6 +152,7 @@ def get_summary_by_userid():
 
 @trades_menu_bp.get("/positions/")
 @jwt_required()
+@cached_response
 def get_positions_by_user():
     try:
         claims = get_jwt()
@@ -88,20 +161,9 @@ def get_positions_by_user():
             user_id = int(user_id)
         except ValueError:
             return jsonify({'status': 'error', 'msg': 'ID must be a positive integer'}), 400
-        sync_with_oanda()
-        conn = connect_to_db_dict_response()
-        with conn.cursor() as cur:
-            get_positions_by_user = """
-                SELECT s.name AS strategy_name, a.instrument AS instrument, t.unrealized_pl AS unrealized_pl, t.current_units AS units, t.transaction_id AS id
-                FROM active_strategies_trades a
-                JOIN strategies s
-                ON a.strategy_id = s.id
-                JOIN trades t
-                ON t.id = a.trade_id
-                WHERE a.user_id = %s AND t.state_id = 1;
-                """
-            cur.execute(get_positions_by_user, (user_id,))
-            positions = cur.fetchall()
+        sync_if_requested()
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+            positions = select_positions(cur, user_id)
         return jsonify({'positions': positions}), 200
     except Exception as e:
         log_error(f'An error has occurred: {str(e)}')
@@ -110,6 +172,7 @@ def get_positions_by_user():
 
 @trades_menu_bp.get("/strategies/")
 @jwt_required()
+@cached_response
 def list_active_strategies_by_user():
     try:
         claims = get_jwt()
@@ -118,24 +181,63 @@ def list_active_strategies_by_user():
             user_id = int(user_id)
         except ValueError:
             return jsonify({'status': 'error', 'msg': 'ID must be a positive integer'}), 400
-        sync_with_oanda()
-        conn = connect_to_db_dict_response()
-        with conn.cursor() as cur:
-            get_strategies_by_user = """
-                SELECT a.id as id, s.name AS strategy_name, a.instrument AS instrument, t.initial_units AS initial_units, 
-                t.current_units AS units, t.transaction_id AS trade_id, a.is_active as is_active, a.pid as pid
-                FROM active_strategies_trades a
-                JOIN strategies s
-                ON a.strategy_id = s.id
-                LEFT JOIN trades t
-                ON t.id = a.trade_id
-                JOIN instruments i
-                ON a.instrument = i.name
-                WHERE a.user_id = %s;
-                """
-            cur.execute(get_strategies_by_user, (user_id,))
-            strategy_instrument_trade = cur.fetchall()
+        sync_if_requested()
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+            strategy_instrument_trade = select_active_strategies(cur, user_id)
         return jsonify({'strategy_instrument_trade': strategy_instrument_trade}), 200
     except Exception as e:
         log_error(f'An error has occurred: {str(e)}')
-        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
\ No newline at end of file
+        return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
+
+
+# Queries shared by the endpoints above and the push stream (controllers/stream.py)
+
+def select_account_summary(cur, user_id):
+    get_account_summary = """
+    SELECT 
+        c.balance AS balance,
+        c.margin_used AS margin_used,
+        c.margin_available AS margin_available,
+        c.nav AS nav,
+        (SELECT SUM(net_realized_pl) FROM trade_audit WHERE user_id = %s) AS realized_pl,
+        (SELECT SUM(unrealized_pl) FROM trades WHERE user_id = %s) AS unrealized_pl
+    FROM cash_balances c
+    WHERE c.trader_id = %s
+    """
+    cur.execute(get_account_summary, (user_id, user_id, user_id))
+    result = cur.fetchone()
+    if result:
+        result['currency'] = 'SGD'
+        result['leverage'] = 20
+    return result
+
+
+def select_positions(cur, user_id):
+    get_positions_by_user = """
+        SELECT s.name AS strategy_name, a.instrument AS instrument, t.unrealized_pl AS unrealized_pl, t.current_units AS units, t.transaction_id AS id
+        FROM active_strategies_trades a
+        JOIN strategies s
+        ON a.strategy_id = s.id
+        JOIN trades t
+        ON t.id = a.trade_id
+        WHERE a.user_id = %s AND t.state_id = 1;
+        """
+    cur.execute(get_positions_by_user, (user_id,))
+    return cur.fetchall()
+
+
+def select_active_strategies(cur, user_id):
+    get_strategies_by_user = """
+        SELECT a.id as id, s.name AS strategy_name, a.instrument AS instrument, t.initial_units AS initial_units, 
+        t.current_units AS units, t.transaction_id AS trade_id, a.is_active as is_active, a.pid as pid
+        FROM active_strategies_trades a
+        JOIN strategies s
+        ON a.strategy_id = s.id
+        LEFT JOIN trades t
+        ON t.id = a.trade_id
+        JOIN instruments i
+        ON a.instrument = i.name
+        WHERE a.user_id = %s;
+        """
+    cur.execute(get_strategies_by_user, (user_id,))
+    return cur.fetchall()
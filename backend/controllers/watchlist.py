@@ -3,7 +3,7 @@ from dotenv import load_dotenv
 import os
 from flask_jwt_extended import jwt_required, get_jwt
 from backend.utilities import log_info, log_error, log_warning
-from backend.db.db import connect_to_db
+from backend.db.db import get_connection
 
 watchlist_bp = Blueprint('watchlist', __name__, url_prefix='/api/watchlist')
 
@@ -16,8 +16,7 @@ def get_watchlist_instrument_by_userid():
     try:
         claims = get_jwt()
         user_id = claims['id']
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             get_watchlist = """
             SELECT *
             FROM watchlist
@@ -38,12 +37,10 @@ def get_watchlist_instrument_by_userid():
 @watchlist_bp.delete('/<int:watchlist_id>/')
 @jwt_required()
 def delete_watchlist_instrument(watchlist_id):
-    conn = None
     try:
-        conn = connect_to_db()
         claims = get_jwt()
         user_id = claims['id']
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             get_delete_item_owner = """
                         SELECT user_id FROM watchlist
                         WHERE id = %s
@@ -67,18 +64,12 @@ def delete_watchlist_instrument(watchlist_id):
     except Exception as e:
         error_message = str(e)
         log_error(error_message)
-        if conn:
-            conn.rollback()
         return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @watchlist_bp.put('/add/')
 @jwt_required()
 def add_instrument_to_watchlist():
-    conn = None
     try:
         data = request.json
         name = data['name']
@@ -87,8 +78,7 @@ def add_instrument_to_watchlist():
         claims = get_jwt()
         user_id = claims['id']
 
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             add_instrument = """
             INSERT INTO watchlist (user_id, name, display_name, type) VALUES (%s, %s, %s, %s)
             RETURNING id, user_id, name, display_name, type
@@ -108,12 +98,7 @@ def add_instrument_to_watchlist():
     except Exception as e:
         error_message = str(e)
         log_error(error_message)
-        if conn:
-            conn.rollback()
         return jsonify({'status': 'error', 'msg': 'an error has occurred'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @watchlist_bp.get('/all/')
@@ -122,8 +107,7 @@ def get_available_instrument():
     try:
         claims = get_jwt()
         user_id = claims['id']
-        conn = connect_to_db()
-        with conn.cursor() as cur:
+        with get_connection() as conn, conn.cursor() as cur:
             get_watchlist = """
             SELECT name, display_name
             FROM instruments
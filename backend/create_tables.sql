@@ -141,6 +141,7 @@ CREATE TABLE IF NOT EXISTS public.trades
     update_time timestamp with time zone DEFAULT CURRENT_TIMESTAMP,
     margin_used numeric(12,5) NOT NULL DEFAULT 0.0000,
     close_time timestamp with time zone,
+    strategy_id integer,
     CONSTRAINT trades_pkey PRIMARY KEY (id),
     CONSTRAINT trades_transaction_id_key UNIQUE (transaction_id),
     CONSTRAINT fk_state_id FOREIGN KEY (state_id)
@@ -158,6 +159,56 @@ TABLESPACE pg_default;
 ALTER TABLE IF EXISTS public.trades
     OWNER to db_user;
 
+-- trades created before strategy_id was recorded
+ALTER TABLE IF EXISTS public.trades
+    ADD COLUMN IF NOT EXISTS strategy_id integer;
+
+-- Index: idx_trades_user_id
+
+-- DROP INDEX IF EXISTS public.idx_trades_user_id;
+
+CREATE INDEX IF NOT EXISTS idx_trades_user_id
+    ON public.trades USING btree
+    (user_id ASC NULLS LAST)
+    TABLESPACE pg_default;
+
+-- Index: idx_trades_open_user_id
+
+-- DROP INDEX IF EXISTS public.idx_trades_open_user_id;
+
+CREATE INDEX IF NOT EXISTS idx_trades_open_user_id
+    ON public.trades USING btree
+    (user_id ASC NULLS LAST)
+    TABLESPACE pg_default
+    WHERE state_id <> 3;
+
+-- Indexes backing the keyset-paginated trade history: newest closed trades first, optionally per instrument
+-- or strategy. All three are partial on closed trades.
+
+-- DROP INDEX IF EXISTS public.idx_trades_closed_history;
+
+CREATE INDEX IF NOT EXISTS idx_trades_closed_history
+    ON public.trades USING btree
+    (user_id ASC NULLS LAST, close_time DESC, id DESC)
+    TABLESPACE pg_default
+    WHERE state_id = 3;
+
+-- DROP INDEX IF EXISTS public.idx_trades_closed_history_instrument;
+
+CREATE INDEX IF NOT EXISTS idx_trades_closed_history_instrument
+    ON public.trades USING btree
+    (user_id ASC NULLS LAST, instrument ASC, close_time DESC, id DESC)
+    TABLESPACE pg_default
+    WHERE state_id = 3;
+
+-- DROP INDEX IF EXISTS public.idx_trades_closed_history_strategy;
+
+CREATE INDEX IF NOT EXISTS idx_trades_closed_history_strategy
+    ON public.trades USING btree
+    (user_id ASC NULLS LAST, strategy_id ASC, close_time DESC, id DESC)
+    TABLESPACE pg_default
+    WHERE state_id = 3;
+
 -- Table: public.trade_audit
 
 -- DROP TABLE IF EXISTS public.trade_audit;
@@ -184,6 +235,32 @@ TABLESPACE pg_default;
 ALTER TABLE IF EXISTS public.trade_audit
     OWNER to db_user;
 
+-- Table: public.trader_daily_pnl
+-- Closed trades rolled up per trader per day (session time zone), maintained by the sync when it audits
+-- closed trades. Rebuild from trade_audit with: flask --app backend.app syncdata rebuild-daily-pnl
+
+-- DROP TABLE IF EXISTS public.trader_daily_pnl;
+
+CREATE TABLE IF NOT EXISTS public.trader_daily_pnl
+(
+    user_id integer NOT NULL,
+    trade_date date NOT NULL,
+    net_realized_pl numeric(15,5) NOT NULL DEFAULT 0,
+    realized_pl numeric(15,5) NOT NULL DEFAULT 0,
+    financing numeric(15,5) NOT NULL DEFAULT 0,
+    trades_closed integer NOT NULL DEFAULT 0,
+    CONSTRAINT trader_daily_pnl_pkey PRIMARY KEY (user_id, trade_date),
+    CONSTRAINT fk_user_id FOREIGN KEY (user_id)
+        REFERENCES public.auth (id) MATCH SIMPLE
+        ON UPDATE NO ACTION
+        ON DELETE NO ACTION
+)
+
+TABLESPACE pg_default;
+
+ALTER TABLE IF EXISTS public.trader_daily_pnl
+    OWNER to db_user;
+
 -- Table: public.oanda_transaction_log
 
 -- DROP TABLE IF EXISTS public.oanda_transaction_log;
@@ -201,6 +278,34 @@ TABLESPACE pg_default;
 ALTER TABLE IF EXISTS public.oanda_transaction_log
     OWNER to db_user;
 
+-- Table: public.oanda_sync_status
+
+-- DROP TABLE IF EXISTS public.oanda_sync_status;
+
+CREATE TABLE IF NOT EXISTS public.oanda_sync_status
+(
+    id integer NOT NULL,
+    last_synced_at timestamp with time zone NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_transaction_id integer,
+    data_version bigint NOT NULL DEFAULT 0,
+    CONSTRAINT oanda_sync_status_pkey PRIMARY KEY (id)
+)
+
+TABLESPACE pg_default;
+
+ALTER TABLE IF EXISTS public.oanda_sync_status
+    OWNER to db_user;
+
+-- data_version is bumped whenever trades, balances or active strategies change without a new OANDA
+-- transaction (open trade P&L refreshes, strategy start / stop). Cached responses are keyed on it.
+ALTER TABLE IF EXISTS public.oanda_sync_status
+    ADD COLUMN IF NOT EXISTS data_version bigint NOT NULL DEFAULT 0;
+
+-- open_trades_version is bumped by every write of open trade unrealized P&L / margin used, by the sync or the
+-- pricing engine, so each can tell when the other has overwritten the values it last wrote.
+ALTER TABLE IF EXISTS public.oanda_sync_status
+    ADD COLUMN IF NOT EXISTS open_trades_version bigint NOT NULL DEFAULT 0;
+
 -- Table: public.strategy_type
 
 -- DROP TABLE IF EXISTS public.strategy_type;
@@ -311,6 +416,94 @@ CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_active_strategies_instruments_with_
     WHERE trade_id IS NOT NULL;
 
 
+-- Table: public.optimization_runs
+-- Parameter sweeps of a strategy, see backend/services/optimizer.py. parameters is the search space,
+-- completed / total the progress, walk_forward the best in-sample parameter set of each fold.
+
+-- DROP TABLE IF EXISTS public.optimization_runs;
+
+CREATE SEQUENCE IF NOT EXISTS public.optimization_runs_id_seq;
+
+CREATE TABLE IF NOT EXISTS public.optimization_runs
+(
+    id integer NOT NULL DEFAULT nextval('optimization_runs_id_seq'::regclass),
+    user_id integer NOT NULL,
+    strategy_id integer NOT NULL,
+    instrument character varying(50) COLLATE pg_catalog."default" NOT NULL,
+    granularity character varying(3) COLLATE pg_catalog."default" NOT NULL,
+    start_time timestamp with time zone,
+    end_time timestamp with time zone,
+    method character varying(10) COLLATE pg_catalog."default" NOT NULL,
+    parameters jsonb NOT NULL,
+    samples integer,
+    seed integer,
+    folds integer NOT NULL DEFAULT 3,
+    train_ratio double precision NOT NULL DEFAULT 0.7,
+    metric character varying(30) COLLATE pg_catalog."default" NOT NULL DEFAULT 'profit',
+    spread double precision NOT NULL DEFAULT 0,
+    status character varying(10) COLLATE pg_catalog."default" NOT NULL DEFAULT 'queued',
+    completed integer NOT NULL DEFAULT 0,
+    total integer NOT NULL DEFAULT 0,
+    walk_forward jsonb,
+    error text COLLATE pg_catalog."default",
+    created_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP,
+    finished_at timestamp with time zone,
+    CONSTRAINT optimization_runs_pkey PRIMARY KEY (id),
+    CONSTRAINT fk_instrument FOREIGN KEY (instrument)
+        REFERENCES public.instruments (name) MATCH SIMPLE
+        ON UPDATE NO ACTION
+        ON DELETE NO ACTION,
+    CONSTRAINT fk_strategy_id FOREIGN KEY (strategy_id)
+        REFERENCES public.strategies (id) MATCH SIMPLE
+        ON UPDATE NO ACTION
+        ON DELETE CASCADE,
+    CONSTRAINT fk_user_id FOREIGN KEY (user_id)
+        REFERENCES public.auth (id) MATCH SIMPLE
+        ON UPDATE NO ACTION
+        ON DELETE NO ACTION
+)
+
+TABLESPACE pg_default;
+
+ALTER TABLE IF EXISTS public.optimization_runs
+    OWNER to db_user;
+
+CREATE INDEX IF NOT EXISTS idx_optimization_runs_strategy
+    ON public.optimization_runs USING btree
+    (strategy_id ASC NULLS LAST, created_at DESC)
+    TABLESPACE pg_default;
+
+-- Table: public.optimization_results
+-- One row per parameter set tried, rank 1 scored best out of sample. in_sample / out_of_sample hold the
+-- backtest summary of every fold.
+
+-- DROP TABLE IF EXISTS public.optimization_results;
+
+CREATE SEQUENCE IF NOT EXISTS public.optimization_results_id_seq;
+
+CREATE TABLE IF NOT EXISTS public.optimization_results
+(
+    id integer NOT NULL DEFAULT nextval('optimization_results_id_seq'::regclass),
+    run_id integer NOT NULL,
+    rank integer NOT NULL,
+    params jsonb NOT NULL,
+    score double precision,
+    in_sample jsonb,
+    out_of_sample jsonb,
+    error text COLLATE pg_catalog."default",
+    CONSTRAINT optimization_results_pkey PRIMARY KEY (id),
+    CONSTRAINT optimization_results_run_rank_key UNIQUE (run_id, rank),
+    CONSTRAINT fk_run_id FOREIGN KEY (run_id)
+        REFERENCES public.optimization_runs (id) MATCH SIMPLE
+        ON UPDATE NO ACTION
+        ON DELETE CASCADE
+)
+
+TABLESPACE pg_default;
+
+ALTER TABLE IF EXISTS public.optimization_results
+    OWNER to db_user;
+
 -- Table: public.orders
 
 -- DROP TABLE IF EXISTS public.orders;
@@ -1,8 +1,116 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
 import psycopg
-from psycopg.rows import dict_row
+from psycopg.rows import dict_row, tuple_row
+from psycopg_pool import ConnectionPool
+from dotenv import load_dotenv
+from backend.utilities import log_warning
+
+load_dotenv()
+database_conninfo = os.environ.get('DATABASE_CONNINFO', 'dbname=traderjoe user=db_user')
+pool_min_size = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+pool_max_size = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+# seconds a request waits for a free connection before giving up with PoolTimeout
+pool_timeout = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+# idle connections above min size are closed after this many seconds
+pool_max_idle = float(os.environ.get('DB_POOL_MAX_IDLE', 300))
+# connections held longer than this many seconds are logged as possible leaks
+pool_leak_warning = float(os.environ.get('DB_POOL_LEAK_WARNING', 30))
+
+# One pool per process, opened on first use. Checked out connections are tracked so /api/metrics/db/ can
+# report occupancy and the oldest checkout, and so connections held too long are logged with their caller.
+
+pool = None
+pool_pid = None
+pool_lock = threading.Lock()
+checked_out = {}
+checked_out_lock = threading.Lock()
+leak_count = 0
+
+
+def get_pool():
+    global pool, pool_pid
+    with pool_lock:
+        # a forked worker must not share its parent's sockets
+        if pool is None or pool_pid != os.getpid():
+            pool = ConnectionPool(database_conninfo, min_size=pool_min_size, max_size=pool_max_size,
+                                  timeout=pool_timeout, max_idle=pool_max_idle,
+                                  check=ConnectionPool.check_connection, name='traderjoe', open=False)
+            pool.open()
+            pool_pid = os.getpid()
+        return pool
+
+
+@contextmanager
+def get_connection(dict_rows=False, caller=None):
+    """
+    Borrows a connection from the pool for the duration of the with block:
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+    The transaction is committed if the block exits normally and rolled back if it raises, then the connection
+    goes back to the pool. Session state (advisory locks, LISTEN, temp tables) outlives the block, release it.
+    dict_rows: fetch rows as dictionaries instead of tuples
+    caller: name logged if the connection is held longer than DB_POOL_LEAK_WARNING
+    """
+    global leak_count
+    with get_pool().connection() as conn:
+        conn.row_factory = dict_row if dict_rows else tuple_row
+        checkout_id = id(conn)
+        checked_out_at = time.monotonic()
+        with checked_out_lock:
+            checked_out[checkout_id] = (checked_out_at, caller or threading.current_thread().name)
+        try:
+            yield conn
+        finally:
+            held_for = time.monotonic() - checked_out_at
+            with checked_out_lock:
+                checked_out.pop(checkout_id, None)
+                if held_for > pool_leak_warning:
+                    leak_count += 1
+            if held_for > pool_leak_warning:
+                log_warning(f'connection held for {held_for:.1f}s by {caller or threading.current_thread().name}',
+                            'get_connection')
+
+
+def get_pool_metrics():
+    """Pool occupancy and wait times, see psycopg_pool ConnectionPool.get_stats() for the counters"""
+    stats = get_pool().get_stats()
+    now = time.monotonic()
+    with checked_out_lock:
+        holders = sorted(checked_out.values())
+    return {
+        'min_size': pool_min_size,
+        'max_size': pool_max_size,
+        'size': stats.get('pool_size', 0),
+        'available': stats.get('pool_available', 0),
+        'in_use': len(holders),
+        'waiting': stats.get('requests_waiting', 0),
+        'requests': stats.get('requests_num', 0),
+        'requests_queued': stats.get('requests_queued', 0),
+        'requests_wait_ms': stats.get('requests_wait_ms', 0),
+        'requests_timeouts': stats.get('requests_errors', 0),
+        'usage_ms': stats.get('usage_ms', 0),
+        'connections_errors': stats.get('connections_errors', 0),
+        'connections_lost': stats.get('connections_lost', 0),
+        'oldest_checkout_seconds': round(now - holders[0][0], 3) if holders else 0,
+        'oldest_checkout_by': holders[0][1] if holders else None,
+        'leak_warnings': leak_count,
+    }
+
+
+def close_pool():
+    global pool
+    with pool_lock:
+        if pool is not None and pool_pid == os.getpid():
+            pool.close()
+        pool = None
+
 
 def connect_to_db():
-    return psycopg.connect("dbname=traderjoe user=db_user")
+    """Dedicated connection outside the pool, for long-lived sessions such as LISTEN. Close it when done."""
+    return psycopg.connect(database_conninfo)
+
 
 def connect_to_db_dict_response():
-    return psycopg.connect("dbname=traderjoe user=db_user", row_factory=dict_row)
+    return psycopg.connect(database_conninfo, row_factory=dict_row)
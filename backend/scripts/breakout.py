@@ -0,0 +1,60 @@
+import sys
+import numpy
+from backend.strategy import Strategy, entry_points
+from backend.strategy.indicators import RollingMax, RollingMin, rolling_max, rolling_min
+
+
+class Breakout(Strategy):
+    """Buys when an H1 bar closes above the highest high of the previous 20 bars, sells below the lowest low"""
+    granularity = 'H1'
+    lookback = 20
+    units = 10000
+
+    async def on_start(self):
+        self.highs = RollingMax(self.lookback)
+        self.lows = RollingMin(self.lookback)
+
+    async def on_candle(self, instrument, granularity, bar):
+        if self.highs.count >= self.lookback:
+            # channel of the previous bars, before this one is added
+            highest = self.highs.value
+            lowest = self.lows.value
+            digits = 2 if 'JPY' in instrument else 5
+            if bar.close > highest:
+                await self.place_market_order(self.units, f'{lowest:.{digits}f}',
+                                              f'{bar.close + (bar.close - lowest):.{digits}f}')
+            elif bar.close < lowest:
+                await self.place_market_order(-self.units, f'{highest:.{digits}f}',
+                                              f'{bar.close - (highest - bar.close):.{digits}f}')
+        self.highs.update(bar.high)
+        self.lows.update(bar.low)
+
+    async def on_fill(self, fill):
+        print(f"filled {fill['units']} {fill['instrument']}")
+        self.stop()
+
+
+def generate_signals(candles, lookback=Breakout.lookback, units=Breakout.units):
+    """The same orders for a whole history at once, for python -m backend.strategy.backtest"""
+    closes = candles['close']
+    # channel of the previous lookback bars
+    highest = numpy.full(len(closes), numpy.nan)
+    lowest = numpy.full(len(closes), numpy.nan)
+    highest[lookback:] = rolling_max(candles['high'], lookback)[lookback - 1:-1]
+    lowest[lookback:] = rolling_min(candles['low'], lookback)[lookback - 1:-1]
+    long = closes > highest
+    short = closes < lowest
+    orders = numpy.where(long, units, numpy.where(short, -units, 0))
+    stop_loss = numpy.where(long, lowest, highest)
+    take_profit = numpy.where(long, closes + (closes - lowest), closes - (highest - closes))
+    return orders, stop_loss, take_profit
+
+
+run, main = entry_points(Breakout)
+
+if __name__ == '__main__':
+    # Example usage, from the repository root: PYTHONPATH=. python backend/scripts/breakout.py EUR_USD
+    if len(sys.argv) < 2:
+        print("Usage: python <script.py> <instrument_name>")
+        sys.exit(1)
+    main(sys.argv[1])
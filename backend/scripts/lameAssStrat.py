@@ -4,6 +4,7 @@ import os
 import sys
 from dotenv import load_dotenv
 from decimal import Decimal, ROUND_HALF_UP
+from backend.services.market_data_client import fetch_latest_candles
 
 load_dotenv()
 oanda_platform = os.environ.get('OANDA_PLATFORM')
@@ -26,10 +27,8 @@ async def get_token():
 
 async def fetch_market_data(instrument_name):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f'{oanda_platform}/v3/accounts/{oanda_account}/candles/latest?candleSpecifications={instrument_name}:D:M', headers={'Authorization': 'Bearer ' + oanda_API_key})
-            response.raise_for_status()
-            return response.json()
+        # one shared upstream poll for every strategy on this instrument, see backend/services/market_data.py
+        return await fetch_latest_candles(instrument_name, 'D')
     except httpx.HTTPStatusError as e:
         print(f"HTTP error occurred: {e}")
     except httpx.RequestError as e:
@@ -0,0 +1,202 @@
+import datetime
+import os
+import re
+import threading
+import time
+import requests
+from dotenv import load_dotenv
+from backend.utilities import log_error, SingleFlight
+
+load_dotenv()
+oanda_platform = os.environ.get('OANDA_PLATFORM')
+oanda_API_key = os.environ.get('OANDA_API_KEY')
+# the forming candle is refetched at most this often, complete candles only once their period ends
+live_candle_ttl = float(os.environ.get('CANDLE_LIVE_TTL', 2))
+# series nobody asked for in this many seconds are dropped
+candle_series_idle = float(os.environ.get('CANDLE_SERIES_IDLE', 600))
+oanda_request_timeout = 10
+
+# Shared candle cache for the charts. Each instrument / granularity series is fetched from OANDA once per process
+# and served to every client from memory. Complete candles never change, so a refresh only asks OANDA for
+# candles from the last complete one onwards. Entries expire when the forming candle may have moved (every
+# CANDLE_LIVE_TTL seconds) and at the candle boundary, whichever comes first. Concurrent refreshes of one series
+# collapse into a single upstream request.
+
+# OANDA's limit for one candles request
+MAX_CANDLE_COUNT = 5000
+# candles OANDA returns for a 'from' request without a count
+DEFAULT_TAIL_COUNT = 500
+GRANULARITY_SECONDS = {
+    'S5': 5, 'S10': 10, 'S15': 15, 'S30': 30,
+    'M1': 60, 'M2': 120, 'M4': 240, 'M5': 300, 'M10': 600, 'M15': 900, 'M30': 1800,
+    'H1': 3600, 'H2': 7200, 'H3': 10800, 'H4': 14400, 'H6': 21600, 'H8': 28800, 'H12': 43200,
+    # a month is at least 28 days, an early boundary only costs one extra refresh
+    'D': 86400, 'W': 604800, 'M': 2419200,
+}
+INSTRUMENT_PATTERN = re.compile(r'^[A-Z0-9]{2,10}_[A-Z0-9]{2,10}$')
+
+series_lock = threading.Lock()
+candle_series = {}
+refresh_flight = SingleFlight()
+upstream_requests = 0
+
+
+class CandleSeries:
+    """Mid candles of one instrument / granularity, oldest first, in OANDA's format"""
+
+    def __init__(self, instrument, granularity):
+        self.instrument = instrument
+        self.granularity = granularity
+        self.candles = []
+        self.count = 0
+        # bumped whenever a refresh changes the candles, streams compare it to what they last sent
+        self.version = 0
+        self.expires_at = 0
+        self.last_used = time.monotonic()
+
+    def is_fresh(self, count):
+        return self.count >= count and time.monotonic() < self.expires_at
+
+    def tail(self, count):
+        return self.candles[-count:]
+
+    def changed_since(self, candle_time):
+        """Candles at or after candle_time, i.e. the last one the client has and everything newer"""
+        return [candle for candle in self.candles if candle['time'] >= candle_time] if candle_time else self.candles
+
+
+def parse_candle_time(candle_time):
+    # OANDA sends RFC 3339 with nanoseconds, e.g. 2024-01-05T14:00:00.000000000Z
+    return datetime.datetime.strptime(candle_time[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+
+
+def get_time_to_live(candles, granularity):
+    """Seconds until the cached candles may be out of date"""
+    if not candles:
+        return live_candle_ttl
+    next_boundary = parse_candle_time(candles[-1]['time']) + datetime.timedelta(
+        seconds=GRANULARITY_SECONDS[granularity])
+    until_boundary = (next_boundary - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    if candles[-1]['complete'] and until_boundary > 0:
+        # market closed with the last period fully formed: nothing changes before the next period opens
+        return until_boundary
+    # forming candle (or a boundary already passed that OANDA has not opened a candle for yet)
+    return max(min(live_candle_ttl, until_boundary), 0.5) if until_boundary > 0 else live_candle_ttl
+
+
+class CandleFetchError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f'OANDA returned {status_code}: {message}')
+        self.status_code = status_code
+
+
+def fetch_candles(instrument, granularity, count=None, from_time=None):
+    global upstream_requests
+    endpoint = f'{oanda_platform}/v3/instruments/{instrument}/candles'
+    params = {'granularity': granularity, 'price': 'M'}
+    if from_time:
+        params['from'] = from_time
+    if count:
+        params['count'] = count
+    headers = {'Authorization': f'Bearer {oanda_API_key}', 'Connection': 'keep-alive'}
+    upstream_requests += 1
+    response = requests.get(endpoint, params=params, headers=headers, timeout=oanda_request_timeout)
+    if response.status_code != 200:
+        raise CandleFetchError(response.status_code, response.text)
+    return response.json().get('candles', [])
+
+
+def merge_candles(candles, new_candles, count):
+    """Replaces candles from the first new candle's time onwards, keeps the newest count candles"""
+    if not new_candles:
+        return candles
+    first_time = new_candles[0]['time']
+    kept = [candle for candle in candles if candle['time'] < first_time]
+    return (kept + new_candles)[-count:]
+
+
+def refresh_series(series, count):
+    complete = [candle for candle in series.candles if candle['complete']]
+    if series.count >= count and complete:
+        # only the tail can have changed: the last complete candle and whatever formed after it
+        new_candles = fetch_candles(series.instrument, series.granularity, from_time=complete[-1]['time'])
+        if len(new_candles) < DEFAULT_TAIL_COUNT:
+            candles = merge_candles(series.candles, new_candles, series.count)
+        else:
+            # the gap is longer than one page, start over rather than leave a hole
+            candles = fetch_candles(series.instrument, series.granularity, count=series.count)
+    else:
+        candles = fetch_candles(series.instrument, series.granularity, count=count)
+        series.count = max(series.count, count)
+    if candles != series.candles:
+        series.candles = candles
+        series.version += 1
+    series.expires_at = time.monotonic() + get_time_to_live(candles, series.granularity)
+    return series
+
+
+def get_series(instrument, granularity, count=500):
+    """
+    Returns the cached CandleSeries, refreshed first if it expired or holds fewer than count candles.
+    Raises ValueError for an unknown instrument format or granularity and CandleFetchError if OANDA refuses.
+    """
+    if not INSTRUMENT_PATTERN.match(instrument or ''):
+        raise ValueError('instrument must look like EUR_USD')
+    if granularity not in GRANULARITY_SECONDS:
+        raise ValueError(f'granularity must be one of {", ".join(GRANULARITY_SECONDS)}')
+    if not 0 < count <= MAX_CANDLE_COUNT:
+        raise ValueError(f'count must be between 1 and {MAX_CANDLE_COUNT}')
+    key = (instrument, granularity)
+    with series_lock:
+        series = candle_series.get(key)
+        if series is None:
+            series = candle_series[key] = CandleSeries(instrument, granularity)
+            created = True
+        else:
+            created = False
+        series.last_used = time.monotonic()
+    if created:
+        prune_idle_series()
+    if series.is_fresh(count):
+        return series
+    try:
+        # whoever finds the series stale first refreshes it, everyone else waits for that request. A caller that
+        # piggybacked on a refresh for fewer candles than it needs goes again.
+        while not series.is_fresh(count):
+            refresh_flight.run(key, lambda: series if series.is_fresh(count) else refresh_series(series, count))
+    except Exception as e:
+        log_error(f'candle refresh of {instrument} {granularity} failed: {str(e)}', 'get_series')
+        if not series.candles:
+            raise
+        # serve the last known candles rather than fail every chart while OANDA is unreachable, and retry later
+        series.expires_at = time.monotonic() + live_candle_ttl
+    return series
+
+
+def watch_series(instrument, granularity, version, timeout):
+    """
+    Blocks until the series moves past version or timeout seconds pass, refreshing it as it expires.
+    Returns the series, or None on timeout. Every stream of a series shares the same refreshes.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        series = get_series(instrument, granularity, 1)
+        if series.version != version:
+            return series
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(remaining, max(series.expires_at - time.monotonic(), 0.1)))
+
+
+def prune_idle_series():
+    now = time.monotonic()
+    with series_lock:
+        for key in [key for key, series in candle_series.items() if now - series.last_used > candle_series_idle]:
+            del candle_series[key]
+
+
+def get_candle_hub_metrics():
+    with series_lock:
+        return {'series': len(candle_series), 'candles': sum(len(series.candles) for series in candle_series.values()),
+                'upstream_requests': upstream_requests}
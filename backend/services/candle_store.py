@@ -0,0 +1,152 @@
+import datetime
+import fcntl
+import os
+from contextlib import contextmanager
+import numpy
+from dotenv import load_dotenv
+from backend.utilities import log_info
+from backend.services.candle_hub import fetch_candles, parse_candle_time, GRANULARITY_SECONDS, INSTRUMENT_PATTERN, \
+    MAX_CANDLE_COUNT
+
+load_dotenv()
+candle_store_dir = os.environ.get('CANDLE_STORE_DIR', './candles')
+# how far back the first backfill of a series reaches when no start is given
+candle_store_default_history = int(os.environ.get('CANDLE_STORE_DEFAULT_HISTORY', 5000))
+
+# Local history of complete mid candles, one directory per series (<CANDLE_STORE_DIR>/<instrument>/<granularity>/)
+# with one flat little-endian file per column. Files are only ever appended to, so the last stored candle is the
+# last entry of time.i8 and a backfill asks OANDA for what came after it. Reads memory-map the files: the arrays
+# returned by read_candles are views of the page cache, slicing a range copies nothing.
+# The time column is written last, its length is the number of complete rows.
+
+COLUMNS = (
+    ('open', numpy.dtype('<f8')),
+    ('high', numpy.dtype('<f8')),
+    ('low', numpy.dtype('<f8')),
+    ('close', numpy.dtype('<f8')),
+    ('volume', numpy.dtype('<i8')),
+    # epoch seconds of the candle's open
+    ('time', numpy.dtype('<i8')),
+)
+
+
+def get_series_dir(instrument, granularity, directory=None):
+    if not INSTRUMENT_PATTERN.match(instrument or ''):
+        raise ValueError('instrument must look like EUR_USD')
+    if granularity not in GRANULARITY_SECONDS:
+        raise ValueError(f'granularity must be one of {", ".join(GRANULARITY_SECONDS)}')
+    return os.path.join(directory or candle_store_dir, instrument, granularity)
+
+
+def get_column_path(series_dir, column, dtype):
+    return os.path.join(series_dir, f'{column}.{dtype.kind}{dtype.itemsize}')
+
+
+def count_stored_rows(series_dir):
+    path = get_column_path(series_dir, 'time', COLUMNS[-1][1])
+    return os.path.getsize(path) // COLUMNS[-1][1].itemsize if os.path.exists(path) else 0
+
+
+def map_column(series_dir, column, dtype, rows):
+    if rows == 0:
+        return numpy.empty(0, dtype=dtype)
+    return numpy.memmap(get_column_path(series_dir, column, dtype), dtype=dtype, mode='r', shape=(rows,))
+
+
+def read_candles(instrument, granularity, start=None, end=None, directory=None):
+    """
+    Stored candles with start <= time < end, as {'time', 'open', 'high', 'low', 'close', 'volume'} read-only
+    NumPy arrays of equal length. time is int64 epoch seconds, start / end are datetimes or epoch seconds.
+    """
+    series_dir = get_series_dir(instrument, granularity, directory)
+    rows = count_stored_rows(series_dir)
+    times = map_column(series_dir, 'time', COLUMNS[-1][1], rows)
+    first = numpy.searchsorted(times, to_epoch(start), side='left') if start is not None else 0
+    last = numpy.searchsorted(times, to_epoch(end), side='left') if end is not None else rows
+    return {column: map_column(series_dir, column, dtype, rows)[first:last] for column, dtype in COLUMNS}
+
+
+def get_last_stored_time(instrument, granularity, directory=None):
+    """Epoch seconds of the newest stored candle, None for an empty series"""
+    times = read_candles(instrument, granularity, directory=directory)['time']
+    return int(times[-1]) if len(times) else None
+
+
+def to_epoch(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return int(value.timestamp())
+    return int(value)
+
+
+def to_columns(candles):
+    return {
+        'open': numpy.array([candle['mid']['o'] for candle in candles], dtype=COLUMNS[0][1]),
+        'high': numpy.array([candle['mid']['h'] for candle in candles], dtype=COLUMNS[1][1]),
+        'low': numpy.array([candle['mid']['l'] for candle in candles], dtype=COLUMNS[2][1]),
+        'close': numpy.array([candle['mid']['c'] for candle in candles], dtype=COLUMNS[3][1]),
+        'volume': numpy.array([candle['volume'] for candle in candles], dtype=COLUMNS[4][1]),
+        'time': numpy.array([to_epoch(parse_candle_time(candle['time'])) for candle in candles], dtype=COLUMNS[5][1]),
+    }
+
+
+@contextmanager
+def lock_series(series_dir):
+    """Serialises writers of one series across processes"""
+    os.makedirs(series_dir, exist_ok=True)
+    with open(os.path.join(series_dir, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def append_candles(series_dir, candles):
+    rows = count_stored_rows(series_dir)
+    columns = to_columns(candles)
+    for column, dtype in COLUMNS:
+        path = get_column_path(series_dir, column, dtype)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            # drop whatever an interrupted append left behind the last complete row
+            f.truncate(rows * dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(columns[column].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def backfill(instrument, granularity, start=None, directory=None):
+    """
+    Appends the complete candles OANDA has after the last stored one. An empty series starts at start or, without
+    one, CANDLE_STORE_DEFAULT_HISTORY candles back. Returns the number of candles added.
+    """
+    series_dir = get_series_dir(instrument, granularity, directory)
+    added = 0
+    with lock_series(series_dir):
+        last_time = get_last_stored_time(instrument, granularity, directory)
+        if last_time is not None:
+            from_time = last_time
+        elif start is not None:
+            from_time = to_epoch(start)
+        else:
+            from_time = int(datetime.datetime.now(datetime.timezone.utc).timestamp()) - \
+                        candle_store_default_history * GRANULARITY_SECONDS[granularity]
+        while True:
+            page = fetch_candles(instrument, granularity, count=MAX_CANDLE_COUNT,
+                                 from_time=datetime.datetime.fromtimestamp(from_time, datetime.timezone.utc)
+                                 .strftime('%Y-%m-%dT%H:%M:%SZ'))
+            complete = [candle for candle in page if candle['complete']
+                        and (last_time is None or to_epoch(parse_candle_time(candle['time'])) > last_time)]
+            if complete:
+                append_candles(series_dir, complete)
+                added += len(complete)
+                last_time = to_epoch(parse_candle_time(complete[-1]['time']))
+                from_time = last_time
+            # a short page, or one ending in the forming candle, reached the present
+            if len(page) < MAX_CANDLE_COUNT or not page[-1]['complete'] or not complete:
+                break
+    if added:
+        log_info(f'stored {added} {instrument} {granularity} candles')
+    return added
@@ -0,0 +1,94 @@
+import csv
+import io
+import zlib
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Encoders for the bulk exports. Each takes an iterator of row batches (lists of tuples, as returned by
+# cursor.fetchmany) and yields bytes as soon as a batch is encoded, so memory use is bounded by one batch
+# no matter how many rows are exported.
+
+
+def parquet_available():
+    return pyarrow is not None
+
+
+def encode_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class ChunkSink:
+    """Write-only file object that hands what was written so far to the caller instead of keeping it"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def get_arrow_type(column_type):
+    return {
+        'integer': pyarrow.int64(),
+        'text': pyarrow.string(),
+        'numeric': pyarrow.decimal128(15, 5),
+        'timestamp': pyarrow.timestamp('us', tz='UTC'),
+    }[column_type]
+
+
+def encode_parquet(columns, column_types, batches):
+    """Each batch becomes one row group"""
+    schema = pyarrow.schema([(column, get_arrow_type(column_type))
+                             for column, column_type in zip(columns, column_types)])
+    sink = ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for batch in batches:
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=schema.field(index).type) for index, column in enumerate(zip(*batch))],
+                schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
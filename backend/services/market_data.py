@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import httpx
+from dotenv import load_dotenv
+from backend.utilities import log_info, log_error, log_warning
+from backend.services.candle_hub import GRANULARITY_SECONDS, INSTRUMENT_PATTERN
+
+load_dotenv()
+oanda_platform = os.environ.get('OANDA_PLATFORM')
+oanda_account = os.environ.get('OANDA_ACCOUNT')
+oanda_API_key = os.environ.get('OANDA_API_KEY')
+market_data_socket = os.environ.get('MARKET_DATA_SOCKET', '/tmp/traderjoe_market_data.sock')
+# seconds between upstream polls, however many strategies are subscribed
+market_data_poll_interval = float(os.environ.get('MARKET_DATA_POLL_INTERVAL', 5))
+max_reconnect_delay = 60
+
+# Local market data daemon for the strategy scripts: python -m backend.services.market_data
+# Strategies connect to MARKET_DATA_SOCKET (see market_data_client) and subscribe to instrument / granularity
+# pairs. The daemon keeps one HTTP client to OANDA and polls candles/latest for every subscribed pair in one
+# batched request, so twenty strategies on EUR_USD H1 cost the same upstream requests as one. Whenever a pair's
+# candles change they are broadcast to its subscribers.
+#
+# The protocol is newline-delimited JSON. Clients send
+#     {"subscribe": ["EUR_USD:H1", ...]}  /  {"unsubscribe": ["EUR_USD:H1"]}
+# and receive, for each change of a subscribed pair, an entry of OANDA's latestCandles list:
+#     {"instrument": "EUR_USD", "granularity": "H1", "candles": [...]}
+# A new subscriber is sent the last known candles straight away. A pair OANDA rejects is dropped and its
+# subscribers get {"error": "...", "specification": "EUR_USD:H1"}; the other pairs keep being polled. An invalid
+# specification in a subscribe is answered the same way.
+
+# candleSpecifications per upstream request, keeps the query string short
+MAX_SPECIFICATIONS_PER_REQUEST = 50
+# a subscriber this many bytes behind is disconnected rather than buffered without limit
+MAX_PENDING_BYTES = 1024 * 1024
+# statuses OANDA answers candles/latest with when a specification in the request is invalid
+REJECTED_SPECIFICATION_STATUSES = (400, 404)
+oanda_request_timeout = 10
+
+
+def parse_specification(specification):
+    """'EUR_USD:H1' -> ('EUR_USD', 'H1'), price component is always mid"""
+    instrument, _, granularity = specification.partition(':')
+    if not INSTRUMENT_PATTERN.match(instrument) or granularity not in GRANULARITY_SECONDS:
+        raise ValueError(f'invalid candle specification {specification}')
+    return instrument, granularity
+
+
+class MarketDataHub:
+    def __init__(self):
+        # 'EUR_USD:H1' -> set of subscriber writers
+        self.subscriptions = {}
+        # 'EUR_USD:H1' -> last broadcast message (bytes)
+        self.latest = {}
+        self.upstream_requests = 0
+        # set when a pair nobody polled before is subscribed, so its first candles don't wait for the next poll
+        self.wake = asyncio.Event()
+
+    def subscribe(self, writer, specifications):
+        for specification in specifications:
+            try:
+                parse_specification(specification)
+            except (ValueError, AttributeError):
+                # refused for this pair only, the client keys the error by specification
+                self.send(writer, (json.dumps({'error': f'invalid candle specification {specification}',
+                                               'specification': specification}) + '\n').encode('utf-8'))
+                continue
+            if specification not in self.subscriptions:
+                self.wake.set()
+            self.subscriptions.setdefault(specification, set()).add(writer)
+            if specification in self.latest:
+                self.send(writer, self.latest[specification])
+
+    def unsubscribe(self, writer, specifications=None):
+        for specification in list(self.subscriptions if specifications is None else specifications):
+            subscribers = self.subscriptions.get(specification)
+            if subscribers is None:
+                continue
+            subscribers.discard(writer)
+            if not subscribers:
+                # nobody listens any more: stop polling it and forget its candles
+                del self.subscriptions[specification]
+                self.latest.pop(specification, None)
+
+    def send(self, writer, message):
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > MAX_PENDING_BYTES:
+            log_warning('dropping a subscriber that stopped reading', 'MarketDataHub.send')
+            self.unsubscribe(writer)
+            writer.close()
+            return
+        writer.write(message)
+
+    def broadcast(self, latest_candles):
+        for entry in latest_candles:
+            specification = f"{entry['instrument']}:{entry['granularity']}"
+            message = (json.dumps(entry) + '\n').encode('utf-8')
+            if self.latest.get(specification) == message or specification not in self.subscriptions:
+                continue
+            self.latest[specification] = message
+            for writer in list(self.subscriptions[specification]):
+                self.send(writer, message)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if 'subscribe' in request:
+                        self.subscribe(writer, request['subscribe'])
+                    if 'unsubscribe' in request:
+                        self.unsubscribe(writer, request['unsubscribe'])
+                except (ValueError, TypeError, AttributeError) as e:
+                    self.send(writer, (json.dumps({'error': str(e)}) + '\n').encode('utf-8'))
+        except ConnectionError:
+            pass
+        finally:
+            self.unsubscribe(writer)
+            writer.close()
+
+    async def fetch_latest_candles(self, client, specifications):
+        latest_candles = []
+        for start in range(0, len(specifications), MAX_SPECIFICATIONS_PER_REQUEST):
+            batch = specifications[start:start + MAX_SPECIFICATIONS_PER_REQUEST]
+            latest_candles.extend(await self.fetch_batch(client, batch))
+        return latest_candles
+
+    async def fetch_batch(self, client, batch):
+        """latestCandles of batch. When OANDA rejects the batch, one of its pairs is bad (delisted instrument,
+        granularity it doesn't serve): the batch is halved until the bad pairs are requested on their own and
+        dropped, so the other pairs in the batch keep their candles"""
+        self.upstream_requests += 1
+        response = await client.get(
+            f'{oanda_platform}/v3/accounts/{oanda_account}/candles/latest',
+            params={'candleSpecifications': ','.join(f'{specification}:M' for specification in batch)})
+        if response.status_code in REJECTED_SPECIFICATION_STATUSES:
+            if len(batch) == 1:
+                self.reject(batch[0], response)
+                return []
+            middle = len(batch) // 2
+            return await self.fetch_batch(client, batch[:middle]) + await self.fetch_batch(client, batch[middle:])
+        response.raise_for_status()
+        return response.json().get('latestCandles', [])
+
+    def reject(self, specification, response):
+        """Sends OANDA's error to the subscribers of specification only and stops polling it"""
+        try:
+            reason = response.json().get('errorMessage')
+        except ValueError:
+            reason = None
+        error = f'OANDA rejected {specification}: {reason or response.status_code}'
+        log_warning(error, 'MarketDataHub.reject')
+        message = (json.dumps({'error': error, 'specification': specification}) + '\n').encode('utf-8')
+        for writer in list(self.subscriptions.get(specification, ())):
+            self.send(writer, message)
+        self.subscriptions.pop(specification, None)
+        self.latest.pop(specification, None)
+
+    async def poll_loop(self, interval):
+        headers = {'Authorization': f'Bearer {oanda_API_key}'}
+        reconnect_delay = 1
+        async with httpx.AsyncClient(headers=headers, timeout=oanda_request_timeout) as client:
+            while True:
+                self.wake.clear()
+                specifications = sorted(self.subscriptions)
+                if specifications:
+                    try:
+                        self.broadcast(await self.fetch_latest_candles(client, specifications))
+                        reconnect_delay = 1
+                    except (httpx.HTTPError, ValueError, AttributeError) as e:
+                        # ValueError / AttributeError: a body that isn't JSON, or not the object OANDA sends
+                        log_warning(f'candle poll failed, retrying in {reconnect_delay}s: {str(e)}', 'poll_loop')
+                        await asyncio.sleep(reconnect_delay)
+                        reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+                        continue
+                try:
+                    await asyncio.wait_for(self.wake.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+
+
+async def serve(path=market_data_socket, interval=market_data_poll_interval):
+    hub = MarketDataHub()
+    if os.path.exists(path):
+        # left behind by a daemon that did not shut down cleanly
+        os.remove(path)
+    server = await asyncio.start_unix_server(hub.handle_client, path=path)
+    os.chmod(path, 0o660)
+    log_info(f'market data daemon listening on {path}, polling every {interval} seconds')
+    try:
+        async with server:
+            await asyncio.gather(server.serve_forever(), hub.poll_loop(interval))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        log_error(f'market data daemon stopped: {str(e)}', 'serve')
+        raise
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import os
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+oanda_platform = os.environ.get('OANDA_PLATFORM')
+oanda_account = os.environ.get('OANDA_ACCOUNT')
+oanda_API_key = os.environ.get('OANDA_API_KEY')
+market_data_socket = os.environ.get('MARKET_DATA_SOCKET', '/tmp/traderjoe_market_data.sock')
+# seconds to wait for the daemon's first candles of a pair before asking OANDA directly
+market_data_timeout = float(os.environ.get('MARKET_DATA_TIMEOUT', 15))
+
+# Client side of the market data daemon (backend/services/market_data.py) for strategy scripts:
+#
+#     from backend.services.market_data_client import fetch_latest_candles
+#     data = await fetch_latest_candles('EUR_USD', 'H1')
+#
+# returns the same {'latestCandles': [...]} as OANDA's candles/latest, so existing analysis code keeps working.
+# The first call connects and subscribes, later calls return the latest candles the daemon broadcast without any
+# round trip. If the daemon is not running, or has not sent the pair's candles within MARKET_DATA_TIMEOUT seconds
+# (stuck, or backing off after upstream errors), the call falls back to asking OANDA directly.
+
+
+class MarketDataConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # 'EUR_USD:H1' -> latest entry of latestCandles
+        self.latest = {}
+        self.subscribed = set()
+        # 'EUR_USD:H1' -> why the daemon refused or stopped polling it
+        self.errors = {}
+        self.updated = asyncio.Condition()
+        self.listener = asyncio.create_task(self.listen())
+
+    async def listen(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                entry = json.loads(line)
+                async with self.updated:
+                    if 'error' in entry and 'specification' in entry:
+                        # the daemon refused the pair or OANDA rejected it, the next subscribe asks again
+                        self.errors[entry['specification']] = entry['error']
+                        self.subscribed.discard(entry['specification'])
+                        self.latest.pop(entry['specification'], None)
+                        self.updated.notify_all()
+                        continue
+                    if 'error' in entry:
+                        # a request the daemon couldn't parse, not tied to any pair's waiters
+                        continue
+                    self.latest[f"{entry['instrument']}:{entry['granularity']}"] = entry
+                    self.updated.notify_all()
+        finally:
+            async with self.updated:
+                self.writer.close()
+                self.updated.notify_all()
+
+    def is_closed(self):
+        return self.listener.done()
+
+    async def subscribe(self, specification):
+        if specification in self.subscribed:
+            return
+        self.subscribed.add(specification)
+        self.writer.write((json.dumps({'subscribe': [specification]}) + '\n').encode('utf-8'))
+        await self.writer.drain()
+
+    async def wait_for(self, specification, previous=None, timeout=None):
+        """Waits until the daemon has sent candles for specification other than previous, returns them.
+        Raises asyncio.TimeoutError after timeout seconds, None waits indefinitely"""
+        async with self.updated:
+            await asyncio.wait_for(
+                self.updated.wait_for(lambda: self.is_closed() or specification in self.errors
+                                      or self.latest.get(specification) not in (None, previous)),
+                timeout)
+            if specification in self.errors:
+                raise ValueError(self.errors.pop(specification))
+            if self.is_closed():
+                raise ConnectionError('market data daemon closed the connection')
+            return self.latest[specification]
+
+
+connection = None
+connection_lock = None
+connection_loop = None
+
+
+async def get_connection():
+    """The event loop's connection to the daemon, (re)connecting if needed"""
+    global connection, connection_lock, connection_loop
+    if connection_loop is not asyncio.get_running_loop():
+        # asyncio.run() was called again, nothing from the previous loop can be reused
+        connection, connection_lock, connection_loop = None, asyncio.Lock(), asyncio.get_running_loop()
+    async with connection_lock:
+        if connection is None or connection.is_closed():
+            reader, writer = await asyncio.open_unix_connection(market_data_socket)
+            connection = MarketDataConnection(reader, writer)
+        return connection
+
+
+async def fetch_from_oanda(instrument, granularity):
+    async with httpx.AsyncClient() as client:
+        response = await client.get(f'{oanda_platform}/v3/accounts/{oanda_account}/candles/latest',
+                                    params={'candleSpecifications': f'{instrument}:{granularity}:M'},
+                                    headers={'Authorization': 'Bearer ' + oanda_API_key})
+        response.raise_for_status()
+        return response.json()
+
+
+async def fetch_latest_candles(instrument, granularity):
+    """OANDA candles/latest response for one instrument / granularity, mid prices"""
+    specification = f'{instrument}:{granularity}'
+    try:
+        daemon = await get_connection()
+        await daemon.subscribe(specification)
+        return {'latestCandles': [await daemon.wait_for(specification, timeout=market_data_timeout)]}
+    except (OSError, ConnectionError, asyncio.TimeoutError):
+        return await fetch_from_oanda(instrument, granularity)
+
+
+async def watch_latest_candles(instrument, granularity):
+    """Yields the candles/latest entry of instrument / granularity every time the daemon broadcasts a change"""
+    specification = f'{instrument}:{granularity}'
+    daemon = await get_connection()
+    await daemon.subscribe(specification)
+    entry = None
+    while True:
+        entry = await daemon.wait_for(specification, entry)
+        yield entry
@@ -0,0 +1,107 @@
+from backend.utilities import log_info
+
+# Parsed view of an OANDA /v3/accounts/{id}/changes response. Built once per sync: client extension tags are
+# parsed once per trade and order, and stages look up an open trade's calculated state by id instead of
+# scanning the raw list.
+
+DEFAULT_USER_ID = 1
+
+
+def parse_client_extensions(client_extensions, object_id):
+    """
+    Orders created through /api/order/oanda/create/ are tagged {'tag': 'trader_<id>', 'comment': 'strategy_<id>'}.
+    Returns (user_id, strategy_id). Untagged trades and orders, e.g. placed on the OANDA platform directly,
+    default to user 1 with no strategy.
+    """
+    if not client_extensions:
+        log_info(f"client extensions user_id not found, defaulting user_id to {DEFAULT_USER_ID} for {object_id}")
+        return DEFAULT_USER_ID, None
+    user_id = int(client_extensions.get('tag').split("_")[1])
+    comment = client_extensions.get('comment')
+    strategy_id = int(comment.split("_")[1]) if comment else None
+    return user_id, strategy_id
+
+
+class Record:
+    __slots__ = ()
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class TradeRecord(Record):
+    __slots__ = ('id', 'user_id', 'strategy_id', 'tagged', 'instrument', 'state', 'open_time', 'close_time',
+                 'current_units', 'initial_units', 'financing', 'price', 'realized_pl')
+
+    def __init__(self, trade):
+        self.id = trade['id']
+        client_extensions = trade.get('clientExtensions')
+        self.tagged = bool(client_extensions)
+        self.user_id, self.strategy_id = parse_client_extensions(client_extensions, self.id)
+        self.instrument = trade['instrument']
+        self.state = trade['state']
+        self.open_time = trade['openTime']
+        self.close_time = trade.get('closeTime')
+        self.current_units = trade['currentUnits']
+        self.initial_units = trade['initialUnits']
+        self.financing = trade['financing']
+        self.price = trade['price']
+        self.realized_pl = trade['realizedPL']
+
+
+class TradeStateRecord(Record):
+    """Calculated state of an open trade, from response['state']['trades']"""
+    __slots__ = ('id', 'unrealized_pl', 'margin_used')
+
+    def __init__(self, trade_state):
+        self.id = trade_state['id']
+        self.unrealized_pl = trade_state['unrealizedPL']
+        self.margin_used = trade_state['marginUsed']
+
+
+class OrderRecord(Record):
+    __slots__ = ('id', 'user_id', 'strategy_id', 'tagged', 'type', 'state', 'position_fill', 'instrument', 'trade_id')
+
+    def __init__(self, order):
+        self.id = order['id']
+        self.type = order['type']
+        self.state = order['state']
+        self.position_fill = order.get('positionFill')
+        self.instrument = order.get('instrument')
+        self.trade_id = order.get('tradeOpenedID') or order.get('tradeReducedID') or None
+        client_extensions = order.get('clientExtensions')
+        self.tagged = bool(client_extensions)
+        if self.type == 'MARKET':
+            self.user_id, self.strategy_id = parse_client_extensions(client_extensions, self.id)
+        else:
+            # stop loss / take profit orders are never tagged, don't log them as missing tags
+            self.user_id, self.strategy_id = DEFAULT_USER_ID, None
+
+
+class ChangesPayload:
+    __slots__ = ('last_transaction_id', 'trades_opened', 'trades_reduced', 'trades_closed', 'orders_filled',
+                 'orders_cancelled', 'trade_states')
+
+    def __init__(self, response):
+        changes = response['changes']
+        self.last_transaction_id = response['lastTransactionID']
+        self.trades_opened = [TradeRecord(trade) for trade in changes['tradesOpened']]
+        self.trades_reduced = [TradeRecord(trade) for trade in changes['tradesReduced']]
+        self.trades_closed = [TradeRecord(trade) for trade in changes['tradesClosed']]
+        self.orders_filled = [OrderRecord(order) for order in changes['ordersFilled']]
+        self.orders_cancelled = [OrderRecord(order) for order in changes['ordersCancelled']]
+
+        self.trade_states = {trade_state['id']: TradeStateRecord(trade_state)
+                             for trade_state in response['state']['trades']}
+
+    def unrealized_pl(self, trade_id):
+        trade_state = self.trade_states.get(trade_id)
+        return trade_state.unrealized_pl if trade_state else 0
+
+    def margin_used(self, trade_id):
+        trade_state = self.trade_states.get(trade_id)
+        return trade_state.margin_used if trade_state else 0
+
+    def count_changed_trades(self):
+        return max(len(self.trades_opened), len(self.trades_reduced), len(self.trades_closed))
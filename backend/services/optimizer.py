@@ -0,0 +1,311 @@
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy
+from psycopg.types.json import Jsonb
+from dotenv import load_dotenv
+from backend.utilities import log_info, log_error
+from backend.db.db import get_connection
+from backend.services.candle_store import read_candles, backfill
+from backend.strategy.backtest import Market, generate_orders, format_time
+from backend.strategy.sdk import load_script
+
+load_dotenv()
+# worker processes per optimization, 0 for one per CPU
+optimizer_workers = int(os.environ.get('OPTIMIZER_WORKERS', 0))
+# most parameter sets one optimization may try
+optimizer_max_combinations = int(os.environ.get('OPTIMIZER_MAX_COMBINATIONS', 1000))
+# optimizations the API runs at once across all traders, each one uses OPTIMIZER_WORKERS processes
+optimizer_max_runs = int(os.environ.get('OPTIMIZER_MAX_RUNS', 2))
+# seconds between progress updates written to optimization_runs
+progress_interval = 1
+
+# Parameter sweeps of a strategy script over stored candles, run as python -m backend.services.optimizer <run_id>
+# for a row of optimization_runs (POST /api/strategy/optimize/ inserts it and starts this in its own process).
+#
+# The candles are copied once into a shared memory block, and every worker of a ProcessPoolExecutor maps it
+# instead of receiving pickled arrays. Workers load the script once and then each task backtests one parameter
+# set, see backend.strategy.backtest, on every walk-forward split. Workers are spawned, not forked, because this
+# process holds connection pool threads.
+#
+# Walk-forward: the first train_ratio of the history is the first fold's training window, and the rest is cut
+# into `folds` test windows. Each fold trains on the train_ratio-long window just before its test window. Orders
+# are generated over training + test window together so indicators are warm, then the orders placed in each
+# window are backtested on that window's bars alone: positions still open when the training window ends are
+# closed there, so the in-sample results never see test window prices. A parameter set's score is its metric
+# averaged over the out-of-sample windows, and results are stored ranked by it in optimization_results.
+# optimization_runs.walk_forward has, per fold, the parameter set that scored best in sample and how it did out
+# of sample, which is what walk-forward optimization would have traded. With 0 folds everything is scored on
+# the whole history.
+#
+# Parameter spaces are {name: [value, ...]} or {name: {'min': 10, 'max': 50, 'step': 5}}. A grid tries every
+# combination. A random search draws `samples` distinct ones, uniformly between min and max when there is no step.
+
+METHODS = ('grid', 'random')
+METRICS = ('profit', 'return', 'profit_factor', 'win_rate', 'profit_to_drawdown')
+
+worker_state = {}
+
+
+def get_parameter_values(name, spec):
+    """[10, 20] as is, {'min': 10, 'max': 30, 'step': 10} as [10, 20, 30], {'min', 'max'} as None (continuous)"""
+    if isinstance(spec, list) and spec:
+        return spec
+    if not isinstance(spec, dict) or not isinstance(spec.get('min'), (int, float)) \
+            or not isinstance(spec.get('max'), (int, float)) or spec['min'] > spec['max']:
+        raise ValueError(f'{name} must be a list of values or {{"min", "max", "step"}}')
+    step = spec.get('step')
+    if step is None:
+        return None
+    if not isinstance(step, (int, float)) or step <= 0:
+        raise ValueError(f'{name} step must be a positive number')
+    count = int((spec['max'] - spec['min']) / step + 1e-9) + 1
+    if count > optimizer_max_combinations:
+        raise ValueError(f'{name} has more than {optimizer_max_combinations} values')
+    # integer bounds and step give integers
+    return [spec['min'] + index * step if isinstance(step, int) and isinstance(spec['min'], int)
+            else round(spec['min'] + index * step, 10) for index in range(count)]
+
+
+def get_parameter_sets(space, method='grid', samples=50, seed=None):
+    """The parameter sets to try, as a list of {name: value}. Raises ValueError for an invalid space."""
+    if not isinstance(space, dict) or not space:
+        raise ValueError('parameters must map parameter names to values')
+    if method not in METHODS:
+        raise ValueError(f'method must be one of {", ".join(METHODS)}')
+    values = {name: get_parameter_values(name, spec) for name, spec in space.items()}
+    if method == 'grid':
+        if any(options is None for options in values.values()):
+            raise ValueError('a grid needs a list or a step for every parameter')
+        total = 1
+        for options in values.values():
+            total *= len(options)
+        if total > optimizer_max_combinations:
+            raise ValueError(f'{total} combinations, at most {optimizer_max_combinations} are allowed')
+        return [dict(zip(values, combination)) for combination in itertools.product(*values.values())]
+    if not isinstance(samples, int) or not 0 < samples <= optimizer_max_combinations:
+        raise ValueError(f'samples must be between 1 and {optimizer_max_combinations}')
+    generator = random.Random(seed)
+    parameter_sets = {}
+    # a small discrete space has fewer distinct sets than samples
+    for _ in range(samples * 10):
+        parameter_set = {}
+        for name, options in values.items():
+            if options is not None:
+                parameter_set[name] = generator.choice(options)
+            elif isinstance(space[name]['min'], int) and isinstance(space[name]['max'], int):
+                parameter_set[name] = generator.randint(space[name]['min'], space[name]['max'])
+            else:
+                parameter_set[name] = generator.uniform(space[name]['min'], space[name]['max'])
+        parameter_sets.setdefault(json.dumps(parameter_set, sort_keys=True), parameter_set)
+        if len(parameter_sets) == samples:
+            break
+    return list(parameter_sets.values())
+
+
+def get_walk_forward_splits(bars, folds, train_ratio):
+    """[(train_start, test_start, test_end)] bar indexes per fold, see the top of this module"""
+    if folds == 0:
+        return [(0, 0, bars)]
+    if not 0 < train_ratio < 1:
+        raise ValueError('train_ratio must be between 0 and 1')
+    train = int(bars * train_ratio)
+    test = (bars - train) // folds
+    if train < 1 or test < 1:
+        raise ValueError(f'{bars} candles are not enough for {folds} folds')
+    return [(fold * test, fold * test + train, fold * test + train + test) for fold in range(folds)]
+
+
+def share_candles(candles):
+    """Copies the candle columns into one new shared memory block, returns it and where each column is"""
+    columns = [(column, numpy.ascontiguousarray(values)) for column, values in candles.items()]
+    memory = shared_memory.SharedMemory(create=True, size=max(sum(values.nbytes for _, values in columns), 1))
+    layout = []
+    offset = 0
+    for column, values in columns:
+        numpy.ndarray(values.shape, dtype=values.dtype, buffer=memory.buf, offset=offset)[:] = values
+        layout.append((column, values.dtype.str, len(values), offset))
+        offset += values.nbytes
+    return memory, layout
+
+
+def init_worker(memory_name, layout, script_path, instrument, granularity, spread):
+    memory = shared_memory.SharedMemory(name=memory_name)
+    worker_state.update({
+        # the block must stay mapped as long as the arrays are used
+        'memory': memory,
+        'candles': {column: numpy.ndarray((length,), dtype=dtype, buffer=memory.buf, offset=offset)
+                    for column, dtype, length, offset in layout},
+        'module': load_script(script_path, 'optimized_script'),
+        'instrument': instrument,
+        'granularity': granularity,
+        'spread': spread,
+        'markets': {},
+    })
+
+
+def get_market(start, end):
+    """Market over bars start:end of the shared candles, built once per worker"""
+    markets = worker_state['markets']
+    if (start, end) not in markets:
+        markets[(start, end)] = Market({column: values[start:end] for column, values in worker_state['candles'].items()},
+                                       worker_state['instrument'], worker_state['spread'])
+    return markets[(start, end)]
+
+
+def evaluate_parameters(params, splits):
+    """In and out of sample backtest summaries of one parameter set per split, runs in a worker"""
+    result = {'params': params, 'folds': [], 'error': None}
+    try:
+        for train_start, test_start, test_end in splits:
+            # signals over training + test window together so indicators are warm at the start of the test window
+            units, stop_loss, take_profit = generate_orders(worker_state['module'], get_market(train_start, test_end),
+                                                            worker_state['granularity'], params)
+            units = numpy.asarray(units)
+            stop_loss = numpy.broadcast_to(numpy.asarray(stop_loss, dtype=numpy.float64), units.shape)
+            take_profit = numpy.broadcast_to(numpy.asarray(take_profit, dtype=numpy.float64), units.shape)
+            boundary = test_start - train_start
+            in_sample = None
+            if boundary:
+                in_sample = get_market(train_start, test_start).backtest(
+                    units[:boundary], stop_loss[:boundary], take_profit[:boundary]).summary()
+            out_of_sample = get_market(test_start, test_end).backtest(
+                units[boundary:], stop_loss[boundary:], take_profit[boundary:]).summary()
+            result['folds'].append({'in_sample': in_sample, 'out_of_sample': out_of_sample})
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {str(e)}'
+    return result
+
+
+def sweep(script_path, candles, instrument, granularity, parameter_sets, splits, spread=0.0, workers=None,
+          report_progress=None):
+    """Results of evaluate_parameters for every parameter set, in completion order"""
+    memory, layout = share_candles(candles)
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers or optimizer_workers or os.cpu_count(),
+                                 mp_context=multiprocessing.get_context('spawn'), initializer=init_worker,
+                                 initargs=(memory.name, layout, script_path, instrument, granularity, spread)) \
+                as executor:
+            futures = [executor.submit(evaluate_parameters, params, splits) for params in parameter_sets]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if report_progress:
+                    report_progress(len(results))
+    finally:
+        memory.close()
+        memory.unlink()
+    return results
+
+
+def get_metric(summary, metric):
+    if summary is None:
+        return None
+    if metric == 'profit_to_drawdown':
+        return summary['profit'] / summary['max_drawdown'] if summary['max_drawdown'] else None
+    return summary[metric]
+
+
+def get_score(result, metric, sample='out_of_sample'):
+    """Mean of the metric over the folds, None if it is undefined in every fold (e.g. no trades)"""
+    values = [get_metric(fold[sample], metric) for fold in result['folds']]
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+
+def rank_results(results, metric):
+    """Best first: scored results by score, then unscored ones, then failed ones"""
+    for result in results:
+        result['score'] = get_score(result, metric) if not result['error'] else None
+    return sorted(results, key=lambda result: (result['error'] is not None, result['score'] is None,
+                                               -(result['score'] or 0)))
+
+
+def get_walk_forward(results, splits, times, metric):
+    """Per fold, the parameter set with the best in-sample metric and its out-of-sample summary"""
+    walk_forward = []
+    for fold, (train_start, test_start, test_end) in enumerate(splits):
+        candidates = [(get_metric(result['folds'][fold]['in_sample'], metric), index)
+                      for index, result in enumerate(results) if not result['error']]
+        candidates = [candidate for candidate in candidates if candidate[0] is not None]
+        best = results[max(candidates)[1]] if candidates else None
+        walk_forward.append({
+            'fold': fold,
+            'train_start': format_time(times[train_start]) if test_start > train_start else None,
+            'test_start': format_time(times[test_start]),
+            'test_end': format_time(times[test_end - 1]),
+            'params': best['params'] if best else None,
+            'in_sample': best['folds'][fold]['in_sample'] if best else None,
+            'out_of_sample': best['folds'][fold]['out_of_sample'] if best else None,
+        })
+    return walk_forward
+
+
+def run_optimization(run_id):
+    with get_connection(dict_rows=True, caller='run_optimization') as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT r.*, s.script_path FROM optimization_runs r JOIN strategies s ON s.id = r.strategy_id
+            WHERE r.id = %s""", (run_id,))
+        run = cur.fetchone()
+        if not run:
+            raise ValueError(f'optimization run {run_id} not found')
+        cur.execute("UPDATE optimization_runs SET status = 'running' WHERE id = %s", (run_id,))
+    try:
+        backfill(run['instrument'], run['granularity'], run['start_time'])
+        candles = read_candles(run['instrument'], run['granularity'], run['start_time'], run['end_time'])
+        splits = get_walk_forward_splits(len(candles['time']), run['folds'], run['train_ratio'])
+        parameter_sets = get_parameter_sets(run['parameters'], run['method'], run['samples'], run['seed'])
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute('UPDATE optimization_runs SET total = %s WHERE id = %s', (len(parameter_sets), run_id))
+        last_report = [time.monotonic()]
+
+        def report_progress(completed):
+            if completed == len(parameter_sets) or time.monotonic() - last_report[0] >= progress_interval:
+                last_report[0] = time.monotonic()
+                with get_connection() as conn, conn.cursor() as cur:
+                    cur.execute('UPDATE optimization_runs SET completed = %s WHERE id = %s', (completed, run_id))
+
+        # script paths are stored relative to the app's root, backend/
+        script_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), run['script_path'])
+        started_at = time.monotonic()
+        results = rank_results(sweep(script_path, candles, run['instrument'], run['granularity'], parameter_sets,
+                                     splits, run['spread'], report_progress=report_progress), run['metric'])
+        walk_forward = get_walk_forward(results, splits, candles['time'], run['metric'])
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.executemany("""
+                INSERT INTO optimization_results (run_id, rank, params, score, in_sample, out_of_sample, error)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                [(run_id, rank, Jsonb(result['params']), result['score'],
+                  Jsonb([fold['in_sample'] for fold in result['folds']]),
+                  Jsonb([fold['out_of_sample'] for fold in result['folds']]), result['error'])
+                 for rank, result in enumerate(results, start=1)])
+            cur.execute("""
+                UPDATE optimization_runs SET status = 'done', walk_forward = %s, finished_at = now() WHERE id = %s
+                """, (Jsonb(walk_forward), run_id))
+        log_info(f'optimization {run_id}: {len(parameter_sets)} parameter sets x {len(splits)} folds over '
+                 f'{len(candles["time"])} candles in {time.monotonic() - started_at:.1f}s')
+    except Exception as e:
+        log_error(f'optimization {run_id} failed: {str(e)}', 'run_optimization')
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE optimization_runs SET status = 'failed', error = %s, finished_at = now() WHERE id = %s
+                """, (str(e), run_id))
+        raise
+
+
+def to_datetime(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc) if epoch is not None else None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python -m backend.services.optimizer <optimization_run_id>')
+        sys.exit(1)
+    run_optimization(int(sys.argv[1]))
@@ -0,0 +1,262 @@
+import os
+import threading
+import time
+import requests
+from dotenv import load_dotenv
+from backend.utilities import log_info, log_error, log_warning
+from backend.db.db import get_connection
+from backend.controllers.syncdata import recompute_trader_nav, recompute_margin_used_and_available, bump_data_version
+from backend.services.trade_writer import update_open_trades, forget_open_trades, bump_open_trades_version
+from backend.services.transaction_stream import parse_stream_lines
+
+load_dotenv()
+oanda_stream_platform = os.environ.get('OANDA_STREAM_PLATFORM', 'https://stream-fxpractice.oanda.com')
+oanda_account = os.environ.get('OANDA_ACCOUNT')
+oanda_API_key = os.environ.get('OANDA_API_KEY')
+leverage = int(os.environ.get('LEVERAGE'))
+# write marked-to-market values to Postgres at most this often...
+flush_interval = float(os.environ.get('PRICING_FLUSH_INTERVAL', 5))
+# ...unless a trader's nav moved by at least this much (account currency) since the last write
+material_change = float(os.environ.get('PRICING_MATERIAL_CHANGE', 5))
+stream_timeout = float(os.environ.get('OANDA_STREAM_TIMEOUT', 20))
+max_reconnect_delay = 60
+
+# Local pricing engine: streams bid/ask for the instruments of open trades and marks the open trades to market
+# in memory on every tick. Per trader unrealized P&L and margin are kept as running totals, so a tick only
+# touches the positions in its instrument. Postgres is written on a throttle (see flush_interval and
+# material_change). The book reloads from the database whenever the sync worker applies new transactions or
+# refreshes open trades with OANDA's figures (oanda_sync_status.open_trades_version, which flushes bump too).
+# Run it inside the API process (PRICING_STREAM=thread) or on its own: python -m backend.services.pricing
+
+pricing_thread = None
+stop_event = threading.Event()
+
+
+class OpenPosition:
+    __slots__ = ('transaction_id', 'user_id', 'instrument', 'units', 'price', 'unrealized_pl', 'margin_used', 'dirty')
+
+    def __init__(self, trade):
+        self.transaction_id = trade['transaction_id']
+        self.user_id = trade['user_id']
+        self.instrument = trade['instrument']
+        self.units = float(trade['current_units'])
+        self.price = float(trade['price'])
+        self.unrealized_pl = float(trade['unrealized_pl'])
+        self.margin_used = float(trade['margin_used'])
+        self.dirty = False
+
+
+class PositionBook:
+    def __init__(self, margin_rate):
+        self.margin_rate = margin_rate
+        self.positions = {}
+        self.positions_by_instrument = {}
+        self.balances = {}
+        self.unrealized_pl = {}
+        self.margin_used = {}
+        self.flushed_nav = {}
+        self.dirty_traders = set()
+
+    def load(self, open_trades, balances):
+        self.positions = {}
+        self.positions_by_instrument = {}
+        self.balances = {balance['trader_id']: float(balance['balance']) for balance in balances}
+        self.unrealized_pl = dict.fromkeys(self.balances, 0.0)
+        self.margin_used = dict.fromkeys(self.balances, 0.0)
+        self.dirty_traders = set()
+        for trade in open_trades:
+            position = OpenPosition(trade)
+            self.positions[position.transaction_id] = position
+            self.positions_by_instrument.setdefault(position.instrument, []).append(position)
+            self.unrealized_pl[position.user_id] = self.unrealized_pl.get(position.user_id, 0.0) + position.unrealized_pl
+            self.margin_used[position.user_id] = self.margin_used.get(position.user_id, 0.0) + position.margin_used
+        self.flushed_nav = {trader_id: self.nav(trader_id) for trader_id in self.balances}
+
+    def instruments(self):
+        return sorted(self.positions_by_instrument)
+
+    def nav(self, trader_id):
+        return self.balances.get(trader_id, 0.0) + self.unrealized_pl.get(trader_id, 0.0)
+
+    def margin_available(self, trader_id):
+        return self.nav(trader_id) - self.margin_used.get(trader_id, 0.0)
+
+    def apply_price(self, price):
+        """
+        Marks every open position in the price's instrument to market. Longs close at the bid and shorts at the
+        ask; quote currency P&L is converted with OANDA's quoteHomeConversionFactors. Margin is approximated as
+        notional at mid / LEVERAGE, the sync worker overwrites it with OANDA's figure on the next sync.
+        """
+        positions = self.positions_by_instrument.get(price['instrument'])
+        conversion_factors = price.get('quoteHomeConversionFactors')
+        if not positions or not conversion_factors:
+            return
+        bid = float(price.get('closeoutBid') or price['bids'][0]['price'])
+        ask = float(price.get('closeoutAsk') or price['asks'][0]['price'])
+        mid = (bid + ask) / 2
+        for position in positions:
+            if position.units > 0:
+                close_price, conversion_factor = bid, float(conversion_factors['positiveUnits'])
+            else:
+                close_price, conversion_factor = ask, float(conversion_factors['negativeUnits'])
+            unrealized_pl = round((close_price - position.price) * position.units * conversion_factor, 5)
+            margin_used = round(abs(position.units) * mid * conversion_factor * self.margin_rate, 5)
+            if unrealized_pl == position.unrealized_pl and margin_used == position.margin_used:
+                continue
+            self.unrealized_pl[position.user_id] += unrealized_pl - position.unrealized_pl
+            self.margin_used[position.user_id] += margin_used - position.margin_used
+            position.unrealized_pl = unrealized_pl
+            position.margin_used = margin_used
+            position.dirty = True
+            self.dirty_traders.add(position.user_id)
+
+    def has_material_change(self, threshold):
+        return any(abs(self.nav(trader_id) - self.flushed_nav.get(trader_id, 0.0)) >= threshold
+                   for trader_id in self.dirty_traders)
+
+    def get_dirty(self):
+        """Returns ([(transaction_id, unrealized_pl, margin_used) ...], [trader_id ...]) changed since the last flush"""
+        dirty_positions = [(position.transaction_id, position.unrealized_pl, position.margin_used)
+                           for position in self.positions.values() if position.dirty]
+        return dirty_positions, list(self.dirty_traders)
+
+    def mark_flushed(self, dirty_positions, dirty_traders):
+        """Clears the dirty flags of what get_dirty returned, once it is committed. Until then a failed write
+        leaves them dirty, so the next flush writes them again"""
+        for transaction_id, _, _ in dirty_positions:
+            position = self.positions.get(transaction_id)
+            if position is not None:
+                position.dirty = False
+        for trader_id in dirty_traders:
+            self.flushed_nav[trader_id] = self.nav(trader_id)
+        self.dirty_traders.difference_update(dirty_traders)
+
+
+def get_sync_version():
+    """(last_transaction_id, open_trades_version) of oanda_sync_status, None before the first sync"""
+    with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+        cur.execute("SELECT last_transaction_id, open_trades_version FROM oanda_sync_status WHERE id = 1")
+        result = cur.fetchone()
+        return (result['last_transaction_id'], result['open_trades_version']) if result else None
+
+
+def load_book(book):
+    with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+        get_open_trades = """
+        SELECT transaction_id, user_id, instrument, current_units, price, unrealized_pl, margin_used
+        FROM trades
+        WHERE state_id != 3 AND user_id IS NOT NULL
+        """
+        cur.execute(get_open_trades)
+        open_trades = cur.fetchall()
+        cur.execute("SELECT trader_id, balance FROM cash_balances WHERE trader_id IS NOT NULL")
+        balances = cur.fetchall()
+    book.load(open_trades, balances)
+    log_info(f'pricing book loaded {len(open_trades)} open trades in {len(book.instruments())} instruments')
+
+
+def flush_book(book, sync_version):
+    """
+    Writes the positions that moved since the last flush.
+    Returns sync_version, moved past this flush's own open_trades_version bump if nobody else wrote open trades
+    in between, so the book is only reloaded for other writers' changes.
+    """
+    dirty_positions, dirty_traders = book.get_dirty()
+    if not dirty_positions:
+        return sync_version
+    try:
+        with get_connection(dict_rows=True) as conn, conn.cursor() as cur:
+            update_open_trades(cur, dirty_positions)
+            recompute_trader_nav(cur, dirty_traders)
+            recompute_margin_used_and_available(cur, dirty_traders)
+            bump_data_version(cur, dirty_traders)
+            open_trades_version = bump_open_trades_version(cur)
+        book.mark_flushed(dirty_positions, dirty_traders)
+        forget_open_trades()
+    except Exception as e:
+        log_error(f'failed to flush marked-to-market trades: {str(e)}', 'flush_book')
+        return sync_version
+    if sync_version is not None and open_trades_version == sync_version[1] + 1:
+        return sync_version[0], open_trades_version
+    return sync_version
+
+
+def stream_prices(book, instruments, sync_version, stop):
+    """
+    Applies price ticks until the set of open instruments changes, the stream ends or stop is set.
+    Returns the sync version (see get_sync_version) the book was last loaded at.
+    """
+    stream_url = f'{oanda_stream_platform}/v3/accounts/{oanda_account}/pricing/stream'
+    headers = {'Authorization': f'Bearer {oanda_API_key}'}
+    params = {'instruments': ','.join(instruments)}
+    last_flush = time.monotonic()
+    with requests.get(stream_url, headers=headers, params=params, stream=True,
+                      timeout=(10, stream_timeout)) as response:
+        response.raise_for_status()
+        log_info(f'streaming prices for {params["instruments"]}')
+        # heartbeats arrive every 5 seconds, so the flush and reload checks run even when prices are quiet
+        for event in parse_stream_lines(response.iter_lines()):
+            if stop.is_set():
+                break
+            if event.get('type') == 'PRICE':
+                book.apply_price(event)
+            now = time.monotonic()
+            if book.has_material_change(material_change) or now - last_flush >= flush_interval:
+                sync_version = flush_book(book, sync_version)
+                last_flush = now
+                current_version = get_sync_version()
+                if current_version != sync_version:
+                    load_book(book)
+                    sync_version = current_version
+                    if book.instruments() != instruments:
+                        break
+    return flush_book(book, sync_version)
+
+
+def pricing_loop(stop):
+    book = PositionBook(1 / leverage)
+    sync_version = None
+    reconnect_delay = 1
+    while not stop.is_set():
+        try:
+            current_version = get_sync_version()
+            if current_version != sync_version or not book.positions:
+                load_book(book)
+                sync_version = current_version
+            instruments = book.instruments()
+            if not instruments:
+                stop.wait(flush_interval)
+                continue
+            sync_version = stream_prices(book, instruments, sync_version, stop)
+            reconnect_delay = 1
+        except (requests.RequestException, ValueError) as e:
+            log_warning(f'price stream disconnected: {str(e)}', 'pricing_loop')
+            stop.wait(reconnect_delay)
+            reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+        except Exception as e:
+            log_error(f'Unexpected error in pricing engine: {str(e)}', 'pricing_loop')
+            stop.wait(reconnect_delay)
+            reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+
+
+def start_pricing_thread():
+    global pricing_thread
+    if pricing_thread and pricing_thread.is_alive():
+        return pricing_thread
+    stop_event.clear()
+    pricing_thread = threading.Thread(target=pricing_loop, args=(stop_event,), name='oanda-pricing', daemon=True)
+    pricing_thread.start()
+    return pricing_thread
+
+
+def stop_pricing_thread(timeout=None):
+    stop_event.set()
+    if pricing_thread:
+        pricing_thread.join(timeout)
+
+
+if __name__ == '__main__':
+    try:
+        pricing_loop(stop_event)
+    except KeyboardInterrupt:
+        stop_event.set()
@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from backend.utilities import log_info, log_error
+from backend.db.db import connect_to_db
+
+load_dotenv()
+# seconds between keep-alive comments on idle streams
+push_heartbeat_interval = float(os.environ.get('PUSH_HEARTBEAT_INTERVAL', 15))
+max_reconnect_delay = 60
+
+# Fan-out of data change notifications to the server-sent event streams of this process.
+# Whatever changes trades, balances or active strategies calls notify_data_changed in its transaction.
+# Postgres delivers the NOTIFY on commit to every API worker's listener thread, which wakes only the
+# subscribers of the affected traders (managers see every trader). Idle subscribers hold no database
+# connection, just a queue.
+
+UPDATES_CHANNEL = 'traderjoe_updates'
+# NOTIFY payloads are limited to 8000 bytes, larger batches are sent as "every trader changed"
+MAX_NOTIFIED_TRADER_IDS = 500
+
+listener_thread = None
+listener_lock = threading.Lock()
+stop_event = threading.Event()
+subscribers_lock = threading.Lock()
+trader_subscribers = {}
+desk_subscribers = set()
+
+
+def notify_data_changed(cur, trader_ids=None):
+    """
+    Queues a notification that is sent when the caller's transaction commits.
+    trader_ids: traders whose data changed, None for all of them
+    """
+    trader_ids = sorted(trader_ids) if trader_ids is not None else None
+    if trader_ids is not None and len(trader_ids) > MAX_NOTIFIED_TRADER_IDS:
+        trader_ids = None
+    cur.execute("SELECT pg_notify(%s, %s)", (UPDATES_CHANNEL, json.dumps({'trader_ids': trader_ids})))
+
+
+class Subscription:
+    """One event stream. Notifications are merged: the stream only needs to know which traders to refresh."""
+
+    def __init__(self, user_id, desk=False):
+        self.user_id = user_id
+        self.desk = desk
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        # trader ids changed since the last wait, None when every trader did
+        self.pending = set()
+
+    def notify(self, trader_ids):
+        with self.lock:
+            if trader_ids is None:
+                self.pending = None
+            elif self.pending is not None:
+                self.pending.update(trader_ids)
+            self.changed.set()
+
+    def wait(self, timeout):
+        """Returns the trader ids changed since the last call ([] meaning all), or None on timeout"""
+        if not self.changed.wait(timeout):
+            return None
+        with self.lock:
+            self.changed.clear()
+            trader_ids, self.pending = self.pending, set()
+        return sorted(trader_ids) if trader_ids is not None else []
+
+
+def subscribe(user_id, desk=False):
+    ensure_listener()
+    subscription = Subscription(user_id, desk)
+    with subscribers_lock:
+        if desk:
+            desk_subscribers.add(subscription)
+        else:
+            trader_subscribers.setdefault(user_id, set()).add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with subscribers_lock:
+        if subscription.desk:
+            desk_subscribers.discard(subscription)
+        else:
+            subscriptions = trader_subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del trader_subscribers[subscription.user_id]
+
+
+def count_subscribers():
+    with subscribers_lock:
+        return sum(len(subscriptions) for subscriptions in trader_subscribers.values()) + len(desk_subscribers)
+
+
+def dispatch(payload):
+    try:
+        trader_ids = json.loads(payload).get('trader_ids')
+    except ValueError:
+        trader_ids = None
+    with subscribers_lock:
+        if trader_ids is None:
+            targets = [subscription for subscriptions in trader_subscribers.values() for subscription in subscriptions]
+        else:
+            targets = [subscription for trader_id in trader_ids
+                       for subscription in trader_subscribers.get(trader_id, ())]
+        targets.extend(desk_subscribers)
+    for subscription in targets:
+        subscription.notify(trader_ids)
+
+
+def listen_loop(stop):
+    """LISTENs on a dedicated autocommit connection and dispatches notifications until stop is set"""
+    reconnect_delay = 1
+    while not stop.is_set():
+        conn = None
+        try:
+            conn = connect_to_db()
+            conn.autocommit = True
+            conn.execute(f"LISTEN {UPDATES_CHANNEL}")
+            log_info(f'listening for {UPDATES_CHANNEL}', 'listen_loop')
+            reconnect_delay = 1
+            # anything that changed while the listener was down: refresh everyone once
+            dispatch('{}')
+            while not stop.is_set():
+                for notification in conn.notifies(timeout=push_heartbeat_interval):
+                    dispatch(notification.payload)
+        except Exception as e:
+            log_error(f'push listener failed, reconnecting in {reconnect_delay}s: {str(e)}', 'listen_loop')
+            stop.wait(reconnect_delay)
+            reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+        finally:
+            if conn:
+                conn.close()
+
+
+def ensure_listener():
+    """Starts this process's listener thread on first use"""
+    global listener_thread
+    with listener_lock:
+        if listener_thread is None or not listener_thread.is_alive():
+            stop_event.clear()
+            listener_thread = threading.Thread(target=listen_loop, args=(stop_event,), name='push-listener',
+                                               daemon=True)
+            listener_thread.start()
+
+
+def stop_listener(timeout=5):
+    stop_event.set()
+    if listener_thread is not None:
+        listener_thread.join(timeout)
+
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+def heartbeat():
+    return f': keep-alive {int(time.time())}\n\n'
@@ -0,0 +1,58 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+response_cache_size = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+
+# In-process cache of rendered JSON responses for the read endpoints. Keys include the data version
+# (see syncdata.cached_response), so a stale entry can never be served, it just stops being hit and ages out.
+# Syncs that change data clear the cache anyway to give the memory back early.
+
+
+class LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+response_cache = LRUCache(response_cache_size)
+
+
+def invalidate_cached_responses():
+    response_cache.clear()
+
+
+def make_etag(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20]
@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import types
+from dotenv import load_dotenv
+from backend.utilities import log_info, log_error, log_warning
+from backend.strategy.sdk import find_entry_point, load_script, run_strategy, Strategy, LegacyScript
+
+load_dotenv()
+# number of host processes, 0 keeps the old one python process per started strategy
+strategy_hosts = int(os.environ.get('STRATEGY_HOSTS', 0))
+# host n listens on <prefix><n>.sock
+strategy_host_socket_prefix = os.environ.get('STRATEGY_HOST_SOCKET_PREFIX', '/tmp/traderjoe_strategy_host_')
+# seconds a strategy may run before it is cancelled, 0 for no limit
+strategy_task_timeout = float(os.environ.get('STRATEGY_TASK_TIMEOUT', 0))
+host_request_timeout = 10
+
+# Strategy hosts: python -m backend.services.strategy_host --hosts 4
+# Each host is one process running many strategies as asyncio tasks on one event loop, so a strategy costs a
+# module and a task rather than an interpreter. Hosts are pinned to a core each where the platform allows it.
+# A strategy is placed on host active_id % STRATEGY_HOSTS, which is how start and stop find it again.
+#
+# A script is loaded under its own module name per start, so two runs never share module globals, and its
+# coroutine entry point (see backend.strategy.sdk.find_entry_point) is run as a task. Scripts with only a
+# blocking main() can't be cancelled inside a host, start_strategy runs those in their own process as before.
+# An exception, sys.exit() or timeout ends only the strategy that raised it.
+#
+# The API talks to a host over its Unix socket with newline-delimited JSON:
+#     {"start": {"active_id": 12, "script_path": "/abs/script.py", "instrument": "EUR_USD"}}
+#     {"stop": {"active_id": 12}}     {"stop_all": true}     {"list": true}
+# and gets back {"ok": true, "pid": <host pid>, ...} or {"error": "..."}.
+
+class NoEntryPoint(Exception):
+    pass
+
+
+def get_socket_path(host):
+    return f'{strategy_host_socket_prefix}{host}.sock'
+
+
+def get_host(active_id, hosts=None):
+    return int(active_id) % (hosts or strategy_hosts)
+
+
+def load_entry_point(active_id, script_path):
+    entry_point = find_entry_point(load_script(script_path, f'strategy_{active_id}'))
+    if entry_point is None:
+        raise NoEntryPoint(f'{script_path} has no async entry point, only main(instrument_name)')
+    return entry_point
+
+
+class StrategyHost:
+    def __init__(self, host, timeout=strategy_task_timeout):
+        self.host = host
+        self.timeout = timeout
+        # active_id -> (task, script_path, instrument)
+        self.strategies = {}
+
+    async def supervise(self, active_id, entry_point, instrument):
+        try:
+            if self.timeout:
+                await asyncio.wait_for(entry_point(instrument), self.timeout)
+            else:
+                await entry_point(instrument)
+            log_info(f'strategy {active_id} on host {self.host} finished')
+        except asyncio.CancelledError:
+            log_info(f'strategy {active_id} on host {self.host} stopped')
+            raise
+        except asyncio.TimeoutError:
+            log_warning(f'strategy {active_id} timed out after {self.timeout}s', 'StrategyHost.supervise')
+        except SystemExit:
+            # the bundled scripts exit once their order is placed
+            log_info(f'strategy {active_id} on host {self.host} exited')
+        except Exception as e:
+            log_error(f'strategy {active_id} failed: {str(e)}', 'StrategyHost.supervise')
+        finally:
+            entry = self.strategies.get(active_id)
+            if entry and entry[0] is asyncio.current_task():
+                del self.strategies[active_id]
+
+    def start(self, active_id, script_path, instrument):
+        if active_id in self.strategies:
+            raise ValueError(f'strategy {active_id} is already running')
+        entry_point = load_entry_point(active_id, script_path)
+        task = asyncio.create_task(self.supervise(active_id, entry_point, instrument), name=f'strategy_{active_id}')
+        self.strategies[active_id] = (task, script_path, instrument)
+        log_info(f'started strategy {active_id} ({script_path} {instrument}) on host {self.host}')
+
+    async def stop(self, active_id):
+        entry = self.strategies.pop(active_id, None)
+        if entry is None:
+            return False
+        entry[0].cancel()
+        await asyncio.gather(entry[0], return_exceptions=True)
+        return True
+
+    async def handle_request(self, request):
+        if 'start' in request:
+            self.start(int(request['start']['active_id']), request['start']['script_path'],
+                       request['start']['instrument'])
+            return {'ok': True}
+        if 'stop' in request:
+            return {'ok': True, 'stopped': await self.stop(int(request['stop']['active_id']))}
+        if 'stop_all' in request:
+            stopped = [await self.stop(active_id) for active_id in list(self.strategies)]
+            return {'ok': True, 'stopped': len(stopped)}
+        if 'list' in request:
+            return {'ok': True, 'strategies': [{'active_id': active_id, 'script_path': script_path,
+                                                'instrument': instrument}
+                                               for active_id, (_, script_path, instrument) in self.strategies.items()]}
+        raise ValueError('unknown request')
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.handle_request(json.loads(line))
+                except NoEntryPoint as e:
+                    response = {'error': str(e), 'no_entry_point': True}
+                except Exception as e:
+                    response = {'error': str(e)}
+                response['pid'] = os.getpid()
+                writer.write((json.dumps(response) + '\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve_host(host):
+    path = get_socket_path(host)
+    strategy_host = StrategyHost(host)
+    if os.path.exists(path):
+        os.remove(path)
+    server = await asyncio.start_unix_server(strategy_host.handle_client, path=path)
+    os.chmod(path, 0o660)
+    log_info(f'strategy host {host} (pid {os.getpid()}) listening on {path}')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def run_host(host):
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+    if cores:
+        os.sched_setaffinity(0, {cores[host % len(cores)]})
+    try:
+        asyncio.run(serve_host(host))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_hosts(hosts):
+    processes = [multiprocessing.Process(target=run_host, args=(host,), name=f'strategy-host-{host}')
+                 for host in range(hosts)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+def send_host_request(host, request):
+    """Blocking round trip to a host, for the API. Raises OSError if the host is not running."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(host_request_timeout)
+        connection.connect(get_socket_path(host))
+        connection.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        with connection.makefile('rb') as response:
+            return json.loads(response.readline())
+
+
+def start_hosted_strategy(active_id, script_path, instrument):
+    """Returns the host's pid. Raises NoEntryPoint for scripts that need their own process."""
+    response = send_host_request(get_host(active_id), {'start': {'active_id': active_id, 'script_path': script_path,
+                                                                  'instrument': instrument}})
+    if response.get('no_entry_point'):
+        raise NoEntryPoint(response['error'])
+    if 'error' in response:
+        raise RuntimeError(f"strategy host refused to start {active_id}: {response['error']}")
+    return response['pid']
+
+
+def stop_hosted_strategy(active_id):
+    """True if a host was running the strategy"""
+    response = send_host_request(get_host(active_id), {'stop': {'active_id': active_id}})
+    return bool(response.get('stopped'))
+
+
+def stop_all_hosted_strategies():
+    for host in range(strategy_hosts):
+        try:
+            send_host_request(host, {'stop_all': True})
+        except OSError as e:
+            log_warning(f'strategy host {host} is not reachable: {str(e)}', 'stop_all_hosted_strategies')
+
+
+class ReplayedFeed:
+    """Calls on_candle every interval seconds instead of waiting for closed bars, for self_check"""
+    interval = 0.01
+
+    async def run_feed(self):
+        while True:
+            await self.call_hook(self.on_candle, self.instrument, self.granularity, None)
+            await asyncio.sleep(self.interval)
+
+
+class ReplayedLegacyScript(ReplayedFeed, LegacyScript):
+    pass
+
+
+class CountingStrategy(ReplayedFeed, Strategy):
+    candles = 0
+
+    async def on_candle(self, instrument, granularity, bar):
+        self.candles += 1
+
+
+def self_check():
+    """A legacy script that sys.exit()s after its order ends only its own strategy, not its host"""
+    async def place_order_and_exit(access_token, instrument, stop_loss_price, take_profit, units):
+        # what the bundled scripts' create_market_order_oanda does after a 201
+        sys.exit(0)
+
+    async def analyze_data_and_trade(data):
+        return True, 1.0, 1.2, 1000
+
+    async def fetch_market_data(instrument):
+        return {}
+
+    async def get_token():
+        return 'token'
+
+    legacy_module = types.SimpleNamespace(__file__=__file__, get_token=get_token, fetch_market_data=fetch_market_data,
+                                          analyze_data_and_trade=analyze_data_and_trade,
+                                          create_market_order_oanda=place_order_and_exit)
+    counting = CountingStrategy('EUR_USD', 'M1')
+
+    async def check():
+        host = StrategyHost(0)
+        exiting = asyncio.create_task(host.supervise(
+            1, lambda instrument: run_strategy(ReplayedLegacyScript(legacy_module, instrument)), 'EUR_USD'))
+        running = asyncio.create_task(host.supervise(2, lambda instrument: run_strategy(counting), 'EUR_USD'))
+        await asyncio.sleep(0.2)
+        assert exiting.done() and exiting.exception() is None, 'the legacy strategy should have stopped cleanly'
+        assert not running.done(), 'the other strategy should still be running'
+        candles = counting.candles
+        await asyncio.sleep(0.1)
+        assert counting.candles > candles, 'the other strategy should still get candles'
+        running.cancel()
+        await asyncio.gather(running, return_exceptions=True)
+
+    try:
+        asyncio.run(check())
+    except SystemExit:
+        raise AssertionError("a strategy's sys.exit() ended the host's event loop")
+    print('strategy host self check passed')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run strategies as asyncio tasks in a few host processes')
+    parser.add_argument('--hosts', type=int, default=strategy_hosts,
+                        help='number of host processes, must match the API\'s STRATEGY_HOSTS')
+    parser.add_argument('--self-check', action='store_true',
+                        help='check that one strategy exiting leaves the others on its host running, then quit')
+    arguments = parser.parse_args()
+    if arguments.self_check:
+        self_check()
+        sys.exit(0)
+    hosts = arguments.hosts
+    if hosts < 1:
+        parser.error('set STRATEGY_HOSTS, e.g. to the number of cores')
+    run_hosts(hosts)
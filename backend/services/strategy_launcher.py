@@ -0,0 +1,132 @@
+import importlib
+import json
+import os
+import runpy
+import signal
+import socket
+import sys
+from dotenv import load_dotenv
+from backend.utilities import log_info, log_error
+
+load_dotenv()
+# 'on' starts strategies that need their own process by forking the launcher instead of a cold python
+strategy_launcher = os.environ.get('STRATEGY_LAUNCHER', 'off') == 'on'
+strategy_launcher_socket = os.environ.get('STRATEGY_LAUNCHER_SOCKET', '/tmp/traderjoe_strategy_launcher.sock')
+# modules imported once in the warm parent, on top of what the bundled scripts use
+strategy_launcher_preload = [module for module in os.environ.get('STRATEGY_LAUNCHER_PRELOAD', '').split(',') if module]
+launcher_request_timeout = 10
+
+# Fork server for strategy processes: python -m backend.services.strategy_launcher
+# The launcher imports what strategy scripts commonly need (asyncio, httpx, dotenv, the market data client) and
+# has .env parsed once, then waits on a Unix socket. Each launch forks it: the child starts with everything already
+# imported and runs the script as __main__ with sys.argv = [script, instrument], just like python script instrument
+# would, minus interpreter start up and imports. The child's pid goes into active_strategies_trades as before and
+# stop_strategy ends it with SIGTERM. The launcher is single threaded so forking it is safe.
+#
+# Request (one per connection): {"script_path": "/abs/script.py", "instrument": "EUR_USD"}
+# Response: {"pid": <child pid>} or {"error": "..."}
+
+PRELOADED_MODULES = ['asyncio', 'decimal', 'json', 'dotenv', 'httpx', 'backend.services.market_data_client']
+
+
+def preload(modules):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            log_error(f'could not preload {module}: {str(e)}', 'preload')
+
+
+def reap_children(signum, frame):
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+
+def run_child(server, connection, script_path, instrument):
+    """Runs in the forked child, never returns"""
+    exit_code = 0
+    try:
+        server.close()
+        connection.close()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        sys.argv = [script_path, instrument]
+        # like python script.py: the script's directory first, the repository root stays importable
+        sys.path.insert(0, os.path.dirname(script_path))
+        runpy.run_path(script_path, run_name='__main__')
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException as e:
+        log_error(f'{script_path} {instrument} failed: {str(e)}', 'run_child')
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # skip the parent's atexit handlers and buffers
+        os._exit(exit_code)
+
+
+def launch(server, connection, request):
+    script_path = request['script_path']
+    instrument = request['instrument']
+    if not os.path.isfile(script_path):
+        raise ValueError(f'{script_path} does not exist')
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        run_child(server, connection, script_path, instrument)
+    log_info(f'launched {script_path} {instrument} as pid {pid}')
+    return pid
+
+
+def serve(path=strategy_launcher_socket):
+    preload(PRELOADED_MODULES + strategy_launcher_preload)
+    signal.signal(signal.SIGCHLD, reap_children)
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o660)
+    server.listen()
+    log_info(f'strategy launcher (pid {os.getpid()}) listening on {path}')
+    try:
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                try:
+                    with connection.makefile('rb') as request:
+                        response = {'pid': launch(server, connection, json.loads(request.readline()))}
+                except Exception as e:
+                    response = {'error': str(e)}
+                connection.sendall((json.dumps(response) + '\n').encode('utf-8'))
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def launch_with_launcher(script_path, instrument, path=None):
+    """Asks the launcher to fork script_path. Returns the pid, raises OSError if the launcher is not running."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(launcher_request_timeout)
+        connection.connect(path or strategy_launcher_socket)
+        connection.sendall((json.dumps({'script_path': script_path, 'instrument': instrument}) + '\n')
+                           .encode('utf-8'))
+        with connection.makefile('rb') as response:
+            response = json.loads(response.readline())
+    if 'error' in response:
+        raise RuntimeError(f"strategy launcher refused {script_path}: {response['error']}")
+    return response['pid']
+
+
+if __name__ == '__main__':
+    try:
+        serve(sys.argv[1] if len(sys.argv) > 1 else strategy_launcher_socket)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,102 @@
+import datetime
+import glob
+import gzip
+import json
+import os
+import threading
+from dotenv import load_dotenv
+from backend.utilities import log_warning
+
+load_dotenv()
+journal_enabled = os.environ.get('SYNC_JOURNAL', 'on') == 'on'
+# relative paths are resolved against backend/, wherever the API, sync worker or flask command was started from
+journal_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 os.environ.get('SYNC_JOURNAL_DIR', 'journal'))
+# days of journal files kept, older ones are deleted when a new day's file is started. 0 keeps everything
+journal_retention_days = int(os.environ.get('SYNC_JOURNAL_RETENTION_DAYS', 30))
+
+# Append-only record of every OANDA /changes payload the sync applied, so slow or broken syncs can be replayed.
+# One gzip file per day, each append is its own gzip member (gzip.open reads them back as one stream) holding
+# one JSON line: {"since": sinceTransactionID, "last": lastTransactionID, "recorded_at": ..., "outcome": ...,
+# "payload": {...}}. A payload is recorded once its sync has committed (outcome "applied") or rolled back
+# ("failed", with "error"), so a rolled back sync that is retried doesn't leave the same changes applied twice.
+# Files older than SYNC_JOURNAL_RETENTION_DAYS are deleted as each day's file is started.
+
+journal_lock = threading.Lock()
+
+
+def get_journal_file_path(directory, now):
+    return os.path.abspath(os.path.join(directory, f"{now.strftime('%y%m%d')}_changes.jsonl.gz"))
+
+
+def prune_journal(directory, now, retention_days=None):
+    """Deletes journal files older than retention_days, returns how many"""
+    retention_days = journal_retention_days if retention_days is None else retention_days
+    if retention_days <= 0:
+        return 0
+    oldest_kept = (now - datetime.timedelta(days=retention_days)).date()
+    removed = 0
+    for file_path in glob.glob(os.path.join(directory, '*_changes.jsonl.gz')):
+        try:
+            day = datetime.datetime.strptime(os.path.basename(file_path).split('_')[0], '%y%m%d').date()
+        except ValueError:
+            # not named by record_payload, leave it alone
+            continue
+        if day < oldest_kept:
+            os.remove(file_path)
+            removed += 1
+    return removed
+
+
+def record_payload(since_transaction_id, payload, error=None, directory=None):
+    """
+    Appends a payload to today's journal file. Never raises: a journal failure must not fail the sync.
+    error: why the sync of the payload rolled back, None once it has committed
+    """
+    if not journal_enabled:
+        return
+    try:
+        directory = directory or journal_directory
+        now = datetime.datetime.now()
+        entry = {
+            'since': int(since_transaction_id),
+            'last': int(payload['lastTransactionID']),
+            'recorded_at': now.isoformat(),
+            'outcome': 'applied' if error is None else 'failed',
+            'payload': payload,
+        }
+        if error is not None:
+            entry['error'] = error
+        line = (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+        os.makedirs(directory, exist_ok=True)
+        file_path = get_journal_file_path(directory, now)
+        with journal_lock:
+            if not os.path.exists(file_path):
+                prune_journal(directory, now)
+            with open(file_path, 'ab') as f:
+                f.write(gzip.compress(line))
+    except Exception as e:
+        log_warning(f'failed to journal changes since {since_transaction_id}: {str(e)}', 'record_payload')
+
+
+def read_journal(directory=None, since=None, until=None, outcome='applied'):
+    """
+    Yields journal entries in the order they were recorded.
+    since / until: only entries whose sinceTransactionID >= since and lastTransactionID <= until
+    outcome: 'applied' or 'failed' entries only, None for both
+    """
+    directory = directory or journal_directory
+    for file_path in sorted(glob.glob(os.path.join(directory, '*_changes.jsonl.gz'))):
+        with gzip.open(file_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if since is not None and entry['since'] < since:
+                    continue
+                if until is not None and entry['last'] > until:
+                    continue
+                # entries journaled before outcomes were recorded were written ahead of their sync
+                if outcome is not None and entry.get('outcome', 'applied') != outcome:
+                    continue
+                yield entry
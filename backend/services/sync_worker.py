@@ -0,0 +1,62 @@
+import os
+import threading
+from dotenv import load_dotenv
+from backend.utilities import log_info, log_error
+from backend.controllers.syncdata import run_sync
+from backend.services.transaction_stream import stream_loop
+
+load_dotenv()
+sync_interval = float(os.environ.get('OANDA_SYNC_INTERVAL', 5))
+# 'poll' fetches /changes every OANDA_SYNC_INTERVAL seconds, 'stream' applies changes as they arrive on the
+# OANDA transaction stream and catches up through /changes whenever the stream reconnects
+sync_mode = os.environ.get('OANDA_SYNC_MODE', 'poll')
+
+# Background worker that keeps the database in step with OANDA so read endpoints don't have to.
+# Run it inside the API process (OANDA_SYNC_WORKER=thread, the default) or as a dedicated process:
+# python -m backend.services.sync_worker
+sync_thread = None
+stop_event = threading.Event()
+
+
+def sync_loop(interval, stop):
+    log_info(f'OANDA sync worker started, polling every {interval} seconds')
+    while not stop.is_set():
+        try:
+            result = run_sync()
+            if result['status'] == 'error':
+                log_error(f"sync failed: {result['msg']}", 'sync_loop')
+        except Exception as e:
+            log_error(f'Unexpected error in sync worker: {str(e)}', 'sync_loop')
+        stop.wait(interval)
+    log_info('OANDA sync worker stopped')
+
+
+def run_worker(mode, interval, stop):
+    if mode == 'stream':
+        stream_loop(stop)
+    else:
+        sync_loop(interval, stop)
+
+
+def start_sync_thread(interval=sync_interval, mode=sync_mode):
+    global sync_thread
+    if sync_thread and sync_thread.is_alive():
+        return sync_thread
+    stop_event.clear()
+    sync_thread = threading.Thread(target=run_worker, args=(mode, interval, stop_event), name='oanda-sync',
+                                   daemon=True)
+    sync_thread.start()
+    return sync_thread
+
+
+def stop_sync_thread(timeout=None):
+    stop_event.set()
+    if sync_thread:
+        sync_thread.join(timeout)
+
+
+if __name__ == '__main__':
+    try:
+        run_worker(sync_mode, sync_interval, stop_event)
+    except KeyboardInterrupt:
+        stop_event.set()
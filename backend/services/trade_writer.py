@@ -0,0 +1,176 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+# Payloads with at least this many trades in one state are staged with COPY instead of sent as arrays.
+# COPY is not available in pipeline mode, so callers check use_copy() before entering a pipeline.
+copy_threshold = int(os.environ.get('TRADE_COPY_THRESHOLD', 500))
+
+# Every row passed to upsert_trades is a tuple in this column order
+TRADE_COLUMNS = ('user_id', 'open_time', 'close_time', 'current_units', 'financing', 'transaction_id',
+                 'initial_units', 'instrument', 'price', 'realized_pl', 'unrealized_pl', 'state_id', 'margin_used',
+                 'strategy_id')
+TRANSACTION_ID_INDEX = TRADE_COLUMNS.index('transaction_id')
+
+upsert_columns = ', '.join(TRADE_COLUMNS)
+
+upsert_returning = """
+ON CONFLICT (transaction_id) DO UPDATE
+SET user_id = EXCLUDED.user_id, open_time = EXCLUDED.open_time,
+    close_time = COALESCE(EXCLUDED.close_time, trades.close_time), current_units = EXCLUDED.current_units,
+    financing = EXCLUDED.financing, initial_units = EXCLUDED.initial_units, instrument = EXCLUDED.instrument,
+    price = EXCLUDED.price, realized_pl = EXCLUDED.realized_pl, unrealized_pl = EXCLUDED.unrealized_pl,
+    state_id = EXCLUDED.state_id, margin_used = EXCLUDED.margin_used, update_time = EXCLUDED.update_time,
+    strategy_id = COALESCE(EXCLUDED.strategy_id, trades.strategy_id)
+RETURNING id, user_id, transaction_id, realized_pl, financing, close_time
+"""
+
+upsert_from_arrays = f"""
+INSERT INTO trades ({upsert_columns}, update_time)
+SELECT incoming.*, CURRENT_TIMESTAMP
+FROM unnest(%s::integer[], %s::timestamptz[], %s::timestamptz[], %s::numeric[], %s::numeric[], %s::varchar[],
+            %s::numeric[], %s::varchar[], %s::numeric[], %s::numeric[], %s::numeric[], %s::integer[], %s::numeric[],
+            %s::integer[])
+     AS incoming
+{upsert_returning}
+"""
+
+create_staging_table = """
+CREATE TEMP TABLE IF NOT EXISTS trades_staging
+(
+    user_id integer,
+    open_time timestamp with time zone,
+    close_time timestamp with time zone,
+    current_units numeric,
+    financing numeric,
+    transaction_id character varying(10),
+    initial_units numeric,
+    instrument character varying(50),
+    price numeric,
+    realized_pl numeric,
+    unrealized_pl numeric,
+    state_id integer,
+    margin_used numeric,
+    strategy_id integer
+) ON COMMIT DELETE ROWS
+"""
+
+upsert_from_staging = f"""
+INSERT INTO trades ({upsert_columns}, update_time)
+SELECT {upsert_columns}, CURRENT_TIMESTAMP
+FROM trades_staging
+{upsert_returning}
+"""
+
+
+def use_copy(number_of_trades):
+    return number_of_trades >= copy_threshold
+
+
+def upsert_trades(cur, trades):
+    """
+    Inserts or updates all given trades in one statement, keyed on the unique transaction_id.
+    trades: list of tuples ordered as TRADE_COLUMNS
+    Returns the affected rows: [{id, user_id, transaction_id, realized_pl, financing, close_time} ...]
+    (tuples instead of dictionaries if the cursor does not use dict rows)
+    """
+    if not trades:
+        return []
+    # ON CONFLICT DO UPDATE cannot touch the same row twice in one statement, keep the last version of each trade
+    trades = list({trade[TRANSACTION_ID_INDEX]: trade for trade in trades}.values())
+    if use_copy(len(trades)):
+        return upsert_trades_via_copy(cur, trades)
+    columns = [list(column) for column in zip(*trades)]
+    cur.execute(upsert_from_arrays, columns)
+    return cur.fetchall()
+
+
+def upsert_trades_via_copy(cur, trades):
+    cur.execute(create_staging_table)
+    cur.execute("TRUNCATE trades_staging")
+    with cur.copy(f"COPY trades_staging ({upsert_columns}) FROM STDIN") as copy:
+        for trade in trades:
+            copy.write_row(trade)
+    cur.execute(upsert_from_staging)
+    return cur.fetchall()
+
+
+update_open_trade_values = """
+UPDATE trades t
+SET unrealized_pl = incoming.unrealized_pl, margin_used = incoming.margin_used, update_time = CURRENT_TIMESTAMP
+FROM unnest(%s::varchar[], %s::numeric[], %s::numeric[]) AS incoming (transaction_id, unrealized_pl, margin_used)
+WHERE t.transaction_id = incoming.transaction_id AND t.state_id != 3
+  AND (t.unrealized_pl, t.margin_used) IS DISTINCT FROM (incoming.unrealized_pl, incoming.margin_used)
+RETURNING t.user_id
+"""
+
+# Last (unrealized_pl, margin_used) this process wrote for each open trade, keyed on transaction_id.
+# Only trusted while nothing else has written open trades since: version holds the oanda_sync_status
+# (last_synced_at, open_trades_version) this process's sync left behind. The pricing engine bumps
+# open_trades_version whenever it flushes, from this process or another one, so the sync forgets the snapshot.
+open_trade_snapshot = {'version': None, 'trades': {}}
+snapshot_lock = threading.Lock()
+
+
+def update_open_trades(cur, open_trades):
+    """
+    Writes the unrealized P&L and margin used of open trades in one statement, keyed on transaction_id.
+    Rows whose values are already equal are left alone, so they produce no dead tuples or WAL.
+    open_trades: list of (transaction_id, unrealized_pl, margin_used) tuples
+    Returns the user ids of the trades that actually changed
+    """
+    if not open_trades:
+        return []
+    cur.execute(update_open_trade_values, [list(column) for column in zip(*open_trades)])
+    return [row['user_id'] if isinstance(row, dict) else row[0] for row in cur.fetchall()]
+
+
+def bump_open_trades_version(cur):
+    """
+    Call in the same transaction as writes of open trade values outside of the sync, e.g. from the pricing engine.
+    Returns the new oanda_sync_status.open_trades_version, None before the first sync
+    """
+    cur.execute("""
+        UPDATE oanda_sync_status SET open_trades_version = open_trades_version + 1 WHERE id = 1
+        RETURNING open_trades_version""")
+    result = cur.fetchone()
+    if result is None:
+        return None
+    return result['open_trades_version'] if isinstance(result, dict) else result[0]
+
+
+def validate_open_trade_snapshot(version):
+    """
+    Forgets the snapshot unless this process's sync was the last to write open trades.
+    version: oanda_sync_status (last_synced_at, open_trades_version) as read at the start of the sync
+    """
+    with snapshot_lock:
+        if open_trade_snapshot['version'] is None or open_trade_snapshot['version'] != version:
+            open_trade_snapshot['version'] = None
+            open_trade_snapshot['trades'] = {}
+
+
+def get_changed_open_trades(open_trades):
+    """Drops the trades whose values match what this process last wrote"""
+    with snapshot_lock:
+        snapshot = open_trade_snapshot['trades']
+        return [trade for trade in open_trades if snapshot.get(trade[0]) != (trade[1], trade[2])]
+
+
+def remember_open_trades(open_trades, version):
+    """
+    Call once the sync that wrote open_trades has committed.
+    open_trades: every open trade of the payload, trades that are no longer open drop out of the snapshot
+    version: oanda_sync_status (last_synced_at, open_trades_version) as the sync left it
+    """
+    with snapshot_lock:
+        open_trade_snapshot['version'] = version
+        open_trade_snapshot['trades'] = {trade[0]: (trade[1], trade[2]) for trade in open_trades}
+
+
+def forget_open_trades():
+    """Call after writing open trade values outside of the sync, e.g. from the pricing engine"""
+    with snapshot_lock:
+        open_trade_snapshot['version'] = None
+        open_trade_snapshot['trades'] = {}
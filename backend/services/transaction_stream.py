@@ -0,0 +1,112 @@
+import json
+import os
+import queue
+import threading
+import requests
+from dotenv import load_dotenv
+from backend.utilities import log_info, log_error, log_warning
+from backend.controllers.syncdata import run_sync
+
+load_dotenv()
+oanda_stream_platform = os.environ.get('OANDA_STREAM_PLATFORM', 'https://stream-fxpractice.oanda.com')
+oanda_account = os.environ.get('OANDA_ACCOUNT')
+oanda_API_key = os.environ.get('OANDA_API_KEY')
+# OANDA sends a heartbeat every 5 seconds, treat the stream as dead when nothing arrives for this long
+stream_timeout = float(os.environ.get('OANDA_STREAM_TIMEOUT', 20))
+max_reconnect_delay = 60
+
+# Streaming ingestion: holds the OANDA transaction stream open and applies new transactions as soon as they
+# arrive instead of waiting for the next poll. Transactions are applied through run_sync, i.e. the same
+# /changes fetch and sync stages as polling, so the stream only decides *when* to sync. The checkpoint is the
+# last transaction id the database is synced up to; every (re)connect first catches up from it with /changes.
+
+def parse_stream_lines(lines):
+    """
+    Incrementally parses the newline delimited JSON of an OANDA stream. lines can be any iterable of
+    bytes or str, e.g. response.iter_lines(). Blank keep-alive lines and malformed lines are skipped.
+    """
+    for line in lines:
+        if not line:
+            continue
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        try:
+            yield json.loads(line)
+        except ValueError:
+            log_warning(f'skipping malformed stream line: {line}', 'parse_stream_lines')
+
+
+def get_event_transaction_id(event):
+    """Transactions carry their own id, heartbeats carry the account's latest transaction id"""
+    if event.get('type') == 'HEARTBEAT':
+        return int(event['lastTransactionID'])
+    if 'id' in event:
+        return int(event['id'])
+    return None
+
+
+def sync_up_to(checkpoint):
+    result = run_sync()
+    if result['status'] == 'error':
+        log_error(f"sync failed: {result['msg']}", 'sync_up_to')
+        return False
+    checkpoint['transaction_id'] = max(checkpoint['transaction_id'], result['last_transaction_id'])
+    return True
+
+
+def read_transaction_stream(stream_url, pending, stop):
+    """Reads the stream until it ends, errors or stop is set, queueing the transaction id of every event"""
+    headers = {'Authorization': f'Bearer {oanda_API_key}'}
+    with requests.get(stream_url, headers=headers, stream=True, timeout=(10, stream_timeout)) as response:
+        response.raise_for_status()
+        log_info(f'connected to transaction stream {stream_url}')
+        for event in parse_stream_lines(response.iter_lines()):
+            if stop.is_set():
+                return
+            transaction_id = get_event_transaction_id(event)
+            if transaction_id is not None:
+                pending.put(transaction_id)
+
+
+def apply_stream_events(pending, stop, checkpoint):
+    while not stop.is_set():
+        try:
+            latest_transaction_id = pending.get(timeout=1)
+        except queue.Empty:
+            continue
+        # a burst of fills arrives as several transactions, drain the queue and apply them with one sync
+        while True:
+            try:
+                latest_transaction_id = max(latest_transaction_id, pending.get_nowait())
+            except queue.Empty:
+                break
+        if latest_transaction_id > checkpoint['transaction_id']:
+            sync_up_to(checkpoint)
+
+
+def stream_loop(stop, stream_url=None):
+    """
+    Runs until stop is set. stream_url defaults to OANDA's transaction stream for OANDA_ACCOUNT,
+    point OANDA_STREAM_PLATFORM (or stream_url) at a local stand-in server to test against canned events.
+    """
+    if stream_url is None:
+        stream_url = f'{oanda_stream_platform}/v3/accounts/{oanda_account}/transactions/stream'
+    checkpoint = {'transaction_id': 0}
+    pending = queue.Queue()
+    applier = threading.Thread(target=apply_stream_events, args=(pending, stop, checkpoint),
+                               name='oanda-stream-applier', daemon=True)
+    applier.start()
+    reconnect_delay = 1
+    while not stop.is_set():
+        # anything that happened while we were disconnected is picked up through /changes
+        sync_up_to(checkpoint)
+        try:
+            read_transaction_stream(stream_url, pending, stop)
+            reconnect_delay = 1
+        except (requests.RequestException, ValueError) as e:
+            log_warning(f'transaction stream disconnected: {str(e)}', 'stream_loop')
+        if stop.is_set():
+            break
+        stop.wait(reconnect_delay)
+        reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+    applier.join()
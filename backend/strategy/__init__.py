@@ -0,0 +1 @@
+from .sdk import Strategy, Bar, run_strategy, entry_points, find_entry_point, find_strategy_class
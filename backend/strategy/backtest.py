@@ -0,0 +1,453 @@
+import argparse
+import asyncio
+import contextlib
+import csv
+import datetime
+import json
+import os
+import sys
+import numpy
+from dotenv import load_dotenv
+from backend.services.candle_hub import parse_candle_time
+from backend.services.candle_store import read_candles, backfill, to_epoch
+from backend.strategy.sdk import Bar, LegacyScript, find_strategy_class, load_script
+
+load_dotenv()
+# account balance a backtest starts from, in the instrument's quote currency
+backtest_initial_balance = float(os.environ.get('BACKTEST_INITIAL_BALANCE', 100000))
+# seconds /api/strategy/backtest/ lets a backtest run
+backtest_timeout = int(os.environ.get('BACKTEST_TIMEOUT', 300))
+
+# Backtests of strategy scripts over historical mid candles, from backend.services.candle_store or a file:
+#     python -m backend.strategy.backtest backend/scripts/breakout.py EUR_USD H1 --start 2023-01-01 --param lookback=30
+#
+# Orders are simulated the way create_market_order_oanda places them: a FOK market order with stopLossOnFill and
+# takeProfitOnFill, prices rounded to 2 (JPY) or 5 digits. An order placed on a bar's close fills at the next bar's
+# open, paying half of --spread. OANDA rejects an order whose stop loss or take profit is on the wrong side of the
+# fill, so does the backtest. From the fill on, every bar's range is checked against both: a long stops out when
+# the low reaches the stop loss (at the open instead if it gapped through) and takes profit when the high reaches
+# the take profit. When one bar reaches both, the stop loss is assumed to come first unless the bar opened beyond
+# the take profit. Positions still open after the last bar are closed at its close.
+# Strategies can not close positions themselves, so a backtest holds one position at a time and ignores orders
+# while one is open, and unlike live it keeps trading after the first fill (stop() is ignored).
+#
+# Scripts are run in the first of these ways they support:
+#   - generate_signals(candles, **params) -> (units, stop_loss, take_profit) arrays, one entry per bar with units
+#     0 where there is no order. Everything is vectorised, for millions of bars per second.
+#   - a Strategy subclass, whose on_candle is called for every bar and whose place_market_order is simulated.
+#   - a legacy script (see LegacyScript): analyze_data_and_trade gets the last two candles of the history as its
+#     candles/latest data on every bar, and create_market_order_oanda is simulated.
+# Both event driven ways record their orders and then go through the vectorised simulation, so the same orders
+# give the same trades whichever way a script is written.
+
+STOP_LOSS = 0
+TAKE_PROFIT = 1
+END_OF_DATA = 2
+EXIT_REASONS = ('stop_loss', 'take_profit', 'end')
+
+
+def get_price_digits(instrument):
+    return 2 if 'JPY' in instrument else 5
+
+
+class FirstAtOrBelow:
+    """
+    For many (start, threshold) pairs at once, the first index >= start whose value is <= threshold, len(values)
+    if there is none. Searches a tree of minimums of FANOUT values, FANOUT ** 2 values, ... like a B-tree: up to
+    the first block that has a value <= threshold, then back down into it. Extra memory is len(values) / 7.
+    """
+    FANOUT = 8
+
+    def __init__(self, values):
+        level = numpy.asarray(values, dtype=numpy.float64)
+        self.size = len(level)
+        self.offsets = numpy.arange(self.FANOUT)
+        self.levels = []
+        while True:
+            padded = numpy.full(max(-(-len(level) // self.FANOUT), 1) * self.FANOUT, numpy.inf)
+            padded[:len(level)] = level
+            self.levels.append(padded)
+            if len(padded) == self.FANOUT:
+                break
+            level = padded.reshape(-1, self.FANOUT).min(axis=1)
+
+    def first_in_blocks(self, level, blocks, thresholds, starts=None):
+        """Per block: (has a value <= threshold, index of the first) among its children from start on"""
+        children = blocks[:, None] * self.FANOUT + self.offsets
+        candidates = self.levels[level][children] <= thresholds[:, None]
+        if starts is not None:
+            candidates &= children >= starts[:, None]
+        return candidates.any(axis=1), children[numpy.arange(len(blocks)), candidates.argmax(axis=1)]
+
+    def find(self, starts, thresholds):
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        thresholds = numpy.asarray(thresholds, dtype=numpy.float64)
+        found = numpy.full(len(starts), self.size, dtype=numpy.int64)
+        pending = numpy.flatnonzero(starts < self.size)
+        positions = starts[pending]
+        pending_thresholds = thresholds[pending]
+        # up: search what is left of each position's block, then move on to the next block one level higher
+        hits = []
+        for level in range(len(self.levels)):
+            inside = positions < len(self.levels[level])
+            pending, positions, pending_thresholds = pending[inside], positions[inside], pending_thresholds[inside]
+            if not len(pending):
+                break
+            has, first = self.first_in_blocks(level, positions // self.FANOUT, pending_thresholds, positions)
+            hits.append((pending[has], first[has], pending_thresholds[has]))
+            pending, positions, pending_thresholds = \
+                pending[~has], positions[~has] // self.FANOUT + 1, pending_thresholds[~has]
+        # down: the first child <= threshold of each block found, until the values themselves
+        entries = numpy.empty(0, dtype=numpy.int64)
+        indexes = numpy.empty(0, dtype=numpy.int64)
+        entry_thresholds = numpy.empty(0)
+        for level in reversed(range(len(hits))):
+            entries = numpy.concatenate((entries, hits[level][0]))
+            indexes = numpy.concatenate((indexes, hits[level][1]))
+            entry_thresholds = numpy.concatenate((entry_thresholds, hits[level][2]))
+            if level:
+                _, indexes = self.first_in_blocks(level - 1, indexes, entry_thresholds)
+        found[entries] = indexes
+        return found
+
+
+class Market:
+    """Candle arrays of one instrument and granularity, with the indexes that find stop loss / take profit hits"""
+
+    def __init__(self, candles, instrument, spread=0.0):
+        self.instrument = instrument
+        self.digits = get_price_digits(instrument)
+        self.time = numpy.asarray(candles['time'], dtype=numpy.int64)
+        self.open = numpy.asarray(candles['open'], dtype=numpy.float64)
+        self.high = numpy.asarray(candles['high'], dtype=numpy.float64)
+        self.low = numpy.asarray(candles['low'], dtype=numpy.float64)
+        self.close = numpy.asarray(candles['close'], dtype=numpy.float64)
+        self.volume = numpy.asarray(candles['volume'], dtype=numpy.int64)
+        self.candles = {'time': self.time, 'open': self.open, 'high': self.high, 'low': self.low,
+                        'close': self.close, 'volume': self.volume}
+        self.spread = spread
+        self.lows = FirstAtOrBelow(self.low)
+        # highs >= threshold is -highs <= -threshold
+        self.highs = FirstAtOrBelow(-self.high)
+
+    def __len__(self):
+        return len(self.time)
+
+    def round_prices(self, prices):
+        return numpy.round(numpy.asarray(prices, dtype=numpy.float64), self.digits)
+
+    def fill_orders(self, order_bars, units, stop_loss, take_profit):
+        """
+        Fills and exits of orders placed on the close of order_bars, as a dict of arrays with one entry per order
+        OANDA would have filled. Orders are simulated independently, see take_trades for one position at a time.
+        """
+        half_spread = self.spread / 2
+        keep = order_bars < len(self) - 1
+        order_bars, units = order_bars[keep], units[keep].astype(numpy.int64)
+        stop_loss, take_profit = self.round_prices(stop_loss[keep]), self.round_prices(take_profit[keep])
+        direction = numpy.sign(units)
+        entry_bars = order_bars + 1
+        entry_prices = self.open[entry_bars] + direction * half_spread
+        # NaN compares False: an order without a stop loss or take profit is not rejected for it
+        rejected = (direction * (entry_prices - stop_loss) <= 0) | (direction * (take_profit - entry_prices) <= 0)
+        keep = ~rejected
+        order_bars, units, direction, entry_bars, entry_prices, stop_loss, take_profit = \
+            order_bars[keep], units[keep], direction[keep], entry_bars[keep], entry_prices[keep], \
+            stop_loss[keep], take_profit[keep]
+        long = direction > 0
+        # longs close on the bid, shorts on the ask: mid thresholds are shifted by half the spread
+        below = numpy.where(long, stop_loss + half_spread, take_profit - half_spread)
+        above = numpy.where(long, take_profit + half_spread, stop_loss - half_spread)
+        below_bars = self.lows.find(entry_bars, numpy.nan_to_num(below, nan=-numpy.inf))
+        above_bars = self.highs.find(entry_bars, -numpy.nan_to_num(above, nan=numpy.inf))
+        stop_bars = numpy.where(long, below_bars, above_bars)
+        target_bars = numpy.where(long, above_bars, below_bars)
+        exit_bars = numpy.minimum(stop_bars, target_bars)
+        ended = exit_bars >= len(self)
+        exit_bars[ended] = len(self) - 1
+        exit_opens = self.open[exit_bars] - direction * half_spread
+        gapped_to_target = direction * (exit_opens - take_profit) >= 0
+        reasons = numpy.where((target_bars < stop_bars) | ((target_bars == stop_bars) & gapped_to_target),
+                              TAKE_PROFIT, STOP_LOSS)
+        reasons[ended] = END_OF_DATA
+        # filled at the stop loss / take profit, or at the open if the bar opened beyond it
+        exit_prices = numpy.where(reasons == TAKE_PROFIT,
+                                  numpy.where(gapped_to_target, exit_opens, take_profit),
+                                  numpy.where(direction * (exit_opens - stop_loss) <= 0, exit_opens, stop_loss))
+        exit_prices[ended] = self.close[-1] - direction[ended] * half_spread
+        return {
+            'order_bar': order_bars, 'entry_bar': entry_bars, 'exit_bar': exit_bars, 'units': units,
+            'entry_price': entry_prices, 'exit_price': exit_prices, 'stop_loss': stop_loss,
+            'take_profit': take_profit, 'reason': reasons,
+        }
+
+    def take_trades(self, fills):
+        """The fills of one position at a time: an order only fills after the previous position's exit bar"""
+        following = numpy.searchsorted(fills['entry_bar'], fills['exit_bar'], side='right')
+        taken = []
+        index = 0
+        while index < len(following):
+            taken.append(index)
+            index = following[index]
+        return {key: values[taken] for key, values in fills.items()}
+
+    def backtest(self, units, stop_loss, take_profit, initial_balance=None):
+        """Vectorised backtest of per-bar order arrays, as returned by generate_signals"""
+        units = numpy.nan_to_num(numpy.asarray(units, dtype=numpy.float64)).astype(numpy.int64)
+        stop_loss = numpy.broadcast_to(numpy.asarray(stop_loss, dtype=numpy.float64), units.shape)
+        take_profit = numpy.broadcast_to(numpy.asarray(take_profit, dtype=numpy.float64), units.shape)
+        order_bars = numpy.flatnonzero(units)
+        trades = self.take_trades(self.fill_orders(order_bars, units[order_bars], stop_loss[order_bars],
+                                                   take_profit[order_bars]))
+        return BacktestResult(self, trades, backtest_initial_balance if initial_balance is None else initial_balance)
+
+
+class BacktestResult:
+    def __init__(self, market, trades, initial_balance):
+        self.market = market
+        self.trades = trades
+        self.initial_balance = initial_balance
+        self.trades['profit'] = trades['units'] * (trades['exit_price'] - trades['entry_price'])
+        self.equity = self.get_equity_curve()
+
+    def get_equity_curve(self):
+        """Balance plus open profit at every bar's close, valued at the price the position would close at"""
+        trades = self.trades
+        bars = len(self.market)
+        realized = numpy.bincount(trades['exit_bar'], weights=trades['profit'], minlength=bars)
+        position = numpy.bincount(trades['entry_bar'], weights=trades['units'], minlength=bars) - \
+            numpy.bincount(trades['exit_bar'], weights=trades['units'], minlength=bars)
+        cost = trades['units'] * trades['entry_price'] + numpy.abs(trades['units']) * self.market.spread / 2
+        position_cost = numpy.bincount(trades['entry_bar'], weights=cost, minlength=bars) - \
+            numpy.bincount(trades['exit_bar'], weights=cost, minlength=bars)
+        return self.initial_balance + numpy.cumsum(realized) + numpy.cumsum(position) * self.market.close - \
+            numpy.cumsum(position_cost)
+
+    def summary(self):
+        profits = self.trades['profit']
+        wins = profits[profits > 0]
+        losses = profits[profits < 0]
+        peaks = numpy.maximum.accumulate(self.equity) if len(self.equity) else self.equity
+        return {
+            'bars': len(self.market),
+            'trades': len(profits),
+            'profit': float(self.equity[-1] - self.initial_balance) if len(self.equity) else 0.0,
+            'return': float(self.equity[-1] / self.initial_balance - 1) if len(self.equity) else 0.0,
+            'win_rate': len(wins) / len(profits) if len(profits) else None,
+            'profit_factor': float(wins.sum() / -losses.sum()) if len(losses) else None,
+            'max_drawdown': float(numpy.max(peaks - self.equity)) if len(self.equity) else 0.0,
+        }
+
+    def get_trade_list(self):
+        times = self.market.time
+        return [{
+            'order_time': format_time(times[trade['order_bar']]),
+            'entry_time': format_time(times[trade['entry_bar']]),
+            'exit_time': format_time(times[trade['exit_bar']]),
+            'units': int(trade['units']),
+            'entry_price': float(trade['entry_price']),
+            'exit_price': float(trade['exit_price']),
+            'stop_loss_price': None if numpy.isnan(trade['stop_loss']) else float(trade['stop_loss']),
+            'take_profit_price': None if numpy.isnan(trade['take_profit']) else float(trade['take_profit']),
+            'exit_reason': EXIT_REASONS[trade['reason']],
+            'profit': float(trade['profit']),
+        } for trade in (dict(zip(self.trades, values)) for values in zip(*self.trades.values()))]
+
+    def to_dict(self, equity_points=1000):
+        """JSON ready summary, trades and an equity curve of at most equity_points points"""
+        step = max(1, -(-len(self.equity) // equity_points))
+        indexes = numpy.arange(0, len(self.equity), step)
+        if len(self.equity) and indexes[-1] != len(self.equity) - 1:
+            indexes = numpy.append(indexes, len(self.equity) - 1)
+        return {
+            'instrument': self.market.instrument,
+            'summary': self.summary(),
+            'trades': self.get_trade_list(),
+            'equity': [{'time': format_time(self.market.time[index]), 'equity': float(self.equity[index])}
+                       for index in indexes],
+        }
+
+
+def format_time(epoch):
+    return datetime.datetime.fromtimestamp(int(epoch), datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class OrderRecorder:
+    """Stands in for the order API in event driven backtests, accepting orders the way the simulation fills them"""
+
+    def __init__(self, market, strategy):
+        self.market = market
+        self.strategy = strategy
+        self.bar = 0
+        self.units = numpy.zeros(len(market), dtype=numpy.int64)
+        self.stop_loss = numpy.full(len(market), numpy.nan)
+        self.take_profit = numpy.full(len(market), numpy.nan)
+        # bar the open position exits on
+        self.exit_bar = -1
+
+    async def place_market_order(self, units, stop_loss_price, take_profit_price):
+        """Same signature and result as Strategy.place_market_order"""
+        if self.bar + 1 <= self.exit_bar:
+            return False
+        fill = self.market.fill_orders(numpy.array([self.bar]), numpy.array([int(units)]),
+                                       numpy.array([float(stop_loss_price)]), numpy.array([float(take_profit_price)]))
+        if not len(fill['units']):
+            return False
+        self.units[self.bar] = fill['units'][0]
+        self.stop_loss[self.bar] = fill['stop_loss'][0]
+        self.take_profit[self.bar] = fill['take_profit'][0]
+        self.exit_bar = fill['exit_bar'][0]
+        await self.strategy.call_hook(self.strategy.on_fill, {
+            'status': 'ok', 'msg': 'order filled', 'instrument': self.market.instrument,
+            'units': int(fill['units'][0]), 'price': float(fill['entry_price'][0]),
+            'stop_loss_price': float(fill['stop_loss'][0]), 'take_profit_price': float(fill['take_profit'][0]),
+        })
+        return True
+
+    async def fetch_market_data(self, instrument_name):
+        """candles/latest as a legacy script's fetch_market_data returns it: the last two closed candles"""
+        market = self.market
+        candles = [{
+            'complete': True,
+            'volume': int(market.volume[index]),
+            'time': format_time(market.time[index]),
+            'mid': {'o': str(market.open[index]), 'h': str(market.high[index]),
+                    'l': str(market.low[index]), 'c': str(market.close[index])},
+        } for index in range(max(self.bar - 1, 0), self.bar + 1)]
+        return {'latestCandles': [{'instrument': instrument_name, 'granularity': self.strategy.granularity,
+                                   'candles': candles}]}
+
+    async def get_token(self):
+        return None
+
+    async def create_market_order_oanda(self, token, instrument_name, stop_loss_price, take_profit_price, units):
+        return await self.place_market_order(units, stop_loss_price, take_profit_price)
+
+
+class InstantAsyncio:
+    """Stands in for a legacy script's asyncio module: a backtest has no wall clock, sleeps return at once"""
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+    @staticmethod
+    async def sleep(delay, result=None):
+        return result
+
+
+async def replay(strategy, market, granularity):
+    """Calls on_candle for every bar of the market, returning the orders placed as per-bar arrays"""
+    recorder = OrderRecorder(market, strategy)
+    if isinstance(strategy, LegacyScript):
+        for name in LegacyScript.LEGACY_FUNCTIONS:
+            if name != 'analyze_data_and_trade':
+                setattr(strategy.module, name, getattr(recorder, name))
+        if hasattr(strategy.module, 'asyncio'):
+            strategy.module.asyncio = InstantAsyncio()
+    else:
+        strategy.place_market_order = recorder.place_market_order
+    await strategy.call_hook(strategy.on_start)
+    for index in range(len(market)):
+        recorder.bar = index
+        bar = Bar(datetime.datetime.fromtimestamp(int(market.time[index]), datetime.timezone.utc),
+                  float(market.open[index]), float(market.high[index]), float(market.low[index]),
+                  float(market.close[index]), int(market.volume[index]))
+        await strategy.call_hook(strategy.on_candle, market.instrument, granularity, bar)
+    return recorder.units, recorder.stop_loss, recorder.take_profit
+
+
+def generate_orders(module, market, granularity, params=None, event_driven=False):
+    """(units, stop_loss, take_profit) per bar of the market for a loaded strategy script"""
+    params = params or {}
+    generate_signals = getattr(module, 'generate_signals', None)
+    strategy_class = find_strategy_class(module)
+    if callable(generate_signals) and not (event_driven and (strategy_class or LegacyScript.supports(module))):
+        return generate_signals(market.candles, **params)
+    if strategy_class:
+        return asyncio.run(replay(strategy_class(market.instrument, granularity, **params), market, granularity))
+    if LegacyScript.supports(module):
+        return asyncio.run(replay(LegacyScript(module, market.instrument), market, granularity))
+    raise ValueError('the script has no generate_signals, Strategy subclass or analyze_data_and_trade')
+
+
+def run_backtest(module, market, granularity, params=None, initial_balance=None, event_driven=False):
+    """Backtest of a loaded strategy script, see the top of this module for how scripts are run"""
+    units, stop_loss, take_profit = generate_orders(module, market, granularity, params, event_driven)
+    return market.backtest(units, stop_loss, take_profit, initial_balance)
+
+
+def read_candle_file(path):
+    """Candles from a .npz with the candle store's columns, or a CSV with a time,open,high,low,close,volume header"""
+    if path.endswith('.npz'):
+        with numpy.load(path) as data:
+            return {column: data[column] for column in ('time', 'open', 'high', 'low', 'close', 'volume')}
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    return {
+        # epoch seconds or RFC 3339
+        'time': numpy.array([int(row['time']) if row['time'].isdigit() else to_epoch(parse_candle_time(row['time']))
+                             for row in rows], dtype=numpy.int64),
+        'open': numpy.array([row['open'] for row in rows], dtype=numpy.float64),
+        'high': numpy.array([row['high'] for row in rows], dtype=numpy.float64),
+        'low': numpy.array([row['low'] for row in rows], dtype=numpy.float64),
+        'close': numpy.array([row['close'] for row in rows], dtype=numpy.float64),
+        'volume': numpy.array([row.get('volume') or 0 for row in rows], dtype=numpy.int64),
+    }
+
+
+def parse_params(pairs):
+    """['lookback=30', 'name=x'] -> {'lookback': 30, 'name': 'x'}"""
+    params = {}
+    for pair in pairs:
+        name, _, value = pair.partition('=')
+        try:
+            params[name] = json.loads(value)
+        except ValueError:
+            params[name] = value
+    return params
+
+
+def parse_time(value):
+    return to_epoch(parse_candle_time(value if 'T' in value else f'{value}T00:00:00Z')) if value else None
+
+
+def main(arguments):
+    if arguments.file:
+        candles = read_candle_file(arguments.file)
+    else:
+        if arguments.backfill:
+            backfill(arguments.instrument, arguments.granularity, parse_time(arguments.start))
+        candles = read_candles(arguments.instrument, arguments.granularity, parse_time(arguments.start),
+                               parse_time(arguments.end))
+    market = Market(candles, arguments.instrument, arguments.spread)
+    # a strategy's own prints must not end up in the JSON
+    with contextlib.redirect_stdout(sys.stderr if arguments.json else sys.stdout):
+        module = load_script(os.path.abspath(arguments.script), 'backtest_script')
+        result = run_backtest(module, market, arguments.granularity, parse_params(arguments.param), arguments.balance,
+                              arguments.event_driven)
+    if arguments.json:
+        print(json.dumps(result.to_dict()))
+    else:
+        for trade in result.get_trade_list():
+            print(f"{trade['entry_time']} {trade['units']:>8} @ {trade['entry_price']:.{market.digits}f} -> "
+                  f"{trade['exit_time']} @ {trade['exit_price']:.{market.digits}f} {trade['exit_reason']:<11} "
+                  f"{trade['profit']:12.2f}")
+        for key, value in result.summary().items():
+            print(f'{key:<14} {value}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backtest a strategy script over stored or file candles')
+    parser.add_argument('script')
+    parser.add_argument('instrument')
+    parser.add_argument('granularity')
+    parser.add_argument('--start', help='e.g. 2023-01-01 or 2023-01-01T00:00:00Z')
+    parser.add_argument('--end')
+    parser.add_argument('--file', help='.csv or .npz candles instead of the candle store')
+    parser.add_argument('--backfill', action='store_true', help='update the candle store from OANDA first')
+    parser.add_argument('--param', action='append', default=[], help='strategy parameter, name=value')
+    parser.add_argument('--spread', type=float, default=0.0, help='in price units, e.g. 0.0001')
+    parser.add_argument('--balance', type=float, default=None)
+    parser.add_argument('--event-driven', action='store_true', help='ignore generate_signals')
+    parser.add_argument('--json', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,386 @@
+import math
+from collections import deque
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Streaming indicators for strategies. Each class updates in O(1) per bar (amortised for the rolling max / min) and
+# has a NumPy batch function computing the same series over history, e.g. for warm up or backtests:
+#
+#     from backend.strategy.indicators import EMA, ema
+#     fast = EMA(12)
+#     fast.warm_up(history['close'])          # or ema(history['close'], 12) for the whole series
+#     value = fast.update(bar.close)
+#
+# Values are NaN until an indicator has seen enough bars (see each class), so batch and streaming outputs line up
+# index for index. python -m backend.strategy.indicators checks that both agree.
+
+
+def smooth(values, alpha, initial):
+    """
+    Vectorised y[t] = (1 - alpha) * y[t - 1] + alpha * x[t] with y[-1] = initial. Worked in blocks short enough
+    that (1 - alpha) ** -block stays far from overflowing.
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    smoothed = numpy.empty(len(values))
+    decay = 1.0 - alpha
+    if decay <= 0:
+        smoothed[:] = values
+        return smoothed
+    block = max(1, int(150 / -math.log10(decay)))
+    previous = initial
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        powers = decay ** numpy.arange(1, len(chunk) + 1)
+        smoothed[start:start + len(chunk)] = powers * (previous + alpha * numpy.cumsum(chunk / powers))
+        previous = smoothed[start + len(chunk) - 1]
+    return smoothed
+
+
+def rolling_extreme(values, window, function, accumulate):
+    values = numpy.asarray(values, dtype=numpy.float64)
+    result = numpy.empty(len(values))
+    head = min(window - 1, len(values))
+    # the first bars only have a partial window
+    result[:head] = accumulate(values[:head])
+    if len(values) >= window:
+        result[window - 1:] = function(sliding_window_view(values, window), axis=1)
+    return result
+
+
+def rolling_max(values, window):
+    """Highest value of the last window values (fewer at the start)"""
+    return rolling_extreme(values, window, numpy.max, numpy.maximum.accumulate)
+
+
+def rolling_min(values, window):
+    """Lowest value of the last window values (fewer at the start)"""
+    return rolling_extreme(values, window, numpy.min, numpy.minimum.accumulate)
+
+
+def ema(values, period):
+    """Exponential moving average with alpha = 2 / (period + 1), starting at the first value"""
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if not len(values):
+        return numpy.empty(0)
+    return smooth(values, 2.0 / (period + 1), values[0])
+
+
+def wilder_average(values, period):
+    """Wilder's smoothing: NaN for the first period - 1 values, their mean at period - 1, then alpha = 1 / period"""
+    result = numpy.full(len(values), numpy.nan)
+    if len(values) >= period:
+        seed = numpy.mean(values[:period])
+        result[period - 1] = seed
+        result[period:] = smooth(values[period:], 1.0 / period, seed)
+    return result
+
+
+def rsi(closes, period=14):
+    """Wilder's RSI, NaN until period + 1 closes"""
+    closes = numpy.asarray(closes, dtype=numpy.float64)
+    result = numpy.full(len(closes), numpy.nan)
+    if len(closes) <= period:
+        return result
+    changes = numpy.diff(closes)
+    average_gain = wilder_average(numpy.maximum(changes, 0.0), period)[period - 1:]
+    average_loss = wilder_average(numpy.maximum(-changes, 0.0), period)[period - 1:]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        result[period:] = numpy.where(average_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + average_gain / average_loss))
+    return result
+
+
+def true_range(highs, lows, closes):
+    highs = numpy.asarray(highs, dtype=numpy.float64)
+    lows = numpy.asarray(lows, dtype=numpy.float64)
+    closes = numpy.asarray(closes, dtype=numpy.float64)
+    ranges = highs - lows
+    if len(closes) > 1:
+        previous_close = closes[:-1]
+        ranges[1:] = numpy.maximum.reduce([ranges[1:], numpy.abs(highs[1:] - previous_close),
+                                           numpy.abs(lows[1:] - previous_close)])
+    return ranges
+
+
+def atr(highs, lows, closes, period=14):
+    """Wilder's average true range, NaN until period bars"""
+    return wilder_average(true_range(highs, lows, closes), period)
+
+
+def vwap(highs, lows, closes, volumes, window=None):
+    """Volume weighted typical price ((high + low + close) / 3), since the first bar or over the last window bars"""
+    typical = (numpy.asarray(highs, dtype=numpy.float64) + numpy.asarray(lows, dtype=numpy.float64)
+               + numpy.asarray(closes, dtype=numpy.float64)) / 3.0
+    volumes = numpy.asarray(volumes, dtype=numpy.float64)
+    weighted = numpy.cumsum(typical * volumes)
+    total_volume = numpy.cumsum(volumes)
+    if window is not None and len(volumes) > window:
+        weighted[window:] = weighted[window:] - weighted[:-window]
+        total_volume[window:] = total_volume[window:] - total_volume[:-window]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(total_volume > 0, weighted / total_volume, numpy.nan)
+
+
+def rolling_variance(values, window, ddof=0):
+    """Variance of the last window values, NaN until the window is full"""
+    values = numpy.asarray(values, dtype=numpy.float64)
+    result = numpy.full(len(values), numpy.nan)
+    if len(values) >= window:
+        result[window - 1:] = sliding_window_view(values, window).var(axis=1, ddof=ddof)
+    return result
+
+
+class RollingMax:
+    """Highest of the last window values. Keeps a deque of candidates in decreasing order, O(1) amortised."""
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+        # (index, value), values strictly decreasing
+        self.candidates = deque()
+        self.value = math.nan
+
+    def dominates(self, kept, new):
+        return kept > new
+
+    def update(self, value):
+        while self.candidates and not self.dominates(self.candidates[-1][1], value):
+            self.candidates.pop()
+        self.candidates.append((self.count, value))
+        if self.candidates[0][0] <= self.count - self.window:
+            self.candidates.popleft()
+        self.count += 1
+        self.value = self.candidates[0][1]
+        return self.value
+
+    def warm_up(self, values):
+        # only the last window values can still matter
+        self.count += max(len(values) - self.window, 0)
+        for value in values[-self.window:]:
+            self.update(float(value))
+        return self.value
+
+
+class RollingMin(RollingMax):
+    """Lowest of the last window values"""
+
+    def dominates(self, kept, new):
+        return kept < new
+
+
+class EMA:
+    def __init__(self, period):
+        self.alpha = 2.0 / (period + 1)
+        self.value = math.nan
+
+    def update(self, value):
+        self.value = value if math.isnan(self.value) else self.value + self.alpha * (value - self.value)
+        return self.value
+
+    def warm_up(self, values):
+        if len(values):
+            self.value = float(smooth(values, self.alpha, values[0] if math.isnan(self.value) else self.value)[-1])
+        return self.value
+
+
+class WilderAverage:
+    """Mean of the first period values, then Wilder's smoothing"""
+
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.total = 0.0
+        self.value = math.nan
+
+    def update(self, value):
+        self.count += 1
+        if self.count < self.period:
+            self.total += value
+        elif self.count == self.period:
+            self.value = (self.total + value) / self.period
+        else:
+            self.value += (value - self.value) / self.period
+        return self.value
+
+    def warm_up(self, values):
+        values = numpy.asarray(values, dtype=numpy.float64)
+        # fill the seed window one value at a time, smooth the rest in one go
+        head = max(min(self.period - self.count, len(values)), 0)
+        for value in values[:head]:
+            self.update(float(value))
+        if len(values) > head:
+            self.value = float(smooth(values[head:], 1.0 / self.period, self.value)[-1])
+            self.count += len(values) - head
+        return self.value
+
+
+class RSI:
+    """Wilder's RSI, NaN until period + 1 closes"""
+
+    def __init__(self, period=14):
+        self.average_gain = WilderAverage(period)
+        self.average_loss = WilderAverage(period)
+        self.previous_close = None
+        self.value = math.nan
+
+    def update(self, close):
+        if self.previous_close is not None:
+            change = close - self.previous_close
+            self.set_value(self.average_gain.update(max(change, 0.0)), self.average_loss.update(max(-change, 0.0)))
+        self.previous_close = close
+        return self.value
+
+    def set_value(self, average_gain, average_loss):
+        if not math.isnan(average_loss):
+            self.value = 100.0 if average_loss == 0 else 100.0 - 100.0 / (1.0 + average_gain / average_loss)
+
+    def warm_up(self, closes):
+        closes = numpy.asarray(closes, dtype=numpy.float64)
+        if self.previous_close is not None:
+            closes = numpy.concatenate(([self.previous_close], closes))
+        if len(closes) > 1:
+            changes = numpy.diff(closes)
+            self.set_value(self.average_gain.warm_up(numpy.maximum(changes, 0.0)),
+                           self.average_loss.warm_up(numpy.maximum(-changes, 0.0)))
+        if len(closes):
+            self.previous_close = float(closes[-1])
+        return self.value
+
+
+class ATR:
+    """Wilder's average true range, NaN until period bars"""
+
+    def __init__(self, period=14):
+        self.average = WilderAverage(period)
+        self.previous_close = None
+        self.value = math.nan
+
+    def update(self, high, low, close):
+        value = high - low
+        if self.previous_close is not None:
+            value = max(value, abs(high - self.previous_close), abs(low - self.previous_close))
+        self.previous_close = close
+        self.value = self.average.update(value)
+        return self.value
+
+    def warm_up(self, highs, lows, closes):
+        if not len(closes):
+            return self.value
+        ranges = true_range(highs, lows, closes)
+        if self.previous_close is not None:
+            ranges[0] = max(ranges[0], abs(highs[0] - self.previous_close), abs(lows[0] - self.previous_close))
+        self.previous_close = float(closes[-1])
+        self.value = self.average.warm_up(ranges)
+        return self.value
+
+
+class VWAP:
+    """Volume weighted typical price since the first bar, or over the last window bars"""
+
+    def __init__(self, window=None):
+        self.window = window
+        self.bars = deque()
+        self.weighted = 0.0
+        self.volume = 0.0
+        self.value = math.nan
+
+    def update(self, high, low, close, volume):
+        weighted = (high + low + close) / 3.0 * volume
+        self.weighted += weighted
+        self.volume += volume
+        if self.window is not None:
+            self.bars.append((weighted, volume))
+            if len(self.bars) > self.window:
+                dropped_weighted, dropped_volume = self.bars.popleft()
+                self.weighted -= dropped_weighted
+                self.volume -= dropped_volume
+        self.value = self.weighted / self.volume if self.volume > 0 else math.nan
+        return self.value
+
+    def warm_up(self, highs, lows, closes, volumes):
+        if self.window is not None:
+            # the window needs the individual bars
+            for bar in zip(highs[-self.window:], lows[-self.window:], closes[-self.window:], volumes[-self.window:]):
+                self.update(*map(float, bar))
+            return self.value
+        typical = (numpy.asarray(highs, dtype=numpy.float64) + numpy.asarray(lows, dtype=numpy.float64)
+                   + numpy.asarray(closes, dtype=numpy.float64)) / 3.0
+        self.weighted += float(numpy.dot(typical, volumes))
+        self.volume += float(numpy.sum(volumes))
+        self.value = self.weighted / self.volume if self.volume > 0 else math.nan
+        return self.value
+
+
+class RollingVariance:
+    """Variance of the last window values, NaN until the window is full. Welford's update, adding and dropping."""
+
+    def __init__(self, window, ddof=0):
+        self.window = window
+        self.ddof = ddof
+        self.values = deque()
+        self.mean = 0.0
+        self.squares = 0.0
+        self.value = math.nan
+
+    def update(self, value):
+        self.values.append(value)
+        if len(self.values) > self.window:
+            dropped = self.values.popleft()
+            previous_mean = self.mean
+            self.mean += (value - dropped) / self.window
+            self.squares += (value - dropped) * (value - self.mean + dropped - previous_mean)
+        else:
+            delta = value - self.mean
+            self.mean += delta / len(self.values)
+            self.squares += delta * (value - self.mean)
+        if len(self.values) == self.window:
+            self.value = max(self.squares, 0.0) / (self.window - self.ddof)
+        return self.value
+
+    def warm_up(self, values):
+        for value in values[-self.window:]:
+            self.update(float(value))
+        return self.value
+
+
+def check(name, streamed, batch):
+    numpy.testing.assert_allclose(streamed, batch, rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=name)
+    print(f'{name:<26} ok')
+
+
+def self_check(bars=20000, seed=7):
+    """Streaming, warmed up and batch versions must agree on a random walk"""
+    generator = numpy.random.default_rng(seed)
+    closes = 1.1 + numpy.cumsum(generator.normal(0, 0.0005, bars))
+    opens = numpy.concatenate(([closes[0]], closes[:-1]))
+    highs = numpy.maximum(opens, closes) + generator.uniform(0, 0.0004, bars)
+    lows = numpy.minimum(opens, closes) - generator.uniform(0, 0.0004, bars)
+    volumes = generator.integers(1, 500, bars).astype(numpy.float64)
+    split = bars // 2
+
+    def streamed(indicator, *series):
+        return numpy.array([indicator.update(*map(float, values)) for values in zip(*series)])
+
+    def warmed(make, *series):
+        # warm up on the first half, stream the second
+        indicator = make()
+        indicator.warm_up(*[values[:split] for values in series])
+        return streamed(indicator, *[values[split:] for values in series])
+
+    cases = [
+        ('rolling max', lambda: RollingMax(20), (highs,), rolling_max(highs, 20)),
+        ('rolling min', lambda: RollingMin(20), (lows,), rolling_min(lows, 20)),
+        ('ema', lambda: EMA(12), (closes,), ema(closes, 12)),
+        ('ema 2', lambda: EMA(2), (closes,), ema(closes, 2)),
+        ('rsi', lambda: RSI(14), (closes,), rsi(closes, 14)),
+        ('atr', lambda: ATR(14), (highs, lows, closes), atr(highs, lows, closes, 14)),
+        ('vwap', lambda: VWAP(), (highs, lows, closes, volumes), vwap(highs, lows, closes, volumes)),
+        ('rolling vwap', lambda: VWAP(50), (highs, lows, closes, volumes), vwap(highs, lows, closes, volumes, 50)),
+        ('rolling variance', lambda: RollingVariance(30, ddof=1), (closes,), rolling_variance(closes, 30, ddof=1)),
+    ]
+    for name, make, series, batch in cases:
+        check(name, streamed(make(), *series), batch)
+        check(f'{name} warm up', warmed(make, *series), batch[split:])
+
+
+if __name__ == '__main__':
+    self_check()
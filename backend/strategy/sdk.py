@@ -0,0 +1,311 @@
+import asyncio
+import datetime
+import importlib.util
+import inspect
+import os
+import sys
+import httpx
+from dotenv import load_dotenv
+from backend.utilities import log_info, log_error
+from backend.services.candle_hub import parse_candle_time, GRANULARITY_SECONDS
+from backend.services.market_data_client import fetch_latest_candles, watch_latest_candles
+
+load_dotenv()
+strategy_api_server = os.environ.get('STRATEGY_API_SERVER', 'http://localhost:5001')
+strategy_api_email = os.environ.get('STRATEGY_API_EMAIL')
+strategy_api_password = os.environ.get('STRATEGY_API_PASSWORD')
+# seconds after a candle boundary before asking for the closed candle, OANDA needs a moment to close it
+strategy_boundary_delay = float(os.environ.get('STRATEGY_BOUNDARY_DELAY', 1))
+api_request_timeout = 30
+
+# Event-driven strategies. Subclass Strategy and implement the hooks you need:
+#
+#     class Breakout(Strategy):
+#         granularity = 'H1'
+#
+#         async def on_candle(self, instrument, granularity, bar):
+#             if bar.close > self.highest:
+#                 await self.place_market_order(10000, stop_loss_price, take_profit_price)
+#
+#     run, main = entry_points(Breakout)
+#
+#     if __name__ == '__main__':
+#         main(sys.argv[1])
+#
+# on_candle is called once per closed bar. Bars come from the market data daemon's shared feed when it runs, and
+# otherwise from one request at each candle boundary, so an H1 strategy makes 24 requests a day instead of one
+# every 5 seconds. on_timer is called every timer_interval seconds if set, and on_fill with the API's response
+# whenever place_market_order gets a fill. An exception in a hook is logged and the strategy keeps running.
+# sys.exit() in a hook stops the strategy, like stop().
+# Strategy hosts and python -m backend.strategy.sdk <script> <instrument> run any script through
+# find_entry_point, which also adapts the legacy scripts (see LegacyScript).
+
+
+class Bar:
+    __slots__ = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, time, open, high, low, close, volume):
+        self.time = time
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    @classmethod
+    def from_candle(cls, candle):
+        """From an OANDA mid candle"""
+        return cls(parse_candle_time(candle['time']), float(candle['mid']['o']), float(candle['mid']['h']),
+                   float(candle['mid']['l']), float(candle['mid']['c']), int(candle['volume']))
+
+    def __repr__(self):
+        return f'Bar({self.time.isoformat()} o={self.open} h={self.high} l={self.low} c={self.close} v={self.volume})'
+
+
+def seconds_until_next_bar(candles, granularity):
+    """Seconds until the bar after the newest candle in candles closes, plus STRATEGY_BOUNDARY_DELAY"""
+    if not candles:
+        return strategy_boundary_delay
+    newest = candles[-1]
+    opens_at = parse_candle_time(newest['time'])
+    # a complete newest candle means the next one has not opened yet: wait for it to close too
+    closes_at = opens_at + datetime.timedelta(seconds=GRANULARITY_SECONDS[granularity] * (2 if newest['complete'] else 1))
+    remaining = (closes_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    if remaining <= 0 and newest['complete']:
+        # no candle where one was due: the market is closed, check back now and then
+        return min(GRANULARITY_SECONDS[granularity], 300)
+    return max(remaining, 0) + strategy_boundary_delay
+
+
+async def candle_feed(instrument, granularity):
+    """
+    Yields OANDA candles/latest entries ({'instrument', 'granularity', 'candles'}) as they change: every broadcast
+    of the market data daemon, or without one, one poll per candle boundary.
+    """
+    try:
+        async for entry in watch_latest_candles(instrument, granularity):
+            yield entry
+    except (OSError, ConnectionError, ValueError) as e:
+        # ValueError: the daemon refused or dropped the pair, polling surfaces the error if it persists
+        log_info(f'no shared feed for {instrument} {granularity}, polling at candle boundaries: {str(e)}')
+    while True:
+        data = await fetch_latest_candles(instrument, granularity)
+        entry = data['latestCandles'][0]
+        yield entry
+        await asyncio.sleep(seconds_until_next_bar(entry['candles'], granularity))
+
+
+class Strategy:
+    granularity = 'H1'
+    # seconds between on_timer calls, None for no timer
+    timer_interval = None
+
+    def __init__(self, instrument, granularity=None, **params):
+        self.instrument = instrument
+        if granularity:
+            self.granularity = granularity
+        # e.g. lookback=30 overrides the class's lookback
+        self.params = params
+        for name, value in params.items():
+            setattr(self, name, value)
+        self.client = None
+        self.token = None
+        self.last_bar_time = None
+        self.stopped = asyncio.Event()
+
+    async def on_start(self):
+        """Called once before the first bar, e.g. to warm up indicators from backend.services.candle_store"""
+
+    async def on_candle(self, instrument, granularity, bar):
+        """Called once for every bar that closes while the strategy runs"""
+
+    async def on_fill(self, fill):
+        """Called with the API's response when an order placed through place_market_order is filled"""
+
+    async def on_timer(self):
+        """Called every timer_interval seconds"""
+
+    async def on_candles(self, entry):
+        """Called with every feed update, closed or not. Turns newly closed candles into on_candle calls."""
+        complete = [candle for candle in entry['candles'] if candle['complete']]
+        if self.last_bar_time is None:
+            # only bars that close from now on
+            self.last_bar_time = complete[-1]['time'] if complete else ''
+            return
+        for candle in complete:
+            if candle['time'] > self.last_bar_time:
+                self.last_bar_time = candle['time']
+                await self.call_hook(self.on_candle, entry['instrument'], entry['granularity'],
+                                     Bar.from_candle(candle))
+
+    def stop(self):
+        self.stopped.set()
+
+    def get_script_path(self):
+        # the order endpoint finds the strategy by the script it was uploaded as
+        return os.path.abspath(inspect.getfile(type(self)))
+
+    async def get_token(self):
+        response = await self.client.post(f'{strategy_api_server}/auth/login/',
+                                          json={'email': strategy_api_email, 'password': strategy_api_password})
+        response.raise_for_status()
+        return response.json()['access']
+
+    async def place_market_order(self, units, stop_loss_price, take_profit_price):
+        """Market order with stop loss and take profit through the API. Returns True once the order is filled."""
+        if self.token is None:
+            self.token = await self.get_token()
+        data = {
+            'instrument': self.instrument,
+            'stop_loss_price': stop_loss_price,
+            'take_profit_price': take_profit_price,
+            'units': units,
+            'script_path': self.get_script_path(),
+        }
+        response = await self.client.post(f'{strategy_api_server}/api/order/oanda/create/',
+                                          headers={'Authorization': f'Bearer {self.token}'}, json=data)
+        if response.status_code == 401:
+            # access tokens last an hour, log in again once
+            self.token = await self.get_token()
+            response = await self.client.post(f'{strategy_api_server}/api/order/oanda/create/',
+                                              headers={'Authorization': f'Bearer {self.token}'}, json=data)
+        if response.status_code != 201:
+            log_error(f'order for {self.instrument} failed: {response.status_code} {response.text}',
+                      type(self).__name__)
+            return False
+        result = response.json()
+        if result.get('msg') == 'order filled':
+            await self.call_hook(self.on_fill, {**result, **data})
+            return True
+        return False
+
+    async def call_hook(self, hook, *args):
+        try:
+            await hook(*args)
+        except SystemExit:
+            # the original scripts sys.exit() once their order is placed. Raised in a task on a strategy host it
+            # would end the host's event loop and every strategy on it, so it only stops this one
+            log_info(f'{hook.__name__} exited for {self.instrument}, stopping')
+            self.stop()
+        except Exception as e:
+            log_error(f'{hook.__name__} failed for {self.instrument}: {str(e)}', type(self).__name__)
+
+    async def run_feed(self):
+        async for entry in candle_feed(self.instrument, self.granularity):
+            await self.call_hook(self.on_candles, entry)
+
+    async def run_timer(self):
+        while True:
+            await asyncio.sleep(self.timer_interval)
+            await self.call_hook(self.on_timer)
+
+
+async def run_strategy(strategy):
+    """Runs the strategy's hooks until it calls stop() or the task is cancelled"""
+    async with httpx.AsyncClient(timeout=api_request_timeout) as client:
+        strategy.client = client
+        await strategy.call_hook(strategy.on_start)
+        tasks = [asyncio.create_task(strategy.run_feed())]
+        if strategy.timer_interval:
+            tasks.append(asyncio.create_task(strategy.run_timer()))
+        stopped = asyncio.create_task(strategy.stopped.wait())
+        try:
+            done, _ = await asyncio.wait(tasks + [stopped], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not stopped and task.exception():
+                    raise task.exception()
+        finally:
+            for task in tasks + [stopped]:
+                task.cancel()
+            await asyncio.gather(*tasks, stopped, return_exceptions=True)
+
+
+def entry_points(strategy_class, **params):
+    """(run, main) for a Strategy subclass: async run(instrument_name) for strategy hosts, main for python script.py"""
+    async def run(instrument_name):
+        await run_strategy(strategy_class(instrument_name, **params))
+
+    def main(instrument_name):
+        asyncio.run(run(instrument_name))
+
+    return run, main
+
+
+class LegacyScript(Strategy):
+    """
+    Adapter for the original scripts (get_token, fetch_market_data, analyze_data_and_trade and
+    create_market_order_oanda, looping every 5 seconds in trading_loop). Instead of sleeping, the script's steps run
+    once per closed bar of GRANULARITY if the script sets it, else once a minute on the M1 close. The script
+    still fetches its own data, through the market data daemon. Like trading_loop, it stops after its first order.
+    """
+    LEGACY_FUNCTIONS = ('get_token', 'fetch_market_data', 'analyze_data_and_trade', 'create_market_order_oanda')
+
+    def __init__(self, module, instrument):
+        super().__init__(instrument, getattr(module, 'GRANULARITY', 'M1'))
+        self.module = module
+
+    @classmethod
+    def supports(cls, module):
+        return all(inspect.iscoroutinefunction(getattr(module, name, None)) for name in cls.LEGACY_FUNCTIONS)
+
+    def get_script_path(self):
+        return os.path.abspath(self.module.__file__)
+
+    async def on_candle(self, instrument, granularity, bar):
+        data = await self.module.fetch_market_data(instrument)
+        if data is None:
+            return
+        signal, stop_loss_price, take_profit, units = await self.module.analyze_data_and_trade(data)
+        if signal:
+            access_token = await self.module.get_token()
+            if await self.module.create_market_order_oanda(access_token, instrument, stop_loss_price, take_profit,
+                                                           units):
+                self.stop()
+
+
+def find_strategy_class(module):
+    """The Strategy subclass a script defines, None unless there is exactly one"""
+    strategy_classes = [value for value in vars(module).values()
+                        if inspect.isclass(value) and issubclass(value, Strategy) and value.__module__ == module.__name__]
+    return strategy_classes[0] if len(strategy_classes) == 1 else None
+
+
+def find_entry_point(module):
+    """
+    async entry_point(instrument_name) for a loaded strategy script, None if it only has a blocking main().
+    In order: run(), the script's Strategy subclass, LegacyScript, trading_loop().
+    """
+    run = getattr(module, 'run', None)
+    if inspect.iscoroutinefunction(run):
+        return run
+    strategy_class = find_strategy_class(module)
+    if strategy_class:
+        return entry_points(strategy_class)[0]
+    if LegacyScript.supports(module):
+        async def run_legacy(instrument_name):
+            await run_strategy(LegacyScript(module, instrument_name))
+        return run_legacy
+    trading_loop = getattr(module, 'trading_loop', None)
+    if inspect.iscoroutinefunction(trading_loop):
+        return trading_loop
+    return None
+
+
+def load_script(script_path, module_name):
+    spec = importlib.util.spec_from_file_location(module_name, script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+if __name__ == '__main__':
+    # python -m backend.strategy.sdk <script.py> <instrument_name>
+    if len(sys.argv) < 3:
+        print('Usage: python -m backend.strategy.sdk <script.py> <instrument_name>')
+        sys.exit(1)
+    script = load_script(sys.argv[1], 'strategy_script')
+    entry_point = find_entry_point(script)
+    if entry_point is None:
+        script.main(sys.argv[2])
+    else:
+        asyncio.run(entry_point(sys.argv[2]))
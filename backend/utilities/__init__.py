@@ -1 +1,2 @@
-from .logger import get_function_name, log_info, log_error, log_warning
\ No newline at end of file
+from .logger import get_function_name, log_info, log_error, log_warning
+from .single_flight import SingleFlight
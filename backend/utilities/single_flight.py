@@ -0,0 +1,36 @@
+import threading
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one. The first caller (the leader) runs the function,
+    callers arriving while it is in flight wait for it and receive the leader's result (or exception).
+    run() returns (result, ran) where ran is False for callers that piggybacked on the leader.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def run(self, key, function, *args, **kwargs):
+        with self.lock:
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = {'done': threading.Event(), 'result': None, 'error': None}
+                self.in_flight[key] = flight
+        if not leader:
+            flight['done'].wait()
+            if flight['error']:
+                raise flight['error']
+            return flight['result'], False
+        try:
+            flight['result'] = function(*args, **kwargs)
+            return flight['result'], True
+        except BaseException as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            flight['done'].set()
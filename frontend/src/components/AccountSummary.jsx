@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useContext } from "react";
 import styles from "./AccountSummary.module.css";
 import useFetch from "../hooks/useFetch";
+import useLiveUpdates from "../hooks/useLiveUpdates";
 import AppContext from "../context/AppContext";
 
 const AccountSummary = () => {
@@ -25,6 +26,11 @@ const AccountSummary = () => {
     getSummary();
   }, []);
 
+  useLiveUpdates(appCtx.accessToken, {
+    summary: (diff) =>
+      setSummary((prevSummary) => ({ ...prevSummary, ...diff.changed })),
+  });
+
   return (
     <div className={`container-fluid ${styles.container}`}>
       <div className={`row ${styles.subheader}`}>
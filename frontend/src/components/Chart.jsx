@@ -204,24 +204,24 @@ const Chart = (props) => {
     },
   };
 
-  const processData = (rawData) => {
+  const processData = (candles) => {
     let categoryData = [];
     let values = [];
     let volumes = [];
 
-    for (let i = 0; i < rawData.candles.length; i++) {
+    for (let i = 0; i < candles.length; i++) {
       let value = [
-        rawData.candles[i].mid.o,
-        rawData.candles[i].mid.c,
-        rawData.candles[i].mid.l,
-        rawData.candles[i].mid.h,
+        candles[i].mid.o,
+        candles[i].mid.c,
+        candles[i].mid.l,
+        candles[i].mid.h,
       ];
-      categoryData.push(rawData.candles[i].time);
+      categoryData.push(candles[i].time);
       values.push(value);
       volumes.push([
         i,
-        rawData.candles[i].volume,
-        rawData.candles[i].mid.c >= rawData.candles[i].mid.o ? 1 : -1,
+        candles[i].volume,
+        candles[i].mid.c >= candles[i].mid.o ? 1 : -1,
       ]);
     }
     return {
@@ -231,109 +231,52 @@ const Chart = (props) => {
     };
   };
 
-  const updateLatestCandles = (RawData, latestCandlesData) => {
-    const CandlesData = structuredClone(RawData);
-    for (const candle of latestCandlesData) {
-      let isInCandlesData = false;
-      for (let i = CandlesData.candles.length - 1; i >= 0; i--) {
-        if (JSON.stringify(candle) === JSON.stringify(CandlesData.candles[i])) {
-          isInCandlesData = true;
-        }
-      }
-      if (!isInCandlesData) {
-        CandlesData.candles.push(candle);
-      }
+  // Later stream events repeat the last candle we have (it may still be forming) followed by any newer ones
+  const mergeCandles = (candles, latestCandles) => {
+    if (!latestCandles.length) {
+      return candles;
     }
-    return CandlesData;
+    const firstTime = latestCandles[0].time;
+    const kept = candles.filter((candle) => candle.time < firstTime);
+    return [...kept, ...latestCandles].slice(-Number(props.count || 500));
   };
 
-  const getData = async (signal) => {
-    try {
-      if (!props.selectedInstrument) {
-        return;
-      }
-      setIsLoading(true);
-      let url1 = `${import.meta.env.VITE_FXPRACTICE_OANDA}/v3/instruments/${
-        props.selectedInstrument.name
-      }/candles`;
-
-      if (props.granularity || props.count || props.from || props.to) {
-        url1 = url1.concat("?");
-      }
-
-      props.granularity
-        ? (url1 = url1.concat(`&granularity=${props.granularity}`))
-        : "";
-      props.count ? (url1 = url1.concat(`&count=${props.count}`)) : "";
-      props.from ? (url1 = url1.concat(`&from=${props.from}`)) : "";
-      props.to ? (url1 = url1.concat(`&to=${props.to}`)) : "";
-
-      let url2 = `${import.meta.env.VITE_FXPRACTICE_OANDA}/v3/accounts/${
-        import.meta.env.VITE_OANDA_ACCOUNT
-      }/candles/latest?candleSpecifications=${props.selectedInstrument.name}:${
-        props.granularity
-      }:M`;
-
-      const res1 = await fetch(url1, {
-        signal,
-        headers: {
-          Authorization: "Bearer " + import.meta.env.VITE_OANDA_DEMO_API_KEY,
-          Connection: "Keep-Alive",
-        },
-      });
-
-      const res2 = await fetch(url2, {
-        signal,
-        headers: {
-          Authorization: "Bearer " + import.meta.env.VITE_OANDA_DEMO_API_KEY,
-          Connection: "Keep-Alive",
-        },
-      });
-
-      if (res1.ok && res2.ok) {
-        const data1 = await res1.json();
-        const data2 = await res2.json();
-        const latestCandles = data2.latestCandles[0].candles;
-        const updatedData = updateLatestCandles(data1, latestCandles);
-        const processedData = processData(updatedData);
+  useEffect(() => {
+    if (!props.selectedInstrument || !AppCtx.accessToken) {
+      return;
+    }
+    setIsLoading(true);
+    let candles = [];
+    let params = `granularity=${props.granularity || "H1"}`;
+    props.count ? (params = params.concat(`&count=${props.count}`)) : "";
 
-        setValues(processedData.values);
-        setVolume(processedData.volumes);
-        setDateTimes(processedData.categoryData);
-        setIsLoading(false);
-      }
-    } catch (error) {
-      if (error.name !== "AbortError") {
-        console.log(error.message);
+    // one shared upstream feed on the server, however many charts are open
+    const source = new EventSource(
+      `${import.meta.env.VITE_SERVER}/api/candles/${
+        props.selectedInstrument.name
+      }/stream/?${params}&jwt=${encodeURIComponent(AppCtx.accessToken)}`
+    );
+    source.addEventListener("candles", (e) => {
+      candles = mergeCandles(candles, JSON.parse(e.data).candles);
+      const processedData = processData(candles);
+      setValues(processedData.values);
+      setVolume(processedData.volumes);
+      setDateTimes(processedData.categoryData);
+      setIsLoading(false);
+    });
+    source.onerror = () => {
+      // EventSource reconnects by itself, only report a stream that never opened
+      if (source.readyState === EventSource.CLOSED) {
         AppCtx.setIsError(true);
-        AppCtx.setErrorMessage(error.message);
+        AppCtx.setErrorMessage("Unable to load candles");
+        setIsLoading(false);
       }
-      setIsLoading(false);
-    }
-  };
-
-  useEffect(() => {
-    const controller = new AbortController();
-    getData(controller.signal);
-
-    return () => {
-      controller.abort();
     };
-  }, []);
 
-  useEffect(() => {
-    const controller = new AbortController();
-    getData(controller.signal);
     return () => {
-      controller.abort();
+      source.close();
     };
-  }, [
-    props.selectedInstrument,
-    props.granularity,
-    props.count,
-    props.from,
-    props.to,
-  ]);
+  }, [props.selectedInstrument, props.granularity, props.count]);
 
   return (
     <div className={`container-fluid py-3 ${styles.chartContainer}`}>
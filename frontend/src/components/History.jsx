@@ -6,18 +6,23 @@ import AppContext from "../context/AppContext";
 const History = () => {
   const fetchData = useFetch();
   const [closedTrades, setClosedTrades] = useState();
+  const [nextCursor, setNextCursor] = useState(null);
   const appCtx = useContext(AppContext);
 
-  const getClosedTrades = async () => {
+  const getClosedTrades = async (cursor) => {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
     const res = await fetchData(
-      "/api/tradesMenu/history/",
+      "/api/tradesMenu/history/" + query,
       "GET",
       undefined,
       appCtx.accessToken
     );
 
     if (res.ok) {
-      setClosedTrades(res.data.history);
+      setClosedTrades((prevTrades) =>
+        cursor ? [...(prevTrades || []), ...res.data.history] : res.data.history
+      );
+      setNextCursor(res.data.next_cursor);
     }
   };
 
@@ -73,6 +78,16 @@ const History = () => {
             </div>
           );
         })}
+      {nextCursor && (
+        <div className="row">
+          <button
+            className={`btn ${styles.loadMore}`}
+            onClick={() => getClosedTrades(nextCursor)}
+          >
+            Load more
+          </button>
+        </div>
+      )}
     </div>
   );
 };
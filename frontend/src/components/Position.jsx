@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useContext } from "react";
 import styles from "./Position.module.css";
 import useFetch from "../hooks/useFetch";
+import useLiveUpdates, { applyRowsDiff } from "../hooks/useLiveUpdates";
 import AppContext from "../context/AppContext";
 
 const Position = () => {
@@ -25,6 +26,11 @@ const Position = () => {
     getPositions();
   }, []);
 
+  useLiveUpdates(appCtx.accessToken, {
+    positions: (diff) =>
+      setPositions((prevPositions) => applyRowsDiff(prevPositions, diff)),
+  });
+
   return (
     <div className={`container-fluid ${styles.container}`}>
       <div className={`row ${styles.subheader}`}>
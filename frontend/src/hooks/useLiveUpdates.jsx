@@ -0,0 +1,98 @@
+import { useEffect } from "react";
+
+// One update stream per tab, shared by every component that subscribes: each EventSource holds a server
+// thread for as long as it is open. The stream sends the full state once when it connects, so the shared
+// connection keeps a snapshot per event to give components that subscribe later the same starting point.
+let shared = null;
+// every event /api/stream/ sends, recorded from the start so late subscribers get a snapshot of each
+const STREAM_EVENTS = ["summary", "positions", "strategies", "traders"];
+
+// Applies a {key, upserted, removed} diff to a list of rows
+export const applyRowsDiff = (rows, diff) => {
+  const upserted = new Map(diff.upserted.map((row) => [row[diff.key], row]));
+  const kept = (rows || [])
+    .filter((row) => !diff.removed.includes(row[diff.key]))
+    .map((row) => upserted.get(row[diff.key]) || row);
+  const existing = new Set(kept.map((row) => row[diff.key]));
+  return [...kept, ...diff.upserted.filter((row) => !existing.has(row[diff.key]))];
+};
+
+// The snapshot as the event a new subscriber would have got first
+const snapshotEvent = (snapshot) =>
+  snapshot.rows
+    ? { key: snapshot.key, upserted: snapshot.rows, removed: [] }
+    : { changed: snapshot.changed };
+
+const openStream = (token) => {
+  const stream = {
+    token,
+    handlers: new Map(),
+    snapshots: new Map(),
+    // events whose next message is a full state again, after a reconnect
+    resyncing: new Set(),
+    opened: false,
+  };
+  stream.source = new EventSource(
+    import.meta.env.VITE_SERVER + "/api/stream/?jwt=" + encodeURIComponent(token)
+  );
+  stream.source.addEventListener("open", () => {
+    if (stream.opened) stream.snapshots.forEach((_, event) => stream.resyncing.add(event));
+    stream.opened = true;
+  });
+  STREAM_EVENTS.forEach((event) => {
+    stream.source.addEventListener(event, (e) => {
+      let data = JSON.parse(e.data);
+      const snapshot = stream.snapshots.get(event);
+      if (data.key !== undefined) {
+        if (snapshot && stream.resyncing.has(event)) {
+          // a full state after a reconnect: rows that are gone were deleted while disconnected
+          const current = new Set(data.upserted.map((row) => row[data.key]));
+          data = {
+            ...data,
+            removed: snapshot.rows.map((row) => row[data.key]).filter((id) => !current.has(id)),
+          };
+        }
+        stream.snapshots.set(event, {
+          key: data.key,
+          rows: applyRowsDiff(snapshot ? snapshot.rows : [], data),
+        });
+      } else {
+        stream.snapshots.set(event, {
+          changed: { ...(snapshot ? snapshot.changed : {}), ...data.changed },
+        });
+      }
+      stream.resyncing.delete(event);
+      (stream.handlers.get(event) || new Set()).forEach((handler) => handler(data));
+    });
+  });
+  return stream;
+};
+
+// Subscribes to the server-sent update stream. handlers: { eventName: (data) => {} }
+// The first event of each kind carries the full state, later ones only what changed.
+const useLiveUpdates = (token, handlers) => {
+  useEffect(() => {
+    if (!token) return;
+    if (!shared || shared.token !== token) {
+      if (shared) shared.source.close();
+      shared = openStream(token);
+    }
+    const stream = shared;
+    const entries = Object.entries(handlers);
+    entries.forEach(([event, handler]) => {
+      if (!stream.handlers.has(event)) stream.handlers.set(event, new Set());
+      stream.handlers.get(event).add(handler);
+      const snapshot = stream.snapshots.get(event);
+      if (snapshot) handler(snapshotEvent(snapshot));
+    });
+    return () => {
+      entries.forEach(([event, handler]) => stream.handlers.get(event).delete(handler));
+      if ([...stream.handlers.values()].every((set) => set.size === 0)) {
+        stream.source.close();
+        if (shared === stream) shared = null;
+      }
+    };
+  }, [token]);
+};
+
+export default useLiveUpdates;